@@ -0,0 +1,202 @@
+"""
+Backend benchmark: ChunkedProcessor and a local-mode SparkProcessor on a synthetic hit log.
+
+    python benchmarks/bench_backends.py [--rows N] [--backends chunked,spark] [--output bench.json]
+                                        [--input hits.tsv] [generator knobs, see synthetic.py --help]
+
+Every backend runs in a child process of its own, so peak RSS is per backend (the Spark JVM is
+reported separately). The result is one JSON document: input description, then per backend the
+wall time, rows/sec, peak RSS, the per-stage times and counters the processor's own Metrics
+recorded during that run, and for Spark the stages from the Spark UI REST API.
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from benchmarks.synthetic import add_spec_arguments, spec_from_args, write_hit_log
+
+BACKENDS = ("chunked", "parallel", "vectorized", "spark")
+
+
+def _timed(stages: dict, name: str, fn):
+    start = time.perf_counter()
+    result = fn()
+    stages[name] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def _peak_rss_mb(status_path: str) -> float | None:
+    # VmHWM is the peak resident set of a live process (Linux only)
+    try:
+        with open(status_path) as fh:
+            for line in fh:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def run_backend(backend: str, path: str) -> dict:
+    """Runs one backend end to end (process + report) in this process and returns its timings."""
+    stages: dict[str, float] = {}
+    out_dir = tempfile.mkdtemp(prefix="bench_report_")
+    result: dict = {"backend": backend}
+    try:
+        if backend == "spark":
+            from src.spark_processor import SparkProcessor, _stage_ids, _stage_metrics
+            spark = _timed(stages, "session", SparkProcessor._get_session)
+            before = _stage_ids(spark)
+            processor = SparkProcessor(path)
+            # attribution, aggregation and the report all run on the executors
+            _timed(stages, "process_and_write", lambda: processor.write(out_dir))
+            result["spark_stages"] = [
+                {
+                    "stage_id": s["stageId"],
+                    "name": s.get("name", ""),
+                    "num_tasks": s.get("numTasks", 0),
+                    "executor_run_ms": s.get("executorRunTime", 0),
+                    "input_records": s.get("inputRecords", 0),
+                    "shuffle_write_bytes": s.get("shuffleWriteBytes", 0),
+                }
+                for s in sorted(_stage_metrics(spark), key=lambda s: s["stageId"])
+                if s["stageId"] not in before
+            ]
+            gateway = getattr(spark.sparkContext._gateway, "proc", None)
+            if gateway is not None:
+                result["jvm_peak_rss_mb"] = _peak_rss_mb(f"/proc/{gateway.pid}/status")
+            spark.stop()
+        else:
+            from src.writer import write_output
+            if backend == "chunked":
+                from src.processor import ChunkedProcessor
+                processor = ChunkedProcessor(path)
+            elif backend == "parallel":
+                from src.processor import ParallelProcessor
+                processor = ParallelProcessor(path)
+            else:
+                from src.vectorized_processor import VectorizedProcessor
+                processor = VectorizedProcessor(path)
+            revenue_map = _timed(stages, "process", processor.process)
+            _timed(stages, "write", lambda: write_output(revenue_map, out_dir))
+            result["keywords"] = len(revenue_map)
+        # read / parse / attribute ... as the processor itself timed them during the measured run
+        result["processor_stages"] = {name: round(seconds, 3) for name, seconds in processor.metrics.stages.items()}
+        result["counters"] = dict(processor.metrics.counters)
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+    result["stages"] = stages
+    result["seconds"] = round(sum(v for k, v in stages.items() if k != "session"), 3)
+    result["python_peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return result
+
+
+def run_in_child(backend: str, path: str, rows: int) -> dict:
+    cmd = [sys.executable, __file__, "--run-one", backend, "--input", path]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    out = proc.stdout.read()
+    # wait4 reports the peak RSS of the child and of any descendants it reaped
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode != 0:
+        return {"backend": backend, "error": f"exit code {proc.returncode}"}
+    result = json.loads(out.strip().splitlines()[-1])
+    result["peak_rss_mb"] = round(usage.ru_maxrss / 1024, 1)
+    result["rows_per_sec"] = round(rows / result["seconds"]) if result["seconds"] else None
+    return result
+
+
+def _count_rows(path: str) -> int:
+    with open(path, "rb") as fh:
+        return max(sum(chunk.count(b"\n") for chunk in iter(lambda: fh.read(1 << 20), b"")) - 1, 0)
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=PROJECT_ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", default="chunked,spark", help=f"comma separated, from {', '.join(BACKENDS)}")
+    parser.add_argument("--input", help="benchmark an existing hit log instead of generating one")
+    parser.add_argument("--output", help="write the JSON here instead of stdout")
+    parser.add_argument("--keep-input", action="store_true", help="keep the generated hit log")
+    parser.add_argument("--run-one", choices=BACKENDS, help=argparse.SUPPRESS)
+    add_spec_arguments(parser)
+    args = parser.parse_args()
+
+    if args.run_one:
+        import logging
+        logging.basicConfig(level=logging.WARNING)
+        print(json.dumps(run_backend(args.run_one, args.input)))
+        return
+
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    unknown = set(backends) - set(BACKENDS)
+    if unknown:
+        parser.error(f"unknown backends: {', '.join(sorted(unknown))}")
+
+    spec = None
+    generate_seconds = None
+    if args.input:
+        path = args.input
+        rows = _count_rows(path)
+    else:
+        spec = spec_from_args(args)
+        fd, path = tempfile.mkstemp(prefix="bench_hits_", suffix=".tsv")
+        os.close(fd)
+        start = time.perf_counter()
+        write_hit_log(path, spec)
+        generate_seconds = round(time.perf_counter() - start, 3)
+        rows = spec.rows
+
+    try:
+        report = {
+            "benchmark": "backends",
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "input": {
+                "path": path if args.input or args.keep_input else None,
+                "rows": rows,
+                "bytes": os.path.getsize(path),
+                "spec": vars(spec) if spec else None,
+                "generate_seconds": generate_seconds,
+            },
+            "results": [run_in_child(backend, path, rows) for backend in backends],
+        }
+    finally:
+        if not args.input and not args.keep_input:
+            os.unlink(path)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            fh.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
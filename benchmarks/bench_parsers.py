@@ -0,0 +1,77 @@
+"""
+Parser microbenchmark: parse_revenue / parse_revenue_batch vs the old split()-based version.
+
+    python benchmarks/bench_parsers.py [rows]
+
+The row mix is ~95% non-purchase hits, like the real logs.
+"""
+from __future__ import annotations
+import random
+import sys
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from src.config import PRODUCT_REVENUE_IDX, PURCHASE_EVENT
+from src.parsers import parse_revenue, parse_revenue_batch
+
+
+def split_parse_revenue(product_list: str | None, event_list: str | None) -> float:
+    # the previous implementation, kept here as the baseline
+    if PURCHASE_EVENT not in {e.strip() for e in (event_list or "").split(",") if e.strip()}:
+        return 0.0
+    if not product_list:
+        return 0.0
+    total = 0.0
+    for product in product_list.split(","):
+        fields = product.split(";")
+        if len(fields) > PRODUCT_REVENUE_IDX:
+            raw = fields[PRODUCT_REVENUE_IDX].strip()
+            if raw:
+                try:
+                    total += float(raw)
+                except ValueError:
+                    pass
+    return total
+
+
+def make_rows(n: int) -> tuple[list[str], list[str]]:
+    rnd = random.Random(7)
+    products, events = [], []
+    for _ in range(n):
+        if rnd.random() < 0.05:
+            events.append("1")
+            products.append("Electronics;Ipod - Nano - 8GB;1;190;,Electronics;Case;1;;")
+        else:
+            events.append(rnd.choice(["", "2", "2,12", "12,10"]))
+            products.append(rnd.choice(["", "Electronics;Zune - 32GB;1;;"]))
+    return products, events
+
+
+def rate(fn, n: int, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return n / best
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    products, events = make_rows(n)
+
+    base = rate(lambda: [split_parse_revenue(p, e) for p, e in zip(products, events)], n)
+    row = rate(lambda: [parse_revenue(p, e) for p, e in zip(products, events)], n)
+    batch = rate(lambda: parse_revenue_batch(products, events), n)
+
+    print(f"rows                : {n:,}")
+    print(f"split() baseline    : {base:,.0f} rows/sec")
+    print(f"parse_revenue       : {row:,.0f} rows/sec  ({row / base:.2f}x)")
+    print(f"parse_revenue_batch : {batch:,.0f} rows/sec  ({batch / base:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Reader benchmark: csv.DictReader rows vs the column-projected tuple batches.
+
+    python benchmarks/bench_reader.py [rows]
+
+Both paths pull the four attribution columns and strip them, like ChunkedProcessor does.
+"""
+from __future__ import annotations
+import csv
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from src.config import CHUNK_SIZE, TSV_DELIMITER
+from src.processor import HIT_COLUMNS
+from src.readers import iter_projected_chunks
+
+FIELDS = [
+    "hit_time_gmt", "date_time", "user_agent", "ip", "event_list",
+    "geo_city", "geo_region", "geo_country", "pagename",
+    "page_url", "product_list", "referrer",
+]
+
+
+def make_file(rows: int) -> str:
+    rnd = random.Random(42)
+    f = tempfile.NamedTemporaryFile(mode="w", suffix=".tsv", delete=False, encoding="utf-8", newline="")
+    writer = csv.writer(f, delimiter=TSV_DELIMITER)
+    writer.writerow(FIELDS)
+    for i in range(rows):
+        purchase = rnd.random() < 0.05
+        writer.writerow([
+            1254033280 + i, "2009-09-27 06:34:40",
+            "Mozilla/5.0 (Windows; U; Windows NT 5.1; en-US; rv:1.9.0.10) Gecko/2009042316 Firefox/3.0.10",
+            f"10.{rnd.randrange(256)}.{rnd.randrange(256)}.{rnd.randrange(256)}",
+            "1" if purchase else "2,12", "Salem", "OR", "US", "Home",
+            "http://www.esshopzilla.com/product/?pid=as32213",
+            "Electronics;Ipod - Nano - 8GB;1;190;" if purchase else "",
+            rnd.choice([
+                "http://www.google.com/search?hl=en&q=Ipod&aq=f",
+                "http://www.esshopzilla.com/cart/",
+                "http://search.yahoo.com/search?p=cd+player",
+            ]),
+        ])
+    f.close()
+    return f.name
+
+
+def dictreader_path(path: str) -> int:
+    n = 0
+    with open(path, encoding="utf-8", errors="replace") as fh:
+        for row in csv.DictReader(fh, delimiter=TSV_DELIMITER):
+            ip           = (row.get("ip")           or "").strip()
+            referrer     = (row.get("referrer")     or "").strip()
+            event_list   = (row.get("event_list")   or "").strip()
+            product_list = (row.get("product_list") or "").strip()
+            n += 1
+    return n
+
+
+def projected_path(path: str) -> int:
+    n = 0
+    for chunk in iter_projected_chunks(path, HIT_COLUMNS, CHUNK_SIZE):
+        for _, ip, referrer, event_list, product_list in chunk:
+            ip, referrer = ip.strip(), referrer.strip()
+            event_list, product_list = event_list.strip(), product_list.strip()
+            n += 1
+    return n
+
+
+def bench(fn, path: str, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = fn(path)
+        best = min(best, time.perf_counter() - start)
+    return rows / best
+
+
+def main() -> None:
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    path = make_file(rows)
+    try:
+        base = bench(dictreader_path, path)
+        fast = bench(projected_path, path)
+    finally:
+        os.unlink(path)
+    print(f"rows            : {rows:,}")
+    print(f"DictReader      : {base:,.0f} rows/sec")
+    print(f"projected tuples: {fast:,.0f} rows/sec  ({fast / base:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
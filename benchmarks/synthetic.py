@@ -0,0 +1,175 @@
+"""
+Synthetic hit-log generator for the backend benchmarks, in the data.sql / _make_tsv column layout.
+
+    python benchmarks/synthetic.py out.tsv --rows 10000000 [--ips N] [--search-ratio R] ...
+
+Output is deterministic for a given seed and set of knobs. Rows come in hit_time_gmt order over
+--days days, so the data attributes the same way on every backend.
+"""
+from __future__ import annotations
+import argparse
+import bisect
+import itertools
+import random
+import sys
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from src.config import TSV_DELIMITER
+
+FIELDS = [
+    "hit_time_gmt", "date_time", "user_agent", "ip", "event_list",
+    "geo_city", "geo_region", "geo_country", "pagename",
+    "page_url", "product_list", "referrer",
+]
+
+# (search url prefix, share of searches); the prefix ends with the keyword parameter
+ENGINES = [
+    ("http://www.google.com/search?hl=en&client=firefox-a&q=", 0.60),
+    ("http://www.bing.com/search?form=QBLH&q=", 0.20),
+    ("http://search.yahoo.com/search?fr=yfp-t-701&p=", 0.15),
+    ("https://duckduckgo.com/?t=h_&q=", 0.05),
+]
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows; U; Windows NT 5.1; en-US; rv:1.9.0.10) Gecko/2009042316 Firefox/3.0.10",
+    "Mozilla/5.0 (Macintosh; U; Intel Mac OS X 10_4_11; en) AppleWebKit/525.27.1 (KHTML, like Gecko) "
+    "Version/3.2.1 Safari/525.27.1",
+    "Mozilla/4.0 (compatible; MSIE 7.0; Windows NT 5.1; .NET CLR 2.0.50727)",
+]
+GEOS = [("Salem", "OR", "US"), ("Rochester", "NY", "US"), ("Duncan", "OK", "US"), ("Austin", "TX", "US")]
+PAGES = [
+    ("Home", "http://www.esshopzilla.com"),
+    ("Hot Buys", "http://www.esshopzilla.com/hotbuys/"),
+    ("Search Results", "http://www.esshopzilla.com/search/?k=ipod"),
+    ("Shopping Cart", "http://www.esshopzilla.com/cart/"),
+]
+BROWSE_EVENTS = ["", "", "2", "12", "2,12"]
+START_TIME = 1254033280
+# most purchases come from an IP that searched shortly before, the rest are direct / returning visits
+FUNNEL_SHARE = 0.8
+RECENT_SEARCHERS = 1_000
+
+
+@dataclass
+class HitLogSpec:
+    rows: int = 1_000_000
+    ips: int = 100_000               # distinct client IPs
+    search_ratio: float = 0.15       # hits that arrive from a search engine results page
+    purchase_ratio: float = 0.02     # hits that carry a purchase event
+    keywords: int = 50_000           # distinct search phrases
+    zipf_s: float = 1.1              # keyword popularity skew, P(rank k) ~ 1 / k^s
+    heavy_ips: int = 10              # bots / NAT gateways ...
+    heavy_share: float = 0.05        # ... that together send this share of all hits
+    days: float = 1.0                # hit_time_gmt span of the log
+    seed: int = 42
+
+
+def _ip(n: int) -> str:
+    return f"{(n >> 24) & 255}.{(n >> 16) & 255}.{(n >> 8) & 255}.{n & 255}"
+
+
+def _keyword(rank: int) -> str:
+    return f"product {rank}" if rank % 3 else f"cheap product {rank}"
+
+
+def generate(spec: HitLogSpec):
+    """Yields the data lines (no header) of a hit log following `spec`."""
+    rnd = random.Random(spec.seed)
+    # IPs are spread over the address space from a fixed offset, heavy hitters come first
+    ip_base = 0x0A000000
+    heavy = [_ip(ip_base + i) for i in range(spec.heavy_ips)]
+    zipf = list(itertools.accumulate(1.0 / (k ** spec.zipf_s) for k in range(1, spec.keywords + 1)))
+    engines = list(itertools.accumulate(share for _, share in ENGINES))
+    span = spec.days * 86_400
+    purchase_cut = spec.purchase_ratio
+    search_cut = spec.purchase_ratio + spec.search_ratio
+
+    recent: list[str] = []
+    last_second, date_time = None, ""
+    for i in range(spec.rows):
+        hit_time = START_TIME + int(i * span / spec.rows)
+        if hit_time != last_second:
+            last_second = hit_time
+            date_time = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(hit_time))
+
+        if heavy and rnd.random() < spec.heavy_share:
+            ip = heavy[rnd.randrange(len(heavy))]
+        else:
+            ip = _ip(ip_base + spec.heavy_ips + rnd.randrange(spec.ips))
+
+        roll = rnd.random()
+        product_list = ""
+        if roll < purchase_cut:
+            if recent and rnd.random() < FUNNEL_SHARE:
+                ip = recent[rnd.randrange(len(recent))]
+            rank = bisect.bisect(zipf, rnd.random() * zipf[-1]) + 1
+            event_list = rnd.choice(["1", "1,2"])
+            revenue = f"{rnd.randrange(1, 500)}.{rnd.randrange(100):02d}"
+            product_list = f"Electronics;{_keyword(rank).title()};1;{revenue};"
+            referrer = "http://www.esshopzilla.com/checkout/?a=confirm"
+        elif roll < search_cut:
+            rank = bisect.bisect(zipf, rnd.random() * zipf[-1]) + 1
+            engine = bisect.bisect(engines, rnd.random() * engines[-1])
+            event_list = ""
+            referrer = ENGINES[min(engine, len(ENGINES) - 1)][0] + _keyword(rank).replace(" ", "+")
+            if len(recent) < RECENT_SEARCHERS:
+                recent.append(ip)
+            else:
+                recent[rnd.randrange(RECENT_SEARCHERS)] = ip
+        else:
+            event_list = rnd.choice(BROWSE_EVENTS)
+            referrer = rnd.choice(PAGES)[1]
+
+        pagename, page_url = rnd.choice(PAGES)
+        city, region, country = rnd.choice(GEOS)
+        yield TSV_DELIMITER.join((
+            str(hit_time), date_time, rnd.choice(USER_AGENTS), ip, event_list,
+            city, region, country, pagename, page_url, product_list, referrer,
+        ))
+
+
+def write_hit_log(path: str, spec: HitLogSpec) -> int:
+    """Writes a hit log to `path` and returns its size in bytes."""
+    with open(path, "w", encoding="utf-8", newline="") as fh:
+        fh.write(TSV_DELIMITER.join(FIELDS) + "\n")
+        batch = []
+        for line in generate(spec):
+            batch.append(line)
+            if len(batch) >= 10_000:
+                fh.write("\n".join(batch) + "\n")
+                batch.clear()
+        if batch:
+            fh.write("\n".join(batch) + "\n")
+        return fh.tell()
+
+
+def add_spec_arguments(parser: argparse.ArgumentParser) -> None:
+    for name, default in asdict(HitLogSpec()).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(default), default=default)
+
+
+def spec_from_args(args: argparse.Namespace) -> HitLogSpec:
+    return HitLogSpec(**{name: getattr(args, name) for name in asdict(HitLogSpec())})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output")
+    add_spec_arguments(parser)
+    args = parser.parse_args()
+    spec = spec_from_args(args)
+
+    start = time.perf_counter()
+    size = write_hit_log(args.output, spec)
+    elapsed = time.perf_counter() - start
+    print(f"rows      : {spec.rows:,}")
+    print(f"bytes     : {size:,}")
+    print(f"generated : {spec.rows / elapsed:,.0f} rows/sec")
+
+
+if __name__ == "__main__":
+    main()
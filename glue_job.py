@@ -6,7 +6,6 @@ import sys
 from awsglue.utils import getResolvedOptions
 
 from src.spark_processor import SparkProcessor
-from src.writer import write_output
 
 logging.basicConfig(
     level=logging.INFO,
@@ -19,9 +18,8 @@ def run(input_path: str, output_path: str) -> None:
     processor = SparkProcessor(input_path)
     logger.info("Starting Glue job | input=%s | output=%s", input_path, output_path)
 
-    revenue_map = processor.process()
-
-    result = write_output(revenue_map, output_path)
+    # the executors write the report; nothing is collected into a driver-side dict
+    result = processor.write(output_path)
     logger.info("Glue job complete → %s", result)
 
 
@@ -50,7 +50,7 @@ echo "[3/6] Checking dependencies..."
 if [ "$PROCESSOR" = "spark" ]; then
     pip3 install --quiet pyspark && echo "PySpark ready."
 else
-    echo "Chunked backend — no extra dependencies."
+    pip3 install --quiet boto3 && echo "Chunked backend — boto3 ready for streaming from S3."
 fi
 
 # 4. Working directory
@@ -60,14 +60,21 @@ SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 cp -r "$SCRIPT_DIR/../src"     "$WORK_DIR/src"
 cp    "$SCRIPT_DIR/../main.py" "$WORK_DIR/main.py"
 
-# 5. Download input from S3
-echo "[5/6] Downloading from S3..."
-aws s3 cp "$INPUT_PATH" "$WORK_DIR/data.sql" --region "$REGION"
+# 5. Input: the chunked backend streams s3:// directly with ranged GETs, other backends need a local copy
+# compressed logs (.gz / .bz2 / .zst) are used as-is, main.py decompresses while it parses
+if [ "$PROCESSOR" = "chunked" ]; then
+    echo "[5/6] Streaming input straight from S3..."
+    INPUT_FILE="$INPUT_PATH"
+else
+    echo "[5/6] Downloading from S3..."
+    INPUT_FILE="$(basename "$INPUT_PATH")"
+    aws s3 cp "$INPUT_PATH" "$WORK_DIR/$INPUT_FILE" --region "$REGION"
+fi
 
 # 6. Run
 echo "[6/6] Running analyzer..."
 cd "$WORK_DIR"
-PROCESSOR="$PROCESSOR" python3 main.py data.sql
+PROCESSOR="$PROCESSOR" python3 main.py "$INPUT_FILE"
 
 # 7. Upload output
 echo "Uploading output to S3..."
@@ -0,0 +1,33 @@
+from __future__ import annotations
+import logging
+import os
+import sys
+
+from src.columnar import ingest
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+)
+
+# One-off conversion of raw hit logs into the columnar dataset that main.py reads much faster:
+#   python ingest.py data/data.sql data/hits_dataset
+#   python main.py data/hits_dataset
+# The input can be anything main.py accepts locally: a file, a directory, a quoted glob or a manifest.
+
+
+def main() -> None:
+    if len(sys.argv) != 3:
+        print(f"python ingest.py data{os.sep}data.sql data{os.sep}hits_dataset")
+        sys.exit(1)
+    input_path, dataset_dir = sys.argv[1], sys.argv[2]
+    try:
+        manifest = ingest(input_path, dataset_dir)
+    except ValueError as exc:
+        print(f"\nError: {exc}")
+        sys.exit(1)
+    print(f"Dataset: {dataset_dir} ({manifest['kept_rows']:,} of {manifest['rows']:,} rows kept)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,13 @@
 from __future__ import annotations
+import glob
 import logging
 import os
 import sys
 
-from src.writer import write_output
+from src import config
+from src.readers import resolve_inputs
+from src.s3 import is_s3
+from src.writer import sidecar_path, write_metrics, write_output
 
 logging.basicConfig(
     level=logging.INFO,
@@ -11,12 +15,23 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-PROCESSOR = os.getenv("PROCESSOR", "chunked")
+PROCESSOR = os.getenv("PROCESSOR", "chunked")   # chunked | parallel | spark | auto (by input size)
+WORKERS   = int(os.getenv("WORKERS", "0"))   # >1 switches the chunked backend to parallel
+CHECKPOINT = os.getenv("CHECKPOINT", "")      # checkpoint file, resumes the chunked backend incrementally
+TOP_K       = int(os.getenv("TOP_K", str(config.TOP_K)))                  # keywords kept per engine, 0 = all
+MIN_REVENUE = float(os.getenv("MIN_REVENUE", str(config.MIN_REVENUE)))    # rows below this are dropped
+# seconds a search stays creditable for a purchase, 0 = no limit
+ATTRIBUTION_WINDOW = int(os.getenv("ATTRIBUTION_WINDOW", str(config.ATTRIBUTION_WINDOW_SECONDS)))
+ORDER = os.getenv("ORDER", config.CHUNKED_ORDER)   # file | reorder | sort, the chunked backend's hit order
+METRICS = os.getenv("METRICS", "1") != "0"   # 0 skips the JSON metrics file next to the report
+PROFILE = os.getenv("PROFILE", "")           # cprofile | sample, the profile is saved next to the report
 #PROCESSOR = os.getenv("PROCESSOR", "spark")
 
 def resolve_path(raw: str) -> str:
 
-    if os.path.exists(raw):
+    # a directory, a *.manifest file or a glob (quoted so the shell leaves it alone) are all accepted;
+    # s3:// objects are streamed by the chunked backend
+    if is_s3(raw) or os.path.exists(raw) or glob.glob(raw):
         return raw
 
     candidate = os.path.join(
@@ -39,19 +54,83 @@ def main() -> None:
         print(f"python main.py data{os.sep}data.sql")
         sys.exit(1)
         #this is the development requirement number 3 of the assignment that the code should run with single argument
+    if PROCESSOR not in ("chunked", "parallel", "spark", "auto"):
+        # the experimental pandas VectorizedProcessor is left out until it beats the chunked backend
+        print(f"\nError: unknown PROCESSOR={PROCESSOR!r}, use chunked, parallel, spark or auto")
+        sys.exit(1)
+    if CHECKPOINT and (PROCESSOR not in ("chunked", "auto") or WORKERS > 1):
+        # only the chunked backend resumes from a checkpoint, the others would quietly ignore it
+        print(
+            f"\nError: CHECKPOINT only resumes the chunked backend (PROCESSOR=chunked or auto, one worker), "
+            f"got PROCESSOR={PROCESSOR} WORKERS={WORKERS}"
+        )
+        sys.exit(1)
     input_path = resolve_path(sys.argv[1])
+    # listed (and, for several files, probed for their first hit time) once, every backend reuses it
+    input_paths = resolve_inputs(input_path)
+
+    backend = PROCESSOR
+    if backend == "auto":
+        # checked before anything heavy is imported, a small file never waits for pandas or a JVM
+        from src.processor import auto_backend
+        backend = "chunked" if CHECKPOINT else auto_backend(input_paths, WORKERS or None, ORDER)
+        logger.info("PROCESSOR=auto -> %s", backend)
 
-    if PROCESSOR == "spark":
+    if backend == "spark":
         from src.spark_processor import SparkProcessor
-        processor = SparkProcessor(input_path)
+        processor = SparkProcessor(
+            input_path, top_k=TOP_K, min_revenue=MIN_REVENUE, attribution_window=ATTRIBUTION_WINDOW,
+            input_paths=input_paths,
+        )
+    elif CHECKPOINT:
+        from src.processor import IncrementalProcessor
+        processor = IncrementalProcessor(
+            input_path, CHECKPOINT, attribution_window=ATTRIBUTION_WINDOW, order=ORDER, input_paths=input_paths,
+        )
+    elif backend == "parallel" or WORKERS > 1:
+        # several files are not a reason on their own: PROCESSOR=chunked stays chunked, and
+        # PROCESSOR=auto weighs them in auto_backend
+        if backend != "parallel":
+            logger.info("WORKERS=%d -> parallel backend", WORKERS)
+        from src.processor import ParallelProcessor
+        processor = ParallelProcessor(
+            input_path, workers=WORKERS or None, attribution_window=ATTRIBUTION_WINDOW, order=ORDER,
+            input_paths=input_paths,
+        )
     else:
         from src.processor import ChunkedProcessor
-        processor = ChunkedProcessor(input_path)
+        processor = ChunkedProcessor(
+            input_path, attribution_window=ATTRIBUTION_WINDOW, order=ORDER, input_paths=input_paths,
+        )
 
     logger.info("Back-end: %s", processor.describe())
 
-    revenue_map = processor.process()
-    output_path = write_output(revenue_map, input_path)
+    profiler = None
+    if PROFILE:
+        from src.profiling import Profiler
+        profiler = Profiler(PROFILE)
+        profiler.start()
+
+    # the report for an s3:// input lands in the working directory, deploy_ec2.sh uploads it
+    output_base = os.path.basename(input_path) if is_s3(input_path) else input_path
+    metrics = processor.metrics
+    if backend == "spark":
+        # Spark writes the report from its executors instead of collecting the result
+        output_path = processor.write(output_base)
+    else:
+        revenue_map = processor.process()
+        with metrics.stage("write"):
+            output_path = write_output(revenue_map, output_base, top_k=TOP_K, min_revenue=MIN_REVENUE)
+
+    if profiler is not None:
+        profiler.stop()
+        profiler.log_top()
+        profile_path = sidecar_path(output_path, config.PROFILE_SUFFIXES[PROFILE])
+        profiler.save(profile_path)
+        metrics.set("profile", {"mode": PROFILE, "path": profile_path, "top": profiler.top()})
+    metrics.log_summary()
+    if METRICS:
+        write_metrics(metrics, output_path)
 
     print(f"Output: {output_path}")
 
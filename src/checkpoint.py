@@ -0,0 +1,124 @@
+from __future__ import annotations
+import hashlib
+import itertools
+import json
+import logging
+import os
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass, field
+
+from src.config import KEYWORD_PARAMS, PRODUCT_REVENUE_IDX, PURCHASE_EVENT, SEARCH_ENGINE_MAP
+
+logger = logging.getLogger(__name__)
+
+# Local checkpoint for incremental runs over an append-only hit log.
+# It records how far into the file attribution got, plus the attribution state at that point
+# (last search per IP and the running revenue map), so the next run only reads the new bytes.
+# The first FINGERPRINT_BYTES of the file are hashed so a rotated or rewritten log starts over.
+#
+# The settings the state was computed with (attribution window, engine map, keyword and revenue
+# settings) are recorded too: resuming under other ones would mix two sets of rules, so it is refused.
+#
+# The file is JSON lines: a header with the offset, fingerprint, settings and number of revenue
+# rows, the [domain, keyword, revenue] rows, then one [ip, domain, keyword, time] row per IP. The
+# header is checked before anything else is read, and the last-search rows are streamed in and
+# out, never held as a list: there can be as many as the log has IPs.
+
+CHECKPOINT_VERSION = 4
+FINGERPRINT_BYTES = 64 * 1024
+# a header is well under this; an older single-object checkpoint is not read in full to find out
+_HEADER_MAX_BYTES = 64 * 1024
+
+
+@dataclass
+class Checkpoint:
+    offset: int = 0
+    fingerprint: str = ""
+    # (ip, domain, keyword, search hit_time_gmt)
+    last_search: Iterable[tuple[str, str, str, int]] = field(default_factory=list)
+    revenue_map: dict[tuple[str, str], float] = field(default_factory=dict)
+
+
+def fingerprint(path: str, upto: int) -> str:
+    with open(path, "rb") as fh:
+        return hashlib.sha1(fh.read(min(upto, FINGERPRINT_BYTES))).hexdigest()
+
+
+def _settings(window: int) -> dict:
+    # what the last-search state and the revenue totals depend on, in their JSON form
+    return {
+        "attribution_window":  window,
+        "search_engine_map":   dict(SEARCH_ENGINE_MAP),
+        "keyword_params":      list(KEYWORD_PARAMS),
+        "purchase_event":      PURCHASE_EVENT,
+        "product_revenue_idx": PRODUCT_REVENUE_IDX,
+    }
+
+
+def load_checkpoint(checkpoint_path: str, input_path: str, window: int = 0) -> Checkpoint:
+    if not os.path.exists(checkpoint_path):
+        return Checkpoint()
+
+    with open(checkpoint_path, encoding="utf-8") as fh:
+        try:
+            header = json.loads(fh.readline(_HEADER_MAX_BYTES))
+        except ValueError:
+            header = None
+        if not isinstance(header, dict):
+            header = {}
+        if header.get("version") != CHECKPOINT_VERSION:
+            logger.warning("Checkpoint %s has version %s, starting over", checkpoint_path, header.get("version"))
+            return Checkpoint()
+
+        changed = [name for name, value in _settings(window).items() if header["settings"].get(name) != value]
+        if changed:
+            raise ValueError(
+                f"Checkpoint {checkpoint_path} was built with another {', '.join(changed)}; "
+                f"restore the settings or delete the checkpoint to start over"
+            )
+
+        offset = header["offset"]
+        if os.path.getsize(input_path) < offset or fingerprint(input_path, offset) != header["fingerprint"]:
+            logger.warning("%s no longer starts with the checkpointed bytes, starting over", input_path)
+            return Checkpoint()
+
+        # one row per (domain, keyword), in the insertion order write_output relies on for ties
+        revenue_map = {}
+        for _ in range(header["revenue"]):
+            domain, keyword, revenue = json.loads(fh.readline())
+            revenue_map[(domain, keyword)] = revenue
+
+    return Checkpoint(
+        offset=offset,
+        fingerprint=header["fingerprint"],
+        last_search=_iter_last_search(checkpoint_path, 1 + header["revenue"]),
+        revenue_map=revenue_map,
+    )
+
+
+def _iter_last_search(checkpoint_path: str, skip: int) -> Iterator[tuple[str, str, str, int]]:
+    # a generator: the file is only opened if the caller has new bytes to attribute
+    with open(checkpoint_path, encoding="utf-8") as fh:
+        for line in itertools.islice(fh, skip, None):
+            ip, domain, keyword, time = json.loads(line)
+            yield ip, domain, keyword, time
+
+
+def save_checkpoint(checkpoint_path: str, state: Checkpoint, window: int = 0) -> None:
+    header = {
+        "version": CHECKPOINT_VERSION,
+        "offset": state.offset,
+        "fingerprint": state.fingerprint,
+        "settings": _settings(window),
+        "revenue": len(state.revenue_map),
+    }
+    dumps = json.JSONEncoder(separators=(",", ":")).encode
+    # write next to the target and rename, so a crash mid-write leaves the old checkpoint intact
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        fh.write(dumps(header) + "\n")
+        for (domain, keyword), revenue in state.revenue_map.items():
+            fh.write(dumps([domain, keyword, revenue]) + "\n")
+        for row in state.last_search:
+            fh.write(dumps(list(row)) + "\n")
+    os.replace(tmp_path, checkpoint_path)
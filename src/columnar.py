@@ -0,0 +1,273 @@
+from __future__ import annotations
+import heapq
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Iterator
+
+from src.config import (
+    CHUNK_SIZE, DATASET_MANIFEST, INGEST_ROW_GROUP_ROWS, KEYWORD_PARAMS, PRODUCT_REVENUE_IDX, PURCHASE_EVENT,
+    SEARCH_ENGINE_MAP,
+)
+from src.parsers import parse_hit_time, parse_revenue, split_referrer
+from src.readers import chunked, iter_projected_chunks, resolve_inputs
+from src.symbols import SymbolTable
+
+logger = logging.getLogger(__name__)
+
+# Columnar intermediate format for repeated analyses of the same logs. ingest() tokenizes and
+# parses the raw hit log once into a Parquet dataset of the attribution columns, partitioned by
+# the UTC day of hit_time_gmt (hit_date=YYYY-MM-DD/part-NNNNN.parquet, hits without a usable
+# time in __HIVE_DEFAULT_PARTITION__). Each row keeps its source position in `seq` (row number
+# across the input files, in resolve_inputs order), so ORDER=file reads merge the partitions back
+# into source order; rows are in seq order inside a partition. Only rows that can matter under
+# some engine map are kept: a referrer host with a keyword, or a purchase. The referrer host is
+# stored as is, not mapped, so a SEARCH_ENGINE_MAP change needs no re-ingest; the keyword params
+# and revenue settings are recorded in the manifest and do.
+#
+# pyarrow is imported by the functions that use it, like pandas in the vectorized backend.
+
+DATASET_VERSION = 2
+DATASET_COLUMNS: tuple[str, ...] = ("seq", "ip", "hit_time_gmt", "referrer_host", "referrer_keyword", "revenue")
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+# partitions with an open Parquet writer during ingest; a partition past this reopens as a new part
+_MAX_OPEN_WRITERS = 32
+_INT64 = 2 ** 63
+
+
+def _schema():
+    import pyarrow as pa
+    return pa.schema([
+        ("seq",              pa.int64()),
+        ("ip",               pa.string()),
+        ("hit_time_gmt",     pa.int64()),
+        ("referrer_host",    pa.string()),
+        ("referrer_keyword", pa.string()),
+        ("revenue",          pa.float64()),
+    ])
+
+
+def _settings() -> dict:
+    # what the stored columns were computed with
+    return {
+        "keyword_params":      list(KEYWORD_PARAMS),
+        "purchase_event":      PURCHASE_EVENT,
+        "product_revenue_idx": PRODUCT_REVENUE_IDX,
+    }
+
+
+def check_manifest(manifest: dict, location: str) -> None:
+    if manifest.get("version") != DATASET_VERSION:
+        raise ValueError(f"{location} is a version {manifest.get('version')} dataset, re-run ingest.py")
+    stale = [name for name, value in _settings().items() if manifest.get(name) != value]
+    if stale:
+        raise ValueError(f"{location} was ingested with other {', '.join(stale)}, re-run ingest.py")
+
+
+def read_manifest(dataset_dir: str) -> dict:
+    with open(os.path.join(dataset_dir, DATASET_MANIFEST), encoding="utf-8") as fh:
+        manifest = json.load(fh)
+    check_manifest(manifest, dataset_dir)
+    return manifest
+
+
+def _partition(time: int | None, names: dict[int, str]) -> str:
+    if time is None:
+        return NULL_PARTITION
+    day = time // 86_400
+    name = names.get(day)
+    if name is None:
+        try:
+            date = datetime.fromtimestamp(day * 86_400, timezone.utc).date()
+        except (OverflowError, OSError, ValueError):
+            # beyond datetime's years 1..9999, still sorted before / after every real day
+            date = datetime.min.date() if day < 0 else datetime.max.date()
+        name = names[day] = f"hit_date={date.isoformat()}"
+    return name
+
+
+class _PartitionWriter:
+    # buffers one partition's rows and appends them to its current part file a row group at a time
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.columns: tuple[list, ...] = tuple([] for _ in DATASET_COLUMNS)
+        self.writer = None
+
+    def __len__(self) -> int:
+        return len(self.columns[0])
+
+    def flush(self, schema, next_part) -> None:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if not len(self):
+            return
+        if self.writer is None:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"part-{next_part():05d}.parquet")
+            self.writer = pq.ParquetWriter(path, schema)
+        self.writer.write_table(pa.Table.from_arrays([pa.array(c) for c in self.columns], schema=schema))
+        for column in self.columns:
+            column.clear()
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+def ingest(input_path: str, dataset_dir: str, row_group_rows: int = INGEST_ROW_GROUP_ROWS) -> dict:
+    """Converts the raw hit log(s) at input_path into a columnar dataset in dataset_dir.
+
+    Returns the manifest, which is written last: a dataset without one is an interrupted ingest.
+    """
+    from src.processor import HIT_COLUMNS
+
+    if os.path.isdir(dataset_dir) and os.listdir(dataset_dir):
+        raise ValueError(f"{dataset_dir} is not empty, ingest into a new directory")
+    sources = resolve_inputs(input_path)
+    schema = _schema()
+    partitions: dict[str, _PartitionWriter] = {}
+    names: dict[int, str] = {}
+    parts = 0
+    rows = 0
+    kept = 0
+
+    def next_part() -> int:
+        nonlocal parts
+        parts += 1
+        return parts - 1
+
+    def flush(writer: _PartitionWriter) -> None:
+        # the writer flushed longest ago is closed first when too many are open
+        writer.flush(schema, next_part)
+        partitions[writer.directory] = partitions.pop(writer.directory)
+        open_writers = [w for w in partitions.values() if w.writer is not None]
+        for stale in open_writers[: max(len(open_writers) - _MAX_OPEN_WRITERS, 0)]:
+            stale.close()
+
+    try:
+        for path in sources:
+            for chunk in iter_projected_chunks(path, HIT_COLUMNS, CHUNK_SIZE):
+                first = rows
+                rows += len(chunk)
+                for seq, (hit_time, ip, referrer, event_list, product_list) in enumerate(chunk, first):
+                    host, keyword = split_referrer(referrer.strip())
+                    revenue = parse_revenue(product_list, event_list)
+                    if not (host and keyword) and revenue <= 0:
+                        continue
+                    time = parse_hit_time(hit_time)
+                    if time is not None and not -_INT64 <= time < _INT64:
+                        # no int64 for it, Spark's cast to long gives null as well
+                        time = None
+                    directory = os.path.join(dataset_dir, _partition(time, names))
+                    writer = partitions.get(directory)
+                    if writer is None:
+                        writer = partitions[directory] = _PartitionWriter(directory)
+                    for column, value in zip(writer.columns, (seq, ip.strip(), time, host, keyword, revenue)):
+                        column.append(value)
+                    kept += 1
+                    if len(writer) >= row_group_rows:
+                        flush(writer)
+        for writer in list(partitions.values()):
+            flush(writer)
+    finally:
+        for writer in partitions.values():
+            writer.close()
+
+    manifest = {
+        "version": DATASET_VERSION,
+        **_settings(),
+        "columns": list(DATASET_COLUMNS),
+        "rows": rows,
+        "kept_rows": kept,
+        "partitions": len(partitions),
+        "sources": sources,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+    os.makedirs(dataset_dir, exist_ok=True)
+    with open(os.path.join(dataset_dir, DATASET_MANIFEST), "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh, indent=2)
+    logger.info(
+        "Ingested %s rows from %d files -> %s (%s rows kept in %d partitions, %d files)",
+        f"{rows:,}", len(sources), dataset_dir, f"{kept:,}", len(partitions), parts,
+    )
+    return manifest
+
+
+def partition_files(dataset_dir: str) -> list[list[str]]:
+    # part files per partition, partitions in time order with the null partition first (like the
+    # nulls-first time sort), parts in the order ingest wrote them
+    partitions = sorted(
+        (name for name in os.listdir(dataset_dir) if os.path.isdir(os.path.join(dataset_dir, name))),
+        key=lambda name: (name != NULL_PARTITION, name),
+    )
+    files = []
+    for name in partitions:
+        directory = os.path.join(dataset_dir, name)
+        parts = sorted(p for p in os.listdir(directory) if p.endswith(".parquet"))
+        files.append([os.path.join(directory, p) for p in parts])
+    return files
+
+
+def relevant_filter():
+    # pushed into the Parquet scan: hits the current SEARCH_ENGINE_MAP can attribute from, and purchases
+    import pyarrow.compute as pc
+    return (pc.field("referrer_host").isin(list(SEARCH_ENGINE_MAP)) & pc.field("referrer_keyword").is_valid()) | (
+        pc.field("revenue") > 0
+    )
+
+
+def iter_dataset_chunks(
+    dataset_dir: str,
+    symbols: SymbolTable,
+    time_sorted: bool = False,
+    chunk_size: int = CHUNK_SIZE,
+) -> Iterator[tuple[list[tuple[int | None, str]], list[int], list[float]]]:
+    # (rows, search ids, revenues) chunks for ChunkedProcessor._attribute: rows are (hit_time_gmt,
+    # ip), search ids the symbols pair id of each search under the current map, -1 for none. Only
+    # the needed columns are read and the filter drops the other hits inside the scan. time_sorted
+    # puts each partition in (hit_time_gmt, seq) order, so the whole dataset is in the order of
+    # ORDER=sort; otherwise the partitions are merged on seq back into source file order.
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+
+    read_manifest(dataset_dir)
+    row_filter = relevant_filter()
+    if not time_sorted:
+        partitions = [_iter_rows(files, row_filter, chunk_size, symbols) for files in partition_files(dataset_dir)]
+        # seq is unique, the merge never compares past it
+        for block in chunked(heapq.merge(*partitions), chunk_size):
+            yield [(time, ip) for _, time, ip, _, _ in block], [r[3] for r in block], [r[4] for r in block]
+        return
+
+    for files in partition_files(dataset_dir):
+        table = ds.dataset(files, format="parquet").to_table(columns=list(DATASET_COLUMNS), filter=row_filter)
+        # sort_indices is stable and the rows are in seq order, equal times keep file order; only
+        # the null partition, read first, holds null times
+        order = pc.sort_indices(table, sort_keys=[("hit_time_gmt", "ascending")])
+        for batch in table.take(order).to_batches(max_chunksize=chunk_size):
+            if batch.num_rows:
+                _, times, ips, search_ids, revenues = _columns(batch, symbols)
+                yield list(zip(times, ips)), search_ids, revenues
+
+
+def _iter_rows(files: list[str], row_filter, chunk_size: int, symbols: SymbolTable) -> Iterator[tuple]:
+    # one partition as (seq, hit_time_gmt, ip, search id, revenue) rows, in seq order
+    import pyarrow.dataset as ds
+    for path in files:
+        for batch in ds.dataset(path, format="parquet").to_batches(
+            columns=list(DATASET_COLUMNS), filter=row_filter, batch_size=chunk_size,
+        ):
+            yield from zip(*_columns(batch, symbols))
+
+
+def _columns(batch, symbols: SymbolTable) -> tuple[list, list, list, list, list]:
+    seqs, ips, times, hosts, keywords, revenues = (batch.column(name).to_pylist() for name in DATASET_COLUMNS)
+    engines = SEARCH_ENGINE_MAP
+    search_ids = [
+        symbols.pair_id(engines[host], keyword) if keyword and host in engines else -1
+        for host, keyword in zip(hosts, keywords)
+    ]
+    return seqs, times, ips, search_ids, revenues
@@ -0,0 +1,238 @@
+from __future__ import annotations
+import bz2
+import gzip
+import io
+import mmap
+import os
+import zlib
+from typing import Callable, Iterator
+
+from src.config import DECOMPRESS_THREADS, READ_BLOCK_SIZE
+from src.s3 import is_s3, open_s3, read_s3_head
+from src.streams import PrefetchReader, map_ordered
+
+# Compressed hit logs are decompressed on a background thread that feeds the csv tokenizer
+# through a small queue, so inflating overlaps with parsing (zlib, bz2 and zstandard all release
+# the GIL). When the member / frame boundaries can be found without decompressing, i.e. BGZF
+# style gzip (block size in the header) and zstd (block sizes in the block headers), members are
+# decompressed on a thread pool instead. bz2 and plain multi-member gzip stay sequential.
+
+_MAGIC = {b"\x1f\x8b": "gzip", b"BZh": "bz2", b"\x28\xb5\x2f\xfd": "zstd"}
+_EXTENSIONS = {".gz": "gzip", ".gzip": "gzip", ".bz2": "bz2", ".zst": "zstd", ".zstd": "zstd"}
+
+# members larger than this are streamed, so one task never has to hold a huge frame in memory
+_MAX_PARALLEL_MEMBER = 4 * READ_BLOCK_SIZE
+
+
+def detect_compression(path: str) -> str | None:
+    if is_s3(path):
+        return _sniff(read_s3_head(path, 4), path)
+    with open(path, "rb") as fh:
+        return _sniff(fh.read(4), path)
+
+
+def _sniff(head: bytes, path: str) -> str | None:
+    # magic bytes win; the extension only matters for files too short to have any
+    for magic, kind in _MAGIC.items():
+        if head.startswith(magic):
+            return kind
+    if not head:
+        return _EXTENSIONS.get(os.path.splitext(path)[1].lower())
+    return None
+
+
+def open_binary(path: str, compression: str | None = None) -> io.BufferedIOBase:
+    if is_s3(path):
+        # S3 objects arrive through ranged GETs; compressed ones are inflated as a stream on top
+        raw = open_s3(path)
+        kind = compression or _sniff(raw.peek(4)[:4], path)
+        if kind is None:
+            return raw
+        return io.BufferedReader(PrefetchReader(_iter_decompressed_stream(raw, kind)), READ_BLOCK_SIZE)
+
+    kind = compression or detect_compression(path)
+    if kind is None:
+        return open(path, "rb")
+    return io.BufferedReader(PrefetchReader(_iter_decompressed(path, kind)), READ_BLOCK_SIZE)
+
+
+def open_plain(path: str) -> io.BufferedIOBase:
+    # decompressed on the calling thread as it is read, with no prefetch thread or READ_BLOCK_SIZE
+    # read-ahead: for the first line or two of a file (header, first hit time)
+    if is_s3(path):
+        return open_binary(path)
+    kind = detect_compression(path)
+    if kind == "gzip":
+        return gzip.open(path, "rb")
+    if kind == "bz2":
+        return bz2.open(path, "rb")
+    if kind == "zstd":
+        reader = _zstandard().ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True)
+        return io.BufferedReader(reader)
+    return open(path, "rb")
+
+
+def _iter_decompressed(path: str, kind: str) -> Iterator[bytes]:
+    with open(path, "rb") as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if kind == "gzip":
+                spans = _bgzf_members(mm)
+                if spans:
+                    yield from _decompress_parallel(mm, spans, lambda data: zlib.decompress(data, 31))
+                else:
+                    yield from _decompress_stream(mm.read, lambda: zlib.decompressobj(31), "gzip")
+            elif kind == "zstd":
+                yield from _zstd_blocks(mm)
+            else:
+                yield from _iter_decompressed_stream(mm, kind)
+
+
+def _iter_decompressed_stream(fh, kind: str) -> Iterator[bytes]:
+    # sequential decompression from any file-like object
+    with fh:
+        if kind == "gzip":
+            yield from _decompress_stream(fh.read, lambda: zlib.decompressobj(31), "gzip")
+        elif kind == "bz2":
+            yield from _decompress_stream(fh.read, bz2.BZ2Decompressor, "bz2")
+        elif kind == "zstd":
+            yield from _zstd_stream(fh)
+        else:
+            raise ValueError(f"Unknown compression: {kind!r}")
+
+
+def _decompress_stream(read: Callable[[int], bytes], new_decompressor: Callable, kind: str) -> Iterator[bytes]:
+    # concatenated members / streams are read back to back, like gzip.open and bz2.open do
+    data = b""
+    decompressor = new_decompressor()
+    pending = False
+    while True:
+        if not data:
+            data = read(READ_BLOCK_SIZE)
+            if not data:
+                break
+        out = decompressor.decompress(data)
+        pending = True
+        data = b""
+        if out:
+            yield out
+        if decompressor.eof:
+            data = decompressor.unused_data
+            decompressor = new_decompressor()
+            pending = False
+    if pending:
+        raise EOFError(f"Compressed {kind} input ended before the end-of-stream marker")
+
+
+def _decompress_parallel(
+    mm: mmap.mmap,
+    spans: list[tuple[int, int]],
+    decompress: Callable[[bytes], bytes],
+) -> Iterator[bytes]:
+    # members are grouped into ~READ_BLOCK_SIZE batches; at most 2 batches per thread are in
+    # flight
+    batches: list[list[tuple[int, int]]] = [[]]
+    size = 0
+    for start, end in spans:
+        if size >= READ_BLOCK_SIZE:
+            batches.append([])
+            size = 0
+        batches[-1].append((start, end))
+        size += end - start
+
+    def run(batch):
+        return b"".join(decompress(mm[start:end]) for start, end in batch)
+
+    threads = DECOMPRESS_THREADS or min(4, os.cpu_count() or 1)
+    yield from map_ordered(run, batches, threads, 2 * threads)
+
+
+def _bgzf_members(mm: mmap.mmap) -> list[tuple[int, int]] | None:
+    # BGZF (bgzip, and some log shippers) puts each member's total size in a "BC" extra
+    # subfield, so members can be located from their headers alone
+    spans = []
+    pos, size = 0, len(mm)
+    while pos < size:
+        if mm[pos:pos + 4] != b"\x1f\x8b\x08\x04" or pos + 12 > size:
+            return None
+        xlen = int.from_bytes(mm[pos + 10:pos + 12], "little")
+        extra, bsize = mm[pos + 12:pos + 12 + xlen], None
+        i = 0
+        while i + 4 <= len(extra):
+            slen = int.from_bytes(extra[i + 2:i + 4], "little")
+            if extra[i:i + 2] == b"BC" and slen == 2:
+                bsize = int.from_bytes(extra[i + 4:i + 6], "little") + 1
+            i += 4 + slen
+        if bsize is None or pos + bsize > size:
+            return None
+        spans.append((pos, pos + bsize))
+        pos += bsize
+    return spans if len(spans) > 1 else None
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError as exc:
+        raise ImportError("zstd input needs the zstandard package: pip install zstandard") from exc
+    return zstandard
+
+
+def _zstd_blocks(mm: mmap.mmap) -> Iterator[bytes]:
+    zstandard = _zstandard()
+    frames = _zstd_frames(mm)
+    if frames and len(frames) > 1 and max(end - start for start, end in frames) <= _MAX_PARALLEL_MEMBER:
+        yield from _decompress_parallel(
+            mm, frames, lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(data)
+        )
+        return
+    yield from _zstd_stream(mm)
+
+
+def _zstd_stream(source) -> Iterator[bytes]:
+    reader = _zstandard().ZstdDecompressor().stream_reader(
+        source, read_size=READ_BLOCK_SIZE, read_across_frames=True, closefd=False,
+    )
+    with reader:
+        while True:
+            out = reader.read(READ_BLOCK_SIZE)
+            if not out:
+                return
+            yield out
+
+
+_ZSTD_MAGIC = 0xFD2FB528
+
+
+def _zstd_frames(mm: mmap.mmap) -> list[tuple[int, int]] | None:
+    # walks frame and block headers only (RFC 8878); skippable frames are dropped
+    spans = []
+    pos, size = 0, len(mm)
+    while pos < size:
+        if pos + 4 > size:
+            return None
+        magic = int.from_bytes(mm[pos:pos + 4], "little")
+        if magic & 0xFFFFFFF0 == 0x184D2A50:
+            pos += 8 + int.from_bytes(mm[pos + 4:pos + 8], "little")
+            continue
+        if magic != _ZSTD_MAGIC or pos + 5 > size:
+            return None
+        start = pos
+        fhd = mm[pos + 4]
+        single_segment = (fhd >> 5) & 1
+        fcs_size = (1 if single_segment else 0, 2, 4, 8)[fhd >> 6]
+        pos += 5 + (0 if single_segment else 1) + (0, 1, 2, 4)[fhd & 3] + fcs_size
+        while True:
+            if pos + 3 > size:
+                return None
+            header = int.from_bytes(mm[pos:pos + 3], "little")
+            block_type, block_size = (header >> 1) & 3, header >> 3
+            pos += 3 + (1 if block_type == 1 else block_size)
+            if header & 1:
+                break
+        pos += 4 if (fhd >> 2) & 1 else 0
+        if pos > size:
+            return None
+        spans.append((start, pos))
+    return spans
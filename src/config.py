@@ -30,7 +30,89 @@ PRODUCT_REVENUE_IDX: int = 3
 
 CHUNK_SIZE: int = 10_000
 
+# rows per pandas frame for the experimental VectorizedProcessor
+VECTORIZED_CHUNK_SIZE: int = 1_000_000
+
+# SparkProcessor enrichment: "native" builds referrer/revenue parsing from Spark SQL built-ins
+# (no Python worker round-trip), "udf" runs parse_referrer / parse_revenue in pandas UDFs
+SPARK_ENRICH: str = "native"
+
+# SparkProcessor attribution: "window" is last(...) over an ip window ordered by hit_time_gmt,
+# "grouped" folds each (ip, time bucket) group once and stitches buckets, no global sort
+SPARK_ATTRIBUTION: str                = "window"
+SPARK_ATTRIBUTION_BUCKET_SECONDS: int = 86_400
+
+# attribution lookback: a purchase is credited to the IP's last search only if that search is at
+# most this many seconds older (by hit_time_gmt), e.g. 1800 or 7 * 86_400; 0 means no limit.
+# Every backend applies it, and the chunked ones evict searches that fell out of it.
+ATTRIBUTION_WINDOW_SECONDS: int = 0
+
+# chunked backends: IPs whose last search is held in memory (roughly 100 bytes each) before the
+# state spills to an on-disk sqlite store in SPILL_DIR ("" is the system temp dir); 0 never spills
+LAST_SEARCH_MEMORY_ENTRIES: int = 5_000_000
+SPILL_DIR: str                  = ""
+
+# order the chunked backend attributes hits in: "file" trusts file order, "reorder" fixes rows up
+# to REORDER_BUFFER_ROWS late with a bounded heap, "sort" is an external merge sort (runs of
+# SORT_RUN_ROWS rows spill to SPILL_DIR); both sort by hit_time_gmt like the Spark backend
+CHUNKED_ORDER: str        = "file"
+REORDER_BUFFER_ROWS: int  = 100_000
+SORT_RUN_ROWS: int        = 500_000
+
+# LRU cache in front of parse_referrer, one per process / Spark executor worker; 0 turns it off
+REFERRER_CACHE_SIZE: int = 65_536
+
+# parallel backend: 0 means one worker per cpu core
+PARALLEL_WORKERS: int           = 0
+# the input is split into workers * this many byte ranges, more ranges balance uneven rows better
+PARALLEL_RANGES_PER_WORKER: int = 4
+
+# PROCESSOR=auto picks a backend from the input size on disk: chunked below AUTO_PARALLEL_BYTES (no
+# worker pool or JVM to start, small hourly files finish in milliseconds), parallel above it, and
+# Spark from AUTO_SPARK_BYTES when pyspark is installed
+AUTO_PARALLEL_BYTES: int = 64 * 1024 * 1024
+AUTO_SPARK_BYTES: int    = 20 * 1024 * 1024 * 1024
+
+# bytes decoded per step when a worker tokenizes its byte range
+READ_BLOCK_SIZE: int = 8 * 1024 * 1024
+
+# s3:// input: bytes per ranged GET, GETs in flight (also the client's connection pool size) and
+# ranges fetched ahead of the parser, which caps the read buffer at about 16 x 8 MB
+S3_RANGE_SIZE: int      = 8 * 1024 * 1024
+S3_CONCURRENCY: int     = 8
+S3_PREFETCH_RANGES: int = 16
+# s3:// output goes up as a multipart upload in parts of this size (S3 needs at least 5 MB)
+S3_PART_SIZE: int       = 8 * 1024 * 1024
+
+# threads that decompress BGZF gzip members / zstd frames in parallel; 0 means min(4, cpu cores)
+DECOMPRESS_THREADS: int = 0
+
+# an input path ending in this is a manifest: one file path or glob per line, relative to the manifest
+MANIFEST_SUFFIX: str = ".manifest"
+
+# columnar dataset written by ingest.py: a directory holding this file plus hit_date=YYYY-MM-DD/
+# partitions of Parquet files; rows are buffered per partition up to INGEST_ROW_GROUP_ROWS
+DATASET_MANIFEST: str      = "_hits_dataset.json"
+INGEST_ROW_GROUP_ROWS: int = 262_144
+
+# report size: keep at most TOP_K keywords per search engine (0 keeps all) and drop rows under
+# MIN_REVENUE; main.py reads both from the environment as well
+TOP_K: int         = 0
+MIN_REVENUE: float = 0.0
+
+# run metrics: a progress / throughput log line at most every this many seconds of a run (0 turns
+# it off); main.py dumps the stage timers and counters as JSON next to the report
+METRICS_PROGRESS_SECONDS: float = 30.0
+# PROFILE=sample in main.py: seconds between two stack samples of the main thread
+PROFILE_SAMPLE_INTERVAL: float = 0.005
+
 
 OUTPUT_SUFFIX: str       = "_SearchKeywordPerformance.tab"
+# files written next to the report: run metrics, and the profile for PROFILE=cprofile / sample
+METRICS_SUFFIX: str      = "_SearchKeywordPerformance.metrics.json"
+PROFILE_SUFFIXES: dict[str, str] = {
+    "cprofile": "_SearchKeywordPerformance.prof",
+    "sample":   "_SearchKeywordPerformance.folded",
+}
 OUTPUT_HEADER: list[str] = ["Search Engine Domain", "Search Keyword", "Revenue"]
 TSV_DELIMITER: str       = "\t"
@@ -0,0 +1,101 @@
+from __future__ import annotations
+import json
+import logging
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, TypeVar
+
+from src.config import METRICS_PROGRESS_SECONDS
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Run metrics for the processors: wall time per stage, counters and a few descriptive values,
+# dumped as JSON next to the report. The processors time whole chunks / frames / Spark jobs,
+# never single rows, so collecting them costs next to nothing on the hot path. Anything that
+# wants the numbers elsewhere (statsd, a log shipper) can subclass Metrics and pass it in.
+
+
+class Metrics:
+
+    def __init__(self, progress_seconds: float | None = None):
+        self.progress_seconds = METRICS_PROGRESS_SECONDS if progress_seconds is None else progress_seconds
+        self.stages: dict[str, float] = {}
+        self.counters: dict[str, int] = {}
+        self.info: dict[str, object] = {}
+        self.started_at = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+        self._next_progress = self._start + self.progress_seconds
+
+    def add_time(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def timed(self, stage: str, items: Iterable[T]) -> Iterator[T]:
+        # charges the time spent producing each item (reading, decompressing) to `stage`
+        items = iter(items)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(items)
+            except StopIteration:
+                self.add_time(stage, time.perf_counter() - start)
+                return
+            self.add_time(stage, time.perf_counter() - start)
+            yield item
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def set(self, name: str, value: object) -> None:
+        self.info[name] = value
+
+    def progress(self, rows: int) -> None:
+        # called once per chunk; logs rows so far and throughput every progress_seconds
+        if not self.progress_seconds:
+            return
+        now = time.perf_counter()
+        if now < self._next_progress:
+            return
+        self._next_progress = now + self.progress_seconds
+        elapsed = now - self._start
+        logger.info(
+            "Progress | %s rows | %s rows/s | %s",
+            f"{rows:,}", f"{rows / elapsed:,.0f}" if elapsed else "-",
+            " ".join(f"{name}={seconds:.1f}s" for name, seconds in self.stages.items()),
+        )
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._start
+
+    def as_dict(self) -> dict:
+        elapsed = self.elapsed()
+        rows = self.counters.get("rows", 0)
+        return {
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "elapsed_seconds": round(elapsed, 3),
+            "rows_per_sec": round(rows / elapsed) if elapsed else None,
+            "stages": {name: round(seconds, 3) for name, seconds in self.stages.items()},
+            "counters": dict(self.counters),
+            "info": dict(self.info),
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.as_dict(), indent=2, default=str)
+
+    def log_summary(self) -> None:
+        summary = self.as_dict()
+        logger.info(
+            "Metrics | %.2fs | %s",
+            summary["elapsed_seconds"],
+            " ".join(f"{name}={seconds:.2f}s" for name, seconds in summary["stages"].items()),
+        )
@@ -0,0 +1,123 @@
+from __future__ import annotations
+import csv
+import heapq
+import itertools
+import logging
+import os
+import tempfile
+from typing import Iterable, Iterator
+
+from src.config import REORDER_BUFFER_ROWS, SORT_RUN_ROWS, SPILL_DIR
+from src.parsers import parse_hit_time
+
+logger = logging.getLogger(__name__)
+
+# Time ordering for the chunked backend. SparkProcessor attributes each IP's hits in
+# hit_time_gmt order, the chunked backend in file order; these put projected hit rows
+# (hit_time_gmt first) into (hit_time_gmt, file position) order so both agree on merged or
+# late-arriving logs. Hits without a usable time go first, like Spark's nulls-first sort;
+# equal times keep file order.
+#
+# reorder_rows is a bounded heap for nearly sorted streams: a row can be up to `buffer_rows`
+# rows late and still come out in place. sort_rows is an external merge sort for anything
+# else: sorted runs of `run_rows` rows go to temporary files and are merged back lazily.
+
+_MERGE_FAN_IN = 128
+
+
+def _time_key(value: str) -> int | float:
+    time = parse_hit_time(value)
+    return float("-inf") if time is None else time
+
+
+def reorder_rows(rows: Iterable[tuple[str, ...]], buffer_rows: int | None = None) -> Iterator[tuple[str, ...]]:
+    buffer_rows = max(REORDER_BUFFER_ROWS if buffer_rows is None else buffer_rows, 1)
+    heap: list = []
+    emitted = float("-inf")
+    late = 0
+    for seq, row in enumerate(rows):
+        entry = (_time_key(row[0]), seq, row)
+        if len(heap) < buffer_rows:
+            heapq.heappush(heap, entry)
+            continue
+        key, _, out = heapq.heappushpop(heap, entry)
+        if key < emitted:
+            late += 1
+        emitted = max(emitted, key)
+        yield out
+    while heap:
+        key, _, out = heapq.heappop(heap)
+        if key < emitted:
+            late += 1
+        emitted = max(emitted, key)
+        yield out
+    if late:
+        logger.warning(
+            "%s rows arrived more than %s rows late and were attributed out of time order; "
+            "raise REORDER_BUFFER_ROWS or use the sort order",
+            f"{late:,}", f"{buffer_rows:,}",
+        )
+
+
+def sort_rows(
+    rows: Iterable[tuple[str, ...]],
+    run_rows: int | None = None,
+    spill_dir: str | None = None,
+) -> Iterator[tuple[str, ...]]:
+    run_rows = max(SORT_RUN_ROWS if run_rows is None else run_rows, 1)
+    spill_dir = (SPILL_DIR if spill_dir is None else spill_dir) or None
+    entries = ((_time_key(row[0]), seq, row) for seq, row in enumerate(rows))
+
+    with tempfile.TemporaryDirectory(prefix="hit_runs_", dir=spill_dir) as tmp:
+        runs: list[str] = []
+        while True:
+            # seq is unique, so sorting never compares the rows themselves
+            run = sorted(itertools.islice(entries, run_rows))
+            if not run:
+                break
+            if not runs and len(run) < run_rows:
+                # everything fit in one run, nothing goes to disk
+                for _, _, row in run:
+                    yield row
+                return
+            runs.append(_write_run(tmp, len(runs), run))
+        logger.info("Sorting %d runs of up to %s rows from %s", len(runs), f"{run_rows:,}", tmp)
+
+        # more runs than the fan-in are merged into bigger runs first, to bound open files
+        count = len(runs)
+        while len(runs) > _MERGE_FAN_IN:
+            group, runs = runs[:_MERGE_FAN_IN], runs[_MERGE_FAN_IN:]
+            runs.append(_merge_into(tmp, count, group))
+            count += 1
+        for _, _, row in _merge(runs):
+            yield row
+
+
+def _write_run(tmp: str, index: int, entries: Iterable[tuple]) -> str:
+    path = os.path.join(tmp, f"run-{index:06d}.tsv")
+    with open(path, "w", newline="", encoding="utf-8") as fh:
+        writer = csv.writer(fh, delimiter="\t")
+        for key, seq, row in entries:
+            writer.writerow(("" if key == float("-inf") else key, seq, *row))
+    return path
+
+
+def _merge_into(tmp: str, index: int, paths: list[str]) -> str:
+    merged = _write_run(tmp, index, _merge(paths))
+    for path in paths:
+        os.unlink(path)
+    return merged
+
+
+def _merge(paths: list[str]) -> Iterator[tuple]:
+    files = [open(path, newline="", encoding="utf-8") for path in paths]
+    try:
+        yield from heapq.merge(*(_read_run(fh) for fh in files))
+    finally:
+        for fh in files:
+            fh.close()
+
+
+def _read_run(fh) -> Iterator[tuple]:
+    for key, seq, *row in csv.reader(fh, delimiter="\t"):
+        yield (float("-inf") if key == "" else int(key)), int(seq), tuple(row)
@@ -1,50 +1,228 @@
 
 from __future__ import annotations
-from urllib.parse import urlparse, parse_qs
-from src.config import SEARCH_ENGINE_MAP, KEYWORD_PARAMS, PURCHASE_EVENT, PRODUCT_REVENUE_IDX
+import re
+from collections import OrderedDict
+from typing import Sequence
+from urllib.parse import unquote, urlsplit
+from src.config import (
+    SEARCH_ENGINE_MAP, KEYWORD_PARAMS, PURCHASE_EVENT, PRODUCT_REVENUE_IDX, REFERRER_CACHE_SIZE,
+)
+
+# Cheap host extraction for the common "scheme://netloc" shape. It picks the same hostname as
+# urlsplit, which is then looked up in SEARCH_ENGINE_MAP (the host index) so internal and
+# other non-engine referrers are rejected without a full URL parse. Anything unusual
+# (non-ascii or bracketed netloc, tab/CR/LF that urlsplit strips) takes the full parse.
+_NETLOC_RE = re.compile(r"[A-Za-z][A-Za-z0-9+.-]*://([^/?#]*)")
+_KEYWORD_PARAM_SET = frozenset(KEYWORD_PARAMS)
+
+# The same host / query / keyword picks as regex patterns, for the column-wise backends (pandas
+# and Spark SQL). They hold for both Python re and java.util.regex.
+REFERRER_HOST_PATTERN  = r"^(?:[A-Za-z][A-Za-z0-9+.-]*:)?//(?:[^/?#]*@)?([^/?#:]*)"
+REFERRER_QUERY_PATTERN = r"^[^#]*?\?([^#]*)"
+
+
+def keyword_param_pattern(param: str) -> str:
+    # first non-empty value of param, like parse_qs (blank values are dropped)
+    return r"(?:^|&)" + re.escape(param) + r"=([^&]+)"
+
+# PURCHASE_EVENT as a whole comma-separated token, whitespace around it allowed like e.strip()
+PURCHASE_EVENT_PATTERN = r"(?:^|,)\s*" + re.escape(PURCHASE_EVENT) + r"\s*(?:,|\Z)"
+_PURCHASE_RE = re.compile(PURCHASE_EVENT_PATTERN)
 
 
 def parse_referrer(referrer: str | None) -> tuple[str | None, str | None]:
 
     if not referrer:
         return None, None
+
+    m = _NETLOC_RE.match(referrer)
+    if m is not None and _is_plain_netloc(m.group(1)) and not _has_stripped_chars(referrer):
+        hostname = m.group(1).rpartition("@")[2].partition(":")[0].lower()
+        if hostname not in SEARCH_ENGINE_MAP:
+            return None, None
+
     try:
-        parsed = urlparse(referrer)
+        parsed = urlsplit(referrer)
+        hostname = (parsed.hostname or "").lower()
     except ValueError:
         return None, None
 
-    hostname = (parsed.hostname or "").lower()
     domain = SEARCH_ENGINE_MAP.get(hostname)
     if not domain:
         return None, None
 
-    qs = parse_qs(parsed.query)
+    keyword = extract_keyword(parsed.query)
+    if keyword:
+        return domain, keyword.lower()
+        # this is the condition which captures if the end user is searching using keyword like Ipod or ipod .. its same product so revenue is capturing both as same ..
+
+    return None, None
+
+
+def split_referrer(referrer: str | None) -> tuple[str | None, str | None]:
+    # (hostname, keyword) of any referrer, before the SEARCH_ENGINE_MAP lookup: the columnar
+    # ingest stores these so a map change needs no re-ingest. parse_referrer(r) is
+    # (SEARCH_ENGINE_MAP[host], keyword) when the host is mapped and keyword is set, else (None, None).
+    if not referrer:
+        return None, None
+    try:
+        parsed = urlsplit(referrer)
+        hostname = (parsed.hostname or "").lower()
+    except ValueError:
+        return None, None
+    keyword = extract_keyword(parsed.query)
+    return hostname or None, keyword.lower() if keyword else None
+
+
+def extract_keyword(query: str) -> str | None:
+    # same answer as parse_qs(query)[param][0].strip() tried in KEYWORD_PARAMS order, but only
+    # the keyword params get decoded and no dict of value lists is built
+    first: dict[str, str] = {}
+    for pair in query.split("&"):
+        name, sep, value = pair.partition("=")
+        if not sep or not value:
+            continue
+        if "%" in name or "+" in name:
+            name = unquote(name.replace("+", " "))
+        if name in _KEYWORD_PARAM_SET and name not in first:
+            first[name] = value
+
     for param in KEYWORD_PARAMS:
-        values = qs.get(param)
-        if values and values[0].strip():
-            return domain, values[0].strip().lower()
-            #return domain, values[0].strip()
-            # this is the condition which captures if the end user is searching using keyword like Ipod or ipod .. its same product so revenue is capturing both as same ..
+        raw = first.get(param)
+        if raw is not None:
+            keyword = unquote(raw.replace("+", " ")).strip()
+            if keyword:
+                return keyword
+    return None
+
+
+def _is_plain_netloc(netloc: str) -> bool:
+    return netloc.isascii() and "[" not in netloc and "%" not in netloc
+
+
+def _has_stripped_chars(referrer: str) -> bool:
+    return "\t" in referrer or "\r" in referrer or "\n" in referrer
 
-    return None, None  
+
+class ReferrerCache:
+    # bounded LRU memo for parse_referrer: the same SERP / internal referrer repeats across a session
+
+    def __init__(self, maxsize: int = REFERRER_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[str, tuple[str | None, str | None]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    _parse = staticmethod(parse_referrer)
+
+    def parse(self, referrer: str | None) -> tuple[str | None, str | None]:
+        if not referrer or self.maxsize <= 0:
+            return self._parse(referrer)
+
+        entries = self._entries
+        result = entries.get(referrer)
+        if result is not None:
+            entries.move_to_end(referrer)
+            self.hits += 1
+            return result
+
+        self.misses += 1
+        result = self._parse(referrer)
+        entries[referrer] = result
+        if len(entries) > self.maxsize:
+            entries.popitem(last=False)
+            self.evictions += 1
+        return result
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> tuple[int, int, int]:
+        return self.hits, self.misses, self.evictions
+
+
+class InternedReferrerCache(ReferrerCache):
+    # the same LRU, but parse() answers with the search's SymbolTable pair id (-1 for no search),
+    # so a repeated referrer costs neither a tuple nor an interning lookup
+
+    def __init__(self, symbols, maxsize: int = REFERRER_CACHE_SIZE):
+        super().__init__(maxsize)
+        self.symbols = symbols
+
+    def _parse(self, referrer: str | None) -> int:
+        domain, keyword = parse_referrer(referrer)
+        return -1 if domain is None else self.symbols.pair_id(domain, keyword)
+
+
+def format_cache_stats(hits: int, misses: int, evictions: int) -> str:
+    lookups = hits + misses
+    rate = 100.0 * hits / lookups if lookups else 0.0
+    return f"referrer cache hit rate: {rate:.1f}% (hits={hits:,} misses={misses:,} evictions={evictions:,})"
+
+
+def parse_hit_time(value: str | None) -> int | None:
+    # epoch seconds, read like Spark's cast to long: blanks around it are ignored, fractions truncated
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return int(float(value))
+    except (TypeError, ValueError, OverflowError):
+        return None
 
 
 def parse_revenue(product_list: str | None, event_list: str | None) -> float:
-    if not _has_purchase(event_list or "") or not product_list:
+    if not event_list or not product_list or not _has_purchase(event_list):
         return 0.0
+    return _sum_product_revenue(product_list)
+
+
+def parse_revenue_batch(
+    product_lists: Sequence[str | None],
+    event_lists: Sequence[str | None],
+) -> list[float]:
+    revenues = [0.0] * len(event_lists)
+    for i, event_list in enumerate(event_lists):
+        # same short-circuit as _has_purchase, inlined so non-purchase rows cost one substring test
+        if event_list and PURCHASE_EVENT in event_list and _PURCHASE_RE.search(event_list):
+            product_list = product_lists[i]
+            if product_list:
+                revenues[i] = _sum_product_revenue(product_list)
+    return revenues
 
+
+def _sum_product_revenue(product_list: str) -> float:
+    # walks "Category;Name;Qty;Revenue;..." entries with find() instead of split(), so only the
+    # revenue slice itself is ever allocated; products with too few fields are skipped
     total = 0.0
-    for product in product_list.split(","):
-        fields = product.split(";")
-        if len(fields) > PRODUCT_REVENUE_IDX:
-            raw = fields[PRODUCT_REVENUE_IDX].strip()
-            if raw:
+    end_of_list = len(product_list)
+    start = 0
+    while start <= end_of_list:
+        end = product_list.find(",", start)
+        if end == -1:
+            end = end_of_list
+
+        pos = start
+        for _ in range(PRODUCT_REVENUE_IDX):
+            pos = product_list.find(";", pos, end)
+            if pos == -1:
+                break
+            pos += 1
+        else:
+            stop = product_list.find(";", pos, end)
+            if stop == -1:
+                stop = end
+            if stop > pos:
                 try:
-                    total += float(raw)
+                    total += float(product_list[pos:stop])
                 except ValueError:
                     pass
+        start = end + 1
     return total
 
 
 def _has_purchase(event_list: str) -> bool:
-    return PURCHASE_EVENT in {e.strip() for e in event_list.split(",") if e.strip()}
+    # the substring test rejects most rows without running the regex
+    return PURCHASE_EVENT in event_list and _PURCHASE_RE.search(event_list) is not None
@@ -1,19 +1,79 @@
 
 from __future__ import annotations
-import csv
+import importlib.util
 import logging
+import multiprocessing as mp
+import os
+import pickle
+import tempfile
 from abc import ABC, abstractmethod
 from collections import defaultdict
+from typing import NamedTuple
 
-from src.config import CHUNK_SIZE, TSV_DELIMITER
-from src.parsers import parse_referrer, parse_revenue
+from src.checkpoint import fingerprint, load_checkpoint, save_checkpoint
+from src.compression import detect_compression
+from src.s3 import is_s3
+from src.config import (
+    ATTRIBUTION_WINDOW_SECONDS, AUTO_PARALLEL_BYTES, AUTO_SPARK_BYTES, CHUNK_SIZE, CHUNKED_ORDER,
+    PARALLEL_RANGES_PER_WORKER, PARALLEL_WORKERS,
+)
+from src.metrics import Metrics
+from src.ordering import reorder_rows, sort_rows
+from src.parsers import InternedReferrerCache, format_cache_stats, parse_hit_time, parse_revenue
+from src.search_state import PAIR_BITS, PAIR_MASK, LastSearchStore, iter_detached, pack_ip
+from src.symbols import SymbolTable
+from src.readers import (
+    chunked, complete_end, input_size, is_dataset, iter_projected_chunks, iter_range_rows, project_rows,
+    read_header, resolve_inputs, split_ranges,
+)
 
 logger = logging.getLogger(__name__)
 
+# the only hit columns attribution needs; everything else is dropped at read time
+HIT_COLUMNS: tuple[str, ...] = ("hit_time_gmt", "ip", "referrer", "event_list", "product_list")
+
+
+def auto_backend(input_paths: list[str], workers: int | None = None, order: str = "file") -> str:
+    # PROCESSOR=auto: "chunked", "parallel" or "spark" by the size of the input on disk
+    if not input_paths or any(is_s3(p) for p in input_paths):
+        # only the chunked backend streams s3:// objects
+        return "chunked"
+    total = sum(input_size(p) for p in input_paths)
+    if total >= AUTO_SPARK_BYTES and importlib.util.find_spec("pyspark") is not None:
+        return "spark"
+    cores = workers or PARALLEL_WORKERS or os.cpu_count() or 1
+    # a single compressed file is one byte range, a pool would only add start-up time; a columnar
+    # dataset is read by the chunked backend only
+    splittable = len(input_paths) > 1 or not (is_dataset(input_paths[0]) or detect_compression(input_paths[0]))
+    if total >= AUTO_PARALLEL_BYTES and cores > 1 and splittable and order == "file":
+        return "parallel"
+    return "chunked"
+
+
 class BaseProcessor(ABC):
 
-    def __init__(self, input_path: str):
+    def __init__(
+        self,
+        input_path: str,
+        attribution_window: int | None = None,
+        metrics: Metrics | None = None,
+        input_paths: list[str] | None = None,
+    ):
         self.input_path = input_path
+        # a directory, glob or manifest expands to several files, read in hit_time_gmt order;
+        # input_paths is resolve_inputs(input_path) when the caller already has it
+        self.input_paths = resolve_inputs(input_path) if input_paths is None else input_paths
+        self.attribution_window = (
+            ATTRIBUTION_WINDOW_SECONDS if attribution_window is None else attribution_window
+        )
+        # stage timers and counters of the last run, main.py writes them next to the report
+        self.metrics = metrics or Metrics()
+        self.metrics.set("backend", type(self).__name__)
+
+    def _count_input_bytes(self) -> None:
+        sizes = [input_size(p) for p in self.input_paths]
+        if None not in sizes:
+            self.metrics.count("bytes_read", sum(sizes))
 
     def process(self) -> dict[tuple[str, str], float]:
 
@@ -26,52 +86,428 @@ class BaseProcessor(ABC):
 
 class ChunkedProcessor(BaseProcessor):
 
+    def __init__(
+        self,
+        input_path: str,
+        attribution_window: int | None = None,
+        order: str | None = None,
+        metrics: Metrics | None = None,
+        input_paths: list[str] | None = None,
+    ):
+        super().__init__(input_path, attribution_window, metrics, input_paths)
+        self.order = CHUNKED_ORDER if order is None else order
+        if self.order not in ("file", "reorder", "sort"):
+            raise ValueError(f"Unknown chunked order: {self.order!r}")
+
     def describe(self) -> str:
-        return f"ChunkedProcessor | chunk_size={CHUNK_SIZE:,} rows | file={self.input_path}"
+        return (
+            f"ChunkedProcessor | chunk_size={CHUNK_SIZE:,} rows | order={self.order} | "
+            f"window={self.attribution_window or 'unbounded'} | file={self.input_path}"
+        )
 
     def process(self) -> dict[tuple[str, str], float]:
-        last_search: dict[str, tuple[str, str]] = {}         
-        revenue_map: dict[tuple[str, str], float] = defaultdict(float) 
+        # revenue per pair id, decoded to (engine, keyword) strings once at the end
+        symbols = SymbolTable()
+        totals: defaultdict[int, float] = defaultdict(float)
+
+        with LastSearchStore(window=self.attribution_window, symbols=symbols) as last_search:
+            if is_dataset(self.input_path):
+                # ingested columns: no tokenizing or parsing, the dataset comes parsed
+                from src.columnar import iter_dataset_chunks
+                parsed = self.metrics.timed(
+                    "read", iter_dataset_chunks(self.input_path, symbols, time_sorted=self.order != "file")
+                )
+                self._attribute(parsed, last_search, totals)
+            else:
+                referrers = InternedReferrerCache(symbols)
+                parsed = self._parse_chunks(self._iter_chunks(), referrers)
+                self._attribute(parsed, last_search, totals, referrers)
+        self._count_input_bytes()
+        return symbols.decode(totals)
+
+    def _parse_chunks(self, chunks, referrers: InternedReferrerCache):
+        # each chunk goes column-wise through the parsers, then row by row through the state in
+        # _attribute, so every stage is timed once per chunk rather than once per row
+        metrics = self.metrics
+        for chunk in metrics.timed("read", chunks):
+            with metrics.stage("parse_referrer"):
+                search_ids = [referrers.parse(referrer.strip()) for _, _, referrer, _, _ in chunk]
+            with metrics.stage("parse_revenue"):
+                # both parsers already skip blanks around tokens, no strip() needed
+                revenues = [parse_revenue(products, events) for _, _, _, events, products in chunk]
+            yield chunk, search_ids, revenues
+
+    def _attribute(
+        self,
+        parsed_chunks,
+        last_search: LastSearchStore,
+        totals: defaultdict[int, float],
+        referrers: InternedReferrerCache | None = None,
+    ) -> None:
+        # parsed_chunks: (rows starting with hit_time_gmt, ip; last_search.symbols pair id of the
+        # search or -1 per row; revenue per row). totals is revenue per pair id.
+        windowed = bool(last_search.window)
+        metrics = self.metrics
+        debug = logger.isEnabledFor(logging.DEBUG)
 
         total_rows = 0
         purchase_rows = 0
 
-        for chunk in self._iter_chunks():
-            for row in chunk:
-                total_rows += 1
-                ip           = (row.get("ip")           or "").strip()
-                referrer     = (row.get("referrer")     or "").strip()
-                event_list   = (row.get("event_list")   or "").strip()
-                product_list = (row.get("product_list") or "").strip()
-
-             
-                domain, keyword = parse_referrer(referrer)
-                if domain and keyword:
-                    last_search[ip] = (domain, keyword)
-
-         
-                revenue = parse_revenue(product_list, event_list)
-                if revenue > 0 and ip in last_search:
-                    purchase_rows += 1
-                    key = last_search[ip]
-                    revenue_map[key] += revenue
-                    logger.debug("$%.2f → %s / '%s'  (ip=%s)", revenue, key[0], key[1], ip)
+        for chunk, search_ids, revenues in parsed_chunks:
+            total_rows += len(chunk)
+            with metrics.stage("attribute"):
+                for row, pair_id, revenue in zip(chunk, search_ids, revenues):
+                    if pair_id < 0 and revenue <= 0:
+                        continue
+                    # with a window, a hit without a usable time neither opens nor uses a search
+                    time = parse_hit_time(row[0]) if windowed else 0
+                    if time is None:
+                        continue
+                    key = pack_ip(row[1].strip())
+                    if pair_id >= 0:
+                        last_search.put_id(key, pair_id, time)
+                    if revenue > 0:
+                        # one lookup per purchase, last_search may have to go to disk for it
+                        found = last_search.lookup_id(key, time)
+                        if found is not None:
+                            purchase_rows += 1
+                            totals[found] += revenue
+                            if debug:
+                                engine, keyword = last_search.symbols.pair(found)
+                                logger.debug("$%.2f → %s / '%s'  (ip=%s)", revenue, engine, keyword, row[1])
+            metrics.progress(total_rows)
 
+        metrics.count("rows", total_rows)
+        metrics.count("purchase_rows", purchase_rows)
+        metrics.count("last_search_spills", last_search.spills)
+        metrics.count("last_search_evicted", last_search.evicted)
+        metrics.set("unique_keywords", len(totals))
+        cache_stats = ""
+        if referrers is not None:
+            hits, misses, evictions = referrers.stats()
+            metrics.count("referrer_cache_hits", hits)
+            metrics.count("referrer_cache_misses", misses)
+            metrics.count("referrer_cache_evictions", evictions)
+            cache_stats = " | " + format_cache_stats(hits, misses, evictions)
         logger.info(
-            "Processed %s rows | purchases attributed: %d | unique (engine,keyword): %d",
-            f"{total_rows:,}", purchase_rows, len(revenue_map),
+            "Processed %s rows | purchases attributed: %d | unique (engine,keyword): %d | "
+            "searches evicted: %s%s",
+            f"{total_rows:,}", purchase_rows, len(totals), f"{last_search.evicted:,}", cache_stats,
         )
-        return dict(revenue_map)
 
     def _iter_chunks(self):
+        if self.order == "file":
+            for path in self.input_paths:
+                yield from iter_projected_chunks(path, HIT_COLUMNS, CHUNK_SIZE)
+            return
+
+        rows = (
+            row
+            for path in self.input_paths
+            for chunk in iter_projected_chunks(path, HIT_COLUMNS, CHUNK_SIZE)
+            for row in chunk
+        )
+        ordered = reorder_rows(rows) if self.order == "reorder" else sort_rows(rows)
+        yield from chunked(ordered, CHUNK_SIZE)
+
+
+class IncrementalProcessor(ChunkedProcessor):
+    """Chunked attribution that resumes an append-only file from a local checkpoint.
+
+    Only bytes past the checkpointed offset are read; the stored last search per IP and the
+    running revenue map carry the earlier rows, so the totals match a full run.
+    """
+
+    def __init__(
+        self,
+        input_path: str,
+        checkpoint_path: str,
+        attribution_window: int | None = None,
+        order: str | None = None,
+        metrics: Metrics | None = None,
+        input_paths: list[str] | None = None,
+    ):
+        super().__init__(input_path, attribution_window, order, metrics, input_paths)
+        if self.order != "file":
+            # the checkpoint is a file offset, so resumed runs can only follow file order
+            raise ValueError(f"Incremental mode reads in file order, not {self.order!r}")
+        if len(self.input_paths) != 1 or is_dataset(input_path):
+            raise ValueError(
+                f"Incremental mode needs a single input file, {input_path!r} has {len(self.input_paths)}"
+            )
+        self.checkpoint_path = checkpoint_path
+
+    def describe(self) -> str:
+        return (
+            f"IncrementalProcessor | chunk_size={CHUNK_SIZE:,} rows | "
+            f"window={self.attribution_window or 'unbounded'} | checkpoint={self.checkpoint_path} | "
+            f"file={self.input_path}"
+        )
+
+    def process(self) -> dict[tuple[str, str], float]:
+        path = self.input_paths[0]
+        if is_s3(path):
+            raise ValueError(f"Incremental mode needs a local file, got {path!r}")
+        if detect_compression(path):
+            raise ValueError(f"Incremental mode needs uncompressed input, {path!r} is compressed")
+        with self.metrics.stage("checkpoint_load"):
+            state = load_checkpoint(self.checkpoint_path, path, self.attribution_window)
+        end = complete_end(path)
+        if state.offset >= end:
+            logger.info("No new data past offset %s, reusing checkpointed totals", f"{state.offset:,}")
+            return dict(state.revenue_map)
+
+        header, data_start = read_header(path)
+        start = max(state.offset, data_start)
+        logger.info("Resuming at offset %s, %s new bytes", f"{start:,}", f"{end - start:,}")
+        self.metrics.count("bytes_read", end - start)
+
+        symbols = SymbolTable()
+        totals: defaultdict[int, float] = defaultdict(float, symbols.encode(state.revenue_map))
+        chunks = chunked(
+            project_rows(iter_range_rows(path, start, end), header, HIT_COLUMNS), CHUNK_SIZE
+        )
+        with LastSearchStore(window=self.attribution_window, symbols=symbols) as last_search:
+            # streamed from the checkpoint, past LAST_SEARCH_MEMORY_ENTRIES it spills like a full run
+            for ip, domain, keyword, time in state.last_search:
+                last_search.put_id(pack_ip(ip), symbols.pair_id(domain, keyword), time)
+            referrers = InternedReferrerCache(symbols)
+            self._attribute(self._parse_chunks(chunks, referrers), last_search, totals, referrers)
+
+            state.offset = end
+            state.fingerprint = fingerprint(path, end)
+            state.last_search = last_search.rows()
+            state.revenue_map = symbols.decode(totals)
+            with self.metrics.stage("checkpoint_save"):
+                save_checkpoint(self.checkpoint_path, state, self.attribution_window)
+        return state.revenue_map
+
+
+class ParallelProcessor(ChunkedProcessor):
+    """Splits the input files into newline-aligned byte ranges that workers read and attribute on their own.
+
+    Each worker returns a segment summary: purchases it could attribute inside its range,
+    purchases that came before any search of their IP in the range (pending) and the last
+    search per IP. Stitching the segments in file order gives the same result as one pass.
+    """
+
+    def __init__(
+        self,
+        input_path: str,
+        workers: int | None = None,
+        attribution_window: int | None = None,
+        order: str | None = None,
+        metrics: Metrics | None = None,
+        input_paths: list[str] | None = None,
+    ):
+        super().__init__(input_path, attribution_window, order, metrics, input_paths)
+        if self.order != "file":
+            raise ValueError(f"The parallel backend stitches byte ranges in file order, not {self.order!r}")
+        if is_dataset(input_path):
+            raise ValueError(f"{input_path!r} is a columnar dataset, it is read by the chunked or Spark backend")
+        self.workers = workers or PARALLEL_WORKERS or os.cpu_count() or 1
+
+    def describe(self) -> str:
+        return (
+            f"ParallelProcessor | workers={self.workers} | "
+            f"ranges={self.workers * PARALLEL_RANGES_PER_WORKER} | "
+            f"window={self.attribution_window or 'unbounded'} | file={self.input_path}"
+        )
+
+    def process(self) -> dict[tuple[str, str], float]:
+        if any(is_s3(p) for p in self.input_paths):
+            raise ValueError("s3:// input is streamed by the chunked backend, not split into byte ranges")
+        metrics = self.metrics
+        tasks = []
+        with metrics.stage("split"):
+            for path, n in self._ranges_per_file():
+                header, ranges = split_ranges(path, n)
+                tasks.extend(
+                    (path, header, len(tasks) + i, start, end, self.attribution_window)
+                    for i, (start, end) in enumerate(ranges)
+                )
+
+        # workers are not timed stage by stage, "attribute" is the pool's wall time
+        with metrics.stage("attribute"), mp.get_context().Pool(min(self.workers, max(len(tasks), 1))) as pool:
+            revenue_map, total_rows, purchase_rows, cache_stats, spills = _stitch_segments(
+                pool.imap(_attribute_range, tasks), self.attribution_window
+            )
+
+        metrics.count("rows", total_rows)
+        metrics.count("purchase_rows", purchase_rows)
+        for name, value in zip(("hits", "misses", "evictions"), cache_stats):
+            metrics.count(f"referrer_cache_{name}", value)
+        metrics.count("last_search_spills", spills)
+        metrics.set("workers", self.workers)
+        metrics.set("ranges", len(tasks))
+        metrics.set("unique_keywords", len(revenue_map))
+        self._count_input_bytes()
+
+        logger.info(
+            "Processed %s rows from %d files in %d ranges on %d workers | purchases attributed: %d | "
+            "unique (engine,keyword): %d | %s",
+            f"{total_rows:,}", len(self.input_paths), len(tasks), self.workers, purchase_rows,
+            len(revenue_map), format_cache_stats(*cache_stats),
+        )
+        return revenue_map
+
+    def _ranges_per_file(self) -> list[tuple[str, int]]:
+        # byte ranges are shared out by file size, every file gets at least one; ranges from all
+        # files go into one pool and are stitched in file order, then range order
+        target = self.workers * PARALLEL_RANGES_PER_WORKER
+        if len(self.input_paths) == 1:
+            return [(self.input_paths[0], target)]
+        sizes = [os.path.getsize(p) for p in self.input_paths]
+        total = sum(sizes) or 1
+        return [(p, max(1, round(target * size / total))) for p, size in zip(self.input_paths, sizes)]
+
+
+class _Segment(NamedTuple):
+    rows: int
+    # keyed by the range's own pair ids, `pairs` decodes them
+    attributed: dict[int, list[tuple[tuple[int, int], float]]]
+    # (packed ip, seq, revenue, hit time): the hit time is for the window check at stitch time
+    pending: _SpillList
+    # LastSearchStore.detach() of the range's store, read back with iter_detached
+    last_search: tuple[str | None, dict[int | str, int]]
+    pairs: list[tuple[str, str]]
+    cache_stats: tuple[int, int, int]
+    spills: int
+
+
+class _SpillList:
+    """Append-only row list that moves its rows to a pickle file past max_rows.
+
+    Iterating gives every row in append order, once: the file is deleted after it is read. Like a
+    detached LastSearchStore it can be handed to another process as long as the file stays put.
+    """
+
+    def __init__(self, max_rows: int = 0, spill_dir: str | None = None):
+        self.max_rows = max_rows
+        self.spill_dir = spill_dir
+        self.spills = 0
+        self._rows: list[tuple] = []
+        self._path: str | None = None
+
+    def append(self, row: tuple) -> None:
+        self._rows.append(row)
+        if self.max_rows and len(self._rows) >= self.max_rows:
+            self._spill()
+
+    def _spill(self) -> None:
+        if self._path is None:
+            fd, self._path = tempfile.mkstemp(prefix="pending_", suffix=".pickle", dir=self.spill_dir)
+            os.close(fd)
+        with open(self._path, "ab") as fh:
+            pickle.dump(self._rows, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        self._rows = []
+        self.spills += 1
+
+    def __iter__(self):
+        if self._path is not None:
+            path, self._path = self._path, None
+            try:
+                with open(path, "rb") as fh:
+                    while True:
+                        try:
+                            batch = pickle.load(fh)
+                        except EOFError:
+                            break
+                        yield from batch
+            finally:
+                os.unlink(path)
+        yield from self._rows
+
+
+def _attribute_range(task) -> _Segment:
+    path, header, index, start, end, window = task
+
+    symbols = SymbolTable()
+    # no window here: a range keeps every search so stitching sees what a single pass would; the
+    # store and the pending purchases spill past LAST_SEARCH_MEMORY_ENTRIES like the serial state
+    last_search = LastSearchStore(window=0, symbols=symbols)
+    # seq = (range index, row in range) orders every purchase globally for the merge
+    attributed: dict[int, list] = defaultdict(list)
+    pending = _SpillList(last_search.max_entries, last_search.spill_dir)
+    referrers = InternedReferrerCache(symbols)
+
+    rows = 0
+    for hit_time, ip, referrer, event_list, product_list in project_rows(
+        iter_range_rows(path, start, end), header, HIT_COLUMNS
+    ):
+        seq = (index, rows)
+        rows += 1
+        pair_id = referrers.parse(referrer.strip())
+        revenue = parse_revenue(product_list.strip(), event_list.strip())
+        if pair_id < 0 and revenue <= 0:
+            continue
+        time = parse_hit_time(hit_time) if window else 0
+        if time is None:
+            continue
+        key = pack_ip(ip.strip())
+
+        if pair_id >= 0:
+            last_search.put_id(key, pair_id, time)
+
+        if revenue > 0:
+            found = last_search.find_id(key)
+            if found is None:
+                pending.append((key, seq, revenue, time))
+            elif not window or time - found[0] <= window:
+                attributed[found[1]].append((seq, revenue))
+
+    return _Segment(
+        rows, dict(attributed), pending, last_search.detach(), symbols.pairs(), referrers.stats(),
+        last_search.spills + pending.spills,
+    )
+
+
+def _stitch_segments(
+    segments, window: int = 0,
+) -> tuple[dict[tuple[str, str], float], int, int, tuple[int, int, int], int]:
+    symbols = SymbolTable()
+    contributions: dict[int, list] = defaultdict(list)
+    total_rows = 0
+    purchase_rows = 0
+    cache_stats = (0, 0, 0)
+    spills = 0
+
+    # each range's last_search is bounded by the range, only the stitched one covers the input
+    with LastSearchStore(window=window, symbols=symbols) as last_search:
+        for seg in segments:
+            total_rows += seg.rows
+            cache_stats = tuple(a + b for a, b in zip(cache_stats, seg.cache_stats))
+            spills += seg.spills
+            # the range's pair ids, as ids of the stitched symbol table
+            ids = [symbols.pair_id(engine, keyword) for engine, keyword in seg.pairs]
+            # pending purchases resolve against searches from earlier ranges only
+            for key, seq, revenue, time in seg.pending:
+                pair_id = last_search.lookup_id(key, time)
+                if pair_id is not None:
+                    contributions[pair_id].append((seq, revenue))
+                    purchase_rows += 1
+            for pair_id, purchases in seg.attributed.items():
+                contributions[ids[pair_id]].extend(purchases)
+                purchase_rows += len(purchases)
+            for key, value in iter_detached(seg.last_search):
+                last_search.put_id(key, ids[value & PAIR_MASK], value >> PAIR_BITS)
+        spills += last_search.spills
+
+    return symbols.decode(_sum_in_order(contributions)), total_rows, purchase_rows, cache_stats, spills
+
+
+def _sum_in_order(
+    contributions: dict[int, list[tuple[tuple[int, int], float]]],
+) -> dict[int, float]:
+    # summing in global row order keeps the float totals identical to the serial path, and
+    # inserting keys in first-attribution order keeps ties sorted the same way in write_output
+    for purchases in contributions.values():
+        purchases.sort()
 
-        with open(self.input_path, encoding="utf-8", errors="replace") as fh:
-            reader = csv.DictReader(fh, delimiter=TSV_DELIMITER)
-            chunk = []
-            for row in reader:
-                chunk.append(row)
-                if len(chunk) == CHUNK_SIZE:
-                    yield chunk
-                    chunk = []      
-            if chunk:              
-                yield chunk
+    totals: dict[int, float] = {}
+    for key in sorted(contributions, key=lambda k: contributions[k][0][0]):
+        total = 0.0
+        for _, revenue in contributions[key]:
+            total += revenue
+        totals[key] = total
+    return totals
@@ -0,0 +1,115 @@
+from __future__ import annotations
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+from collections import Counter
+
+from src.config import PROFILE_SAMPLE_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# PROFILE=cprofile / sample in main.py wraps the run in one of these. cProfile counts every
+# call, so it is exact but slows the row loops down severalfold; the sampler looks at the main
+# thread's stack every PROFILE_SAMPLE_INTERVAL seconds from a background thread and costs little.
+# Only the driver process is profiled: parallel workers and Spark executors are not.
+
+PROFILE_MODES = ("cprofile", "sample")
+
+
+class Profiler:
+
+    def __init__(self, mode: str, interval: float | None = None):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode: {mode!r}")
+        self.mode = mode
+        self.interval = PROFILE_SAMPLE_INTERVAL if interval is None else interval
+        self._profile: cProfile.Profile | None = None
+        self._stacks: Counter[str] = Counter()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        if self.mode == "cprofile":
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+            return
+        target = threading.get_ident()
+        self._thread = threading.Thread(target=self._sample, args=(target,), name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._profile is not None:
+            self._profile.disable()
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+
+    def __enter__(self) -> Profiler:
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.stop()
+
+    def _sample(self, target: int) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self._stacks[";".join(reversed(stack))] += 1
+
+    def top(self, n: int = 15) -> list[dict]:
+        """The n functions with the most own time: seconds for cprofile, samples for the sampler."""
+        if self.mode == "cprofile":
+            stats = pstats.Stats(self._profile)
+            entries = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:n]
+            return [
+                {
+                    "function": f"{name} ({os.path.basename(filename)}:{line})",
+                    "calls": calls,
+                    "own_seconds": round(own, 3),
+                    "cumulative_seconds": round(cumulative, 3),
+                }
+                for (filename, line, name), (_, calls, own, cumulative, _) in entries
+            ]
+        own: Counter[str] = Counter()
+        inclusive: Counter[str] = Counter()
+        for stack, samples in self._stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += samples
+            for frame in set(frames):
+                inclusive[frame] += samples
+        total = sum(self._stacks.values()) or 1
+        return [
+            {
+                "function": function,
+                "own_share": round(samples / total, 3),
+                "inclusive_share": round(inclusive[function] / total, 3),
+            }
+            for function, samples in own.most_common(n)
+        ]
+
+    def save(self, path: str) -> None:
+        # cprofile: a pstats file (snakeviz, python -m pstats); sample: folded stacks, one
+        # "frame;frame;... count" line per stack, for flamegraph.pl or speedscope
+        if self.mode == "cprofile":
+            self._profile.dump_stats(path)
+            return
+        with open(path, "w", encoding="utf-8") as fh:
+            for stack, samples in self._stacks.most_common():
+                fh.write(f"{stack} {samples}\n")
+
+    def log_top(self, n: int = 15) -> None:
+        out = io.StringIO()
+        for entry in self.top(n):
+            values = " ".join(f"{k}={v}" for k, v in entry.items() if k != "function")
+            out.write(f"\n  {entry['function']}  {values}")
+        logger.info("Profile (%s), top %d by own time:%s", self.mode, n, out.getvalue())
@@ -0,0 +1,34 @@
+from __future__ import annotations
+import heapq
+from operator import itemgetter
+from typing import Iterable
+
+# Report row selection. The dashboards read the top keywords per engine, so with a top_k the
+# long tail never gets sorted: one bounded min-heap per engine keeps the k best rows seen so far.
+
+
+def top_revenue(
+    items: Iterable[tuple[tuple[str, str], float]],
+    top_k: int = 0,
+    min_revenue: float = 0.0,
+) -> list[tuple[tuple[str, str], float]]:
+    # Rows at or above min_revenue, at most top_k per engine (0 keeps all), by revenue descending.
+    # Ties keep input order, the same as sorted(..., reverse=True) over the whole map.
+    if min_revenue:
+        items = (item for item in items if item[1] >= min_revenue)
+    if not top_k:
+        return sorted(items, key=itemgetter(1), reverse=True)
+
+    heaps: dict[str, list] = {}
+    for idx, (key, revenue) in enumerate(items):
+        heap = heaps.setdefault(key[0], [])
+        # -idx ranks the earlier of two equal revenues higher, the heap root is the row to drop
+        entry = (revenue, -idx, key)
+        if len(heap) < top_k:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+
+    selected = [entry for heap in heaps.values() for entry in heap]
+    selected.sort(reverse=True)
+    return [(key, revenue) for revenue, _, key in selected]
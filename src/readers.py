@@ -0,0 +1,223 @@
+from __future__ import annotations
+import csv
+import glob
+import io
+import mmap
+import os
+from itertools import islice
+from operator import itemgetter
+from typing import Iterable, Iterator
+
+from src.compression import detect_compression, open_binary, open_plain
+from src.config import (
+    DATASET_MANIFEST, MANIFEST_SUFFIX, METRICS_SUFFIX, OUTPUT_SUFFIX, PROFILE_SUFFIXES, READ_BLOCK_SIZE,
+    TSV_DELIMITER,
+)
+
+# Byte-range reading for the raw hit log.
+# Records never span lines (same assumption as multiLine=false in the Spark reader), so any
+# offset right after a b"\n" is a safe place to start an independent csv tokenizer.
+# Quoted fields like user_agent are fine as long as the quotes close on the same line.
+
+# the report and the files written next to it are never read back as input
+_REPORT_SUFFIXES = (OUTPUT_SUFFIX, METRICS_SUFFIX, *PROFILE_SUFFIXES.values())
+
+
+def resolve_inputs(path: str) -> list[str]:
+    # A directory, a glob or a manifest expands to its files, ordered by the first hit_time_gmt of
+    # each so per-IP state carries over file boundaries in time order (hourly logs are appended
+    # in time order, so the first row is the file's earliest). Anything else, including s3://
+    # prefixes that Spark lists itself, is passed through as a single input.
+    if "://" in path or is_dataset(path):
+        return [path]
+    if path.endswith(MANIFEST_SUFFIX) and os.path.isfile(path):
+        paths = _read_manifest(path)
+    elif os.path.isdir(path):
+        paths = [
+            os.path.join(path, name) for name in os.listdir(path)
+            if not name.startswith(".") and not name.endswith(_REPORT_SUFFIXES)
+        ]
+    elif os.path.isfile(path) or not glob.has_magic(path):
+        # an existing file is taken as named, even with [ or ? in it
+        return [path]
+    else:
+        paths = glob.glob(path)
+
+    files = sorted(p for p in paths if os.path.isfile(p))
+    if len(files) < 2:
+        return files
+    return sorted(files, key=_first_hit_time)
+
+
+def _read_manifest(manifest: str) -> list[str]:
+    base = os.path.dirname(manifest)
+    paths: list[str] = []
+    with open(manifest, encoding="utf-8") as fh:
+        for line in fh:
+            entry = line.strip()
+            if not entry or entry.startswith("#"):
+                continue
+            entry = os.path.join(base, entry)
+            if glob.has_magic(entry):
+                paths.extend(glob.glob(entry))
+            elif os.path.isfile(entry):
+                paths.append(entry)
+            else:
+                raise FileNotFoundError(f"{manifest} lists a missing file: {entry}")
+    return paths
+
+
+def _first_hit_time(path: str) -> float:
+    # files without a readable first hit_time_gmt go last, in name order (sorted() is stable)
+    with open_plain(path) as fh:
+        header = _tokenize_line(fh.readline())
+        row = _tokenize_line(fh.readline())
+    try:
+        return float(row[header.index("hit_time_gmt")])
+    except (ValueError, IndexError):
+        return float("inf")
+
+
+def is_dataset(path: str) -> bool:
+    # a columnar dataset from ingest.py, read through src.columnar instead of as text
+    return os.path.isfile(os.path.join(path, DATASET_MANIFEST))
+
+
+def input_size(path: str) -> int | None:
+    # bytes on disk (compressed size for compressed input); s3:// objects are not looked up
+    if "://" in path:
+        return None
+    if is_dataset(path):
+        return sum(
+            os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names
+        )
+    return os.path.getsize(path)
+
+
+def read_header(path: str) -> tuple[list[str], int]:
+    # for compressed input the offset counts decompressed bytes, nothing can seek to it
+    with open_plain(path) as fh:
+        line = fh.readline()
+    return _tokenize_line(line), len(line)
+
+
+def split_ranges(path: str, n: int) -> tuple[list[str], list[tuple[int, int]]]:
+    header, data_start = read_header(path)
+    size = os.path.getsize(path)
+    if detect_compression(path):
+        # a compressed stream has no random access, the whole file is one range
+        return header, [(0, size)] if size else []
+    if size <= data_start:
+        return header, []
+
+    bounds = [data_start]
+    step = (size - data_start) / max(n, 1)
+    with open(path, "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for i in range(1, max(n, 1)):
+            target = int(data_start + i * step)
+            nl = mm.find(b"\n", max(target - 1, data_start))
+            boundary = size if nl == -1 else nl + 1
+            if boundary >= size:
+                break
+            if boundary > bounds[-1]:
+                bounds.append(boundary)
+    bounds.append(size)
+    return header, list(zip(bounds, bounds[1:]))
+
+
+def complete_end(path: str) -> int:
+    # offset just past the last b"\n"; a trailing line without one may still be being appended
+    size = os.path.getsize(path)
+    if size == 0:
+        return 0
+    with open(path, "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return mm.rfind(b"\n") + 1
+
+
+def iter_range_rows(
+    path: str,
+    start: int,
+    end: int,
+    block_size: int = READ_BLOCK_SIZE,
+) -> Iterator[list[str]]:
+    # decodes and tokenizes [start, end) in newline-aligned blocks so memory stays at ~block_size
+    if end <= start:
+        return
+    if detect_compression(path):
+        # split_ranges gives compressed files a single range, read it as a stream past the header
+        with open_text(path) as fh:
+            reader = csv.reader(fh, delimiter=TSV_DELIMITER)
+            next(reader, None)
+            yield from (row for row in reader if row)
+        return
+    with open(path, "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = start
+        while pos < end:
+            stop = min(pos + block_size, end)
+            if stop < end:
+                nl = mm.rfind(b"\n", pos, stop)
+                if nl == -1:
+                    nl = mm.find(b"\n", stop, end)
+                stop = end if nl == -1 else nl + 1
+            yield from _tokenize_block(mm[pos:stop])
+            pos = stop
+
+
+def iter_projected_chunks(
+    path: str,
+    columns: tuple[str, ...],
+    chunk_size: int,
+) -> Iterator[list[tuple[str, ...]]]:
+    # csv.reader + itemgetter instead of DictReader: no per-row dict, and the
+    # unprojected fields are dropped with the row list straight away
+    with open_text(path) as fh:
+        reader = csv.reader(fh, delimiter=TSV_DELIMITER)
+        header = next(reader, [])
+        yield from chunked(project_rows((row for row in reader if row), header, columns), chunk_size)
+
+
+def open_text(path: str) -> io.TextIOWrapper:
+    # gzip / bz2 / zstd input is decompressed on a background thread while the caller parses
+    return io.TextIOWrapper(open_binary(path), encoding="utf-8", errors="replace", newline="")
+
+
+def chunked(rows: Iterable[tuple[str, ...]], chunk_size: int) -> Iterator[list[tuple[str, ...]]]:
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def project_rows(
+    rows: Iterable[list[str]],
+    header: list[str],
+    columns: tuple[str, ...],
+) -> Iterator[tuple[str, ...]]:
+    idx = [header.index(c) if c in header else None for c in columns]
+    if None in idx or len(idx) < 2:
+        for row in rows:
+            yield _project_slow(row, idx)
+        return
+
+    get = itemgetter(*idx)
+    width = max(idx) + 1
+    for row in rows:
+        yield get(row) if len(row) >= width else _project_slow(row, idx)
+
+
+def _project_slow(row: list[str], idx: list[int | None]) -> tuple[str, ...]:
+    # short rows and missing columns read as "" (DictReader gives None, the processors treat both the same)
+    return tuple(row[i] if i is not None and i < len(row) else "" for i in idx)
+
+
+def _tokenize_block(block: bytes) -> Iterator[list[str]]:
+    text = io.TextIOWrapper(io.BytesIO(block), encoding="utf-8", errors="replace", newline="")
+    for row in csv.reader(text, delimiter=TSV_DELIMITER):
+        if row:
+            yield row
+
+
+def _tokenize_line(line: bytes) -> list[str]:
+    return next(_tokenize_block(line), [])
@@ -0,0 +1,151 @@
+from __future__ import annotations
+import functools
+import io
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterator
+
+from src.config import READ_BLOCK_SIZE, S3_CONCURRENCY, S3_PART_SIZE, S3_PREFETCH_RANGES, S3_RANGE_SIZE
+from src.streams import PrefetchReader, map_ordered
+
+# s3:// input is streamed with concurrent ranged GETs: up to S3_CONCURRENCY requests run at once
+# on one shared client (its connection pool is sized to match), at most S3_PREFETCH_RANGES
+# ranges are held ahead of the parser, and the ranges are handed over in order as they arrive.
+# Every GET is pinned to the ETag seen when the object was opened, so an object replaced
+# mid-read fails instead of mixing two versions. Output goes the other way through S3Writer,
+# a multipart upload with the same concurrency limit.
+
+
+def is_s3(path: str) -> bool:
+    return path.startswith("s3://")
+
+
+def split_s3_path(path: str) -> tuple[str, str]:
+    bucket, _, key = path[len("s3://"):].partition("/")
+    return bucket, key
+
+
+@functools.lru_cache(maxsize=None)
+def get_client():
+    import boto3
+    from botocore.config import Config
+    return boto3.client(
+        "s3",
+        config=Config(max_pool_connections=S3_CONCURRENCY, retries={"max_attempts": 5, "mode": "standard"}),
+    )
+
+
+def read_s3_head(path: str, n: int) -> bytes:
+    bucket, key = split_s3_path(path)
+    try:
+        return get_client().get_object(Bucket=bucket, Key=key, Range=f"bytes=0-{n - 1}")["Body"].read()
+    except get_client().exceptions.NoSuchKey as exc:
+        raise FileNotFoundError(path) from exc
+    except get_client().exceptions.ClientError as exc:
+        # a zero-byte object has no satisfiable range
+        if exc.response["Error"]["Code"] == "InvalidRange":
+            return b""
+        raise
+
+
+def open_s3(path: str) -> io.BufferedReader:
+    bucket, key = split_s3_path(path)
+    client = get_client()
+    try:
+        head = client.head_object(Bucket=bucket, Key=key)
+    except client.exceptions.ClientError as exc:
+        if exc.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            raise FileNotFoundError(path) from exc
+        raise
+    blocks = _iter_ranges(bucket, key, head["ContentLength"], head["ETag"])
+    return io.BufferedReader(PrefetchReader(blocks), READ_BLOCK_SIZE)
+
+
+def _iter_ranges(bucket: str, key: str, size: int, etag: str) -> Iterator[bytes]:
+    client = get_client()
+
+    def fetch(start: int) -> bytes:
+        end = min(start + S3_RANGE_SIZE, size) - 1
+        response = client.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end}", IfMatch=etag)
+        return response["Body"].read()
+
+    yield from map_ordered(fetch, range(0, size, S3_RANGE_SIZE), S3_CONCURRENCY, S3_PREFETCH_RANGES)
+
+
+class S3Writer:
+    """Text sink for an s3:// key that uploads in S3_PART_SIZE multipart parts, several at once.
+
+    At most S3_CONCURRENCY parts are in flight plus the one being filled, so memory stays at a few
+    parts whatever the total size. Output smaller than one part goes up in a single put_object.
+    Leaving the with block on an exception, or a failed complete, aborts the upload: no partial
+    object or orphaned parts are left behind.
+    """
+
+    def __init__(self, path: str, content_type: str = "text/plain"):
+        self.path = path
+        self.bucket, self.key = split_s3_path(path)
+        self.content_type = content_type
+        self._client = get_client()
+        self._buf = bytearray()
+        self._upload_id: str | None = None
+        self._pool: ThreadPoolExecutor | None = None
+        self._parts: list = []
+
+    def write(self, text: str) -> int:
+        self._buf += text.encode("utf-8")
+        if len(self._buf) >= S3_PART_SIZE:
+            self._submit_part()
+        return len(text)
+
+    def close(self) -> None:
+        if self._upload_id is None:
+            self._client.put_object(
+                Bucket=self.bucket, Key=self.key, Body=bytes(self._buf), ContentType=self.content_type,
+            )
+            return
+        try:
+            if self._buf:
+                self._submit_part()
+            parts = [f.result() for f in self._parts]
+            self._pool.shutdown()
+            self._client.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self._upload_id, MultipartUpload={"Parts": parts},
+            )
+        except BaseException:
+            # an upload S3 refused to complete would otherwise keep its parts (and their storage) around
+            self.abort()
+            raise
+
+    def abort(self) -> None:
+        if self._upload_id is None:
+            return
+        self._pool.shutdown(cancel_futures=True)
+        self._client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+
+    def __enter__(self) -> S3Writer:
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _submit_part(self) -> None:
+        if self._upload_id is None:
+            self._upload_id = self._client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, ContentType=self.content_type,
+            )["UploadId"]
+            self._pool = ThreadPoolExecutor(S3_CONCURRENCY)
+
+        in_flight = [f for f in self._parts if not f.done()]
+        if len(in_flight) >= S3_CONCURRENCY:
+            wait(in_flight, return_when=FIRST_COMPLETED)
+
+        body, self._buf = bytes(self._buf), bytearray()
+        self._parts.append(self._pool.submit(self._upload_part, len(self._parts) + 1, body))
+
+    def _upload_part(self, number: int, body: bytes) -> dict:
+        response = self._client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self._upload_id, PartNumber=number, Body=body,
+        )
+        return {"PartNumber": number, "ETag": response["ETag"]}
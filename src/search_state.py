@@ -0,0 +1,248 @@
+from __future__ import annotations
+import itertools
+import logging
+import os
+import socket
+import sqlite3
+import tempfile
+from collections.abc import MutableMapping
+from typing import Iterator
+
+from src.config import ATTRIBUTION_WINDOW_SECONDS, LAST_SEARCH_MEMORY_ENTRIES, SPILL_DIR
+from src.symbols import SymbolTable
+
+logger = logging.getLogger(__name__)
+
+# Last search per IP for the chunked backends, the one piece of state that grows with the log.
+# IPv4 addresses are kept as ints and (engine, keyword) pairs as SymbolTable ids, so an entry
+# is an int -> int dict slot instead of a str key plus a tuple; the chunked backends call
+# put_id / lookup_id with packed IPs and pair ids directly. Past LAST_SEARCH_MEMORY_ENTRIES
+# IPs the least recently written half of the in-memory entries is flushed to an on-disk sqlite
+# table and lookups fall back to it; the recently written IPs, where purchases usually come
+# from, stay in memory. A store can be detached and its state read back in another process
+# (parallel workers hand theirs to the stitching parent that way).
+#
+# With an attribution window a search only counts for purchases at most `window` seconds after
+# it (by hit_time_gmt). Entries are then kept in write order, which for a time-ordered log is
+# time order, and every window / _SWEEPS_PER_WINDOW seconds of log time the expired head of that
+# queue is dropped (and the expired rows of the spill table), so the state holds about one window
+# of IPs. lookup() checks the window itself; eviction only bounds memory. A purchase that
+# arrives more than a window later than the newest search seen may miss a search it would have
+# been credited to without eviction, which only happens on badly out-of-order input.
+
+# an entry's value is search time << PAIR_BITS | pair id
+PAIR_BITS = 32
+PAIR_MASK = (1 << PAIR_BITS) - 1
+_SWEEPS_PER_WINDOW = 8
+
+
+def pack_ip(ip: str) -> int | str:
+    # anything that does not round-trip exactly (IPv6, leading zeros, junk) stays a str key
+    try:
+        packed = socket.inet_pton(socket.AF_INET, ip)
+    except OSError:
+        return ip
+    if socket.inet_ntop(socket.AF_INET, packed) != ip:
+        return ip
+    return int.from_bytes(packed, "big")
+
+
+def _unpack_ip(key: int | str) -> str:
+    if isinstance(key, str):
+        return key
+    return socket.inet_ntop(socket.AF_INET, key.to_bytes(4, "big"))
+
+
+class LastSearchStore(MutableMapping):
+    """ip -> (domain, keyword) mapping with compact keys and values and a bounded memory footprint.
+
+    put() / lookup() carry the hit time for attribution windows; the mapping interface ignores it.
+    """
+
+    def __init__(
+        self,
+        max_entries: int | None = None,
+        spill_dir: str | None = None,
+        window: int | None = None,
+        symbols: SymbolTable | None = None,
+    ):
+        self.symbols = SymbolTable() if symbols is None else symbols
+        self.max_entries = LAST_SEARCH_MEMORY_ENTRIES if max_entries is None else max_entries
+        self.spill_dir = (SPILL_DIR if spill_dir is None else spill_dir) or None
+        self.window = ATTRIBUTION_WINDOW_SECONDS if window is None else window
+        # packed ip -> time << PAIR_BITS | pair id
+        self._memory: dict[int | str, int] = {}
+        self._db: sqlite3.Connection | None = None
+        self._db_path: str | None = None
+        self._now = 0
+        self._next_sweep = 0
+        self.spills = 0
+        self.evicted = 0
+
+    def put(self, ip: str, pair: tuple[str, str], time: int = 0) -> None:
+        self.put_id(pack_ip(ip), self.symbols.pair_id(*pair), time)
+
+    def put_id(self, key: int | str, pair_id: int, time: int = 0) -> None:
+        # key is pack_ip(ip), pair_id a self.symbols id; re-inserting moves the IP to the back,
+        # so memory is in write order (the window queue, and oldest first for _spill)
+        self._memory.pop(key, None)
+        if self.window:
+            if time > self._now:
+                self._now = time
+                if time >= self._next_sweep:
+                    self._sweep()
+        self._memory[key] = time << PAIR_BITS | pair_id
+        if self.max_entries and len(self._memory) > self.max_entries:
+            self._spill()
+
+    def lookup(self, ip: str, time: int = 0) -> tuple[str, str] | None:
+        # the last search of ip, if a purchase at `time` still falls inside its window
+        pair_id = self.lookup_id(pack_ip(ip), time)
+        return None if pair_id is None else self.symbols.pair(pair_id)
+
+    def lookup_id(self, key: int | str, time: int = 0) -> int | None:
+        found = self.find_id(key)
+        if found is None:
+            return None
+        searched_at, pair_id = found
+        if self.window and time - searched_at > self.window:
+            return None
+        return pair_id
+
+    def rows(self) -> Iterator[tuple[str, str, str, int]]:
+        # (ip, domain, keyword, search time), the form the checkpoint stores
+        for key, value in self._iter_values():
+            yield (_unpack_ip(key), *self.symbols.pair(value & PAIR_MASK), value >> PAIR_BITS)
+
+    def find_id(self, key: int | str) -> tuple[int, int] | None:
+        # (search time, pair id) of the last search of key, whatever the window
+        value = self._memory.get(key)
+        if value is not None:
+            return value >> PAIR_BITS, value & PAIR_MASK
+        if self._db is not None:
+            row = self._db.execute("SELECT time, pair FROM last_search WHERE ip = ?", (key,)).fetchone()
+            if row:
+                return row
+        return None
+
+    def _sweep(self) -> None:
+        cutoff = self._now - self.window
+        self._next_sweep = self._now + max(self.window // _SWEEPS_PER_WINDOW, 1)
+        expired = []
+        for key, value in self._memory.items():
+            if value >> PAIR_BITS >= cutoff:
+                break
+            expired.append(key)
+        for key in expired:
+            del self._memory[key]
+        self.evicted += len(expired)
+        if self._db is not None:
+            self.evicted += self._db.execute("DELETE FROM last_search WHERE time < ?", (cutoff,)).rowcount
+
+    def __setitem__(self, ip: str, pair: tuple[str, str]) -> None:
+        self.put(ip, pair)
+
+    def get(self, ip: str, default=None):
+        found = self.find_id(pack_ip(ip))
+        return default if found is None else self.symbols.pair(found[1])
+
+    def __getitem__(self, ip: str) -> tuple[str, str]:
+        pair = self.get(ip)
+        if pair is None:
+            raise KeyError(ip)
+        return pair
+
+    def __contains__(self, ip) -> bool:
+        return self.get(ip) is not None
+
+    def __delitem__(self, ip: str) -> None:
+        key = pack_ip(ip)
+        found = self._memory.pop(key, None) is not None
+        if self._db is not None:
+            found = self._db.execute("DELETE FROM last_search WHERE ip = ?", (key,)).rowcount > 0 or found
+        if not found:
+            raise KeyError(ip)
+
+    def __iter__(self) -> Iterator[str]:
+        for key, _ in self._iter_values():
+            yield _unpack_ip(key)
+
+    def items(self) -> Iterator[tuple[str, tuple[str, str]]]:
+        for key, value in self._iter_values():
+            yield _unpack_ip(key), self.symbols.pair(value & PAIR_MASK)
+
+    def __len__(self) -> int:
+        if self._db is None:
+            return len(self._memory)
+        # spilled IPs that were written again since are in both tiers
+        return sum(1 for _ in self._iter_values())
+
+    def _iter_values(self) -> Iterator[tuple[int | str, int]]:
+        # spilled rows come first, they are older than anything still in memory
+        if self._db is not None:
+            for key, time, pair_id in self._db.execute("SELECT ip, time, pair FROM last_search"):
+                if key not in self._memory:
+                    yield key, time << PAIR_BITS | pair_id
+        yield from self._memory.items()
+
+    def _spill(self) -> None:
+        if self._db is None:
+            fd, self._db_path = tempfile.mkstemp(prefix="last_search_", suffix=".sqlite", dir=self.spill_dir)
+            os.close(fd)
+            self._db = sqlite3.connect(self._db_path)
+            self._db.executescript(
+                "PRAGMA journal_mode = OFF; PRAGMA synchronous = OFF;"
+                # no column affinity, so int and str IP keys never compare equal
+                "CREATE TABLE last_search (ip PRIMARY KEY, time INTEGER NOT NULL, pair INTEGER NOT NULL) WITHOUT ROWID;"
+            )
+            if self.window:
+                self._db.execute("CREATE INDEX last_search_time ON last_search (time)")
+        # the oldest entries go, the newer half of max_entries stays
+        spilled = list(itertools.islice(self._memory.items(), len(self._memory) - self.max_entries // 2))
+        self._db.executemany(
+            "INSERT OR REPLACE INTO last_search (ip, time, pair) VALUES (?, ?, ?)",
+            ((key, value >> PAIR_BITS, value & PAIR_MASK) for key, value in spilled),
+        )
+        self._db.commit()
+        for key, _ in spilled:
+            del self._memory[key]
+        self.spills += 1
+        logger.info("Spilled %s last-search entries to %s", f"{len(spilled):,}", self._db_path)
+
+    def detach(self) -> tuple[str | None, dict[int | str, int]]:
+        # (spill file, in-memory entries) for iter_detached, in this or another process; the
+        # store is left empty and the spill file becomes the reader's to delete
+        path = None
+        if self._db is not None:
+            self._db.close()
+            path, self._db, self._db_path = self._db_path, None, None
+        memory, self._memory = self._memory, {}
+        return path, memory
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            os.unlink(self._db_path)
+            self._db = None
+
+    def __enter__(self) -> LastSearchStore:
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+
+def iter_detached(state: tuple[str | None, dict[int | str, int]]) -> Iterator[tuple[int | str, int]]:
+    # (key, time << PAIR_BITS | pair id) of a detached store, spilled rows first and in time order,
+    # so put_id-ing them keeps a windowed store's queue in order; the spill file is deleted once read
+    path, memory = state
+    if path is not None:
+        db = sqlite3.connect(path)
+        try:
+            for key, time, pair_id in db.execute("SELECT ip, time, pair FROM last_search ORDER BY time"):
+                if key not in memory:
+                    yield key, time << PAIR_BITS | pair_id
+        finally:
+            db.close()
+            os.unlink(path)
+    yield from memory.items()
@@ -1,71 +1,372 @@
 
 from __future__ import annotations
+import csv
+import io
+import json
 import logging
+import os
+from typing import TYPE_CHECKING
 
-import pandas as pd
-from pyspark.sql import SparkSession, Window
-from pyspark.sql import functions as F
-from pyspark.sql.types import DoubleType, StringType, StructField, StructType
-
+from src.metrics import Metrics
 from src.processor import BaseProcessor
-from src.parsers import parse_referrer, parse_revenue
-from src.config import PURCHASE_EVENT, TSV_DELIMITER
+from src.ranking import top_revenue
+from src.writer import report_path
+from src.columnar import check_manifest
+from src.parsers import REFERRER_HOST_PATTERN, REFERRER_QUERY_PATTERN, keyword_param_pattern
+from src.config import (
+    DATASET_MANIFEST, KEYWORD_PARAMS, PRODUCT_REVENUE_IDX, PURCHASE_EVENT, SEARCH_ENGINE_MAP,
+    MIN_REVENUE, OUTPUT_HEADER, SPARK_ATTRIBUTION, SPARK_ATTRIBUTION_BUCKET_SECONDS, SPARK_ENRICH, TOP_K,
+    TSV_DELIMITER,
+)
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from pyspark.sql import SparkSession
+
+# pyspark and pandas are imported by the functions that use them: importing this module (for a
+# backend choice, or the tests) stays cheap, the imports are paid once a Spark job is built.
 
 logger = logging.getLogger(__name__)
 
 
-HIT_SCHEMA = StructType([
-    StructField("hit_time_gmt",  StringType(), True),
-    StructField("date_time",     StringType(), True),
-    StructField("user_agent",    StringType(), True),
-    StructField("ip",            StringType(), True),
-    StructField("event_list",    StringType(), True),
-    StructField("geo_city",      StringType(), True),
-    StructField("geo_region",    StringType(), True),
-    StructField("geo_country",   StringType(), True),
-    StructField("pagename",      StringType(), True),
-    StructField("page_url",      StringType(), True),
-    StructField("product_list",  StringType(), True),
-    StructField("referrer",      StringType(), True),
-])
-
-@F.pandas_udf(StructType([
-    StructField("domain",  StringType(), True),
-    StructField("keyword", StringType(), True),
-]))
-def _udf_parse_referrer(referrer_series: pd.Series) -> pd.DataFrame:
-    results = referrer_series.map(parse_referrer)
-    return pd.DataFrame(results.tolist(), columns=["domain", "keyword"])
-
-
-@F.pandas_udf(DoubleType())
-def _udf_parse_revenue(
-    product_series: pd.Series,
-    event_series: pd.Series,
-) -> pd.Series:
-    return pd.Series([
-        parse_revenue(p, e)
-        for p, e in zip(product_series, event_series)
-    ])
+HIT_FIELDS = [
+    "hit_time_gmt", "date_time", "user_agent", "ip", "event_list", "geo_city", "geo_region",
+    "geo_country", "pagename", "page_url", "product_list", "referrer",
+]
+# DDL string, every column read as a string
+HIT_SCHEMA = ", ".join(f"{name} string" for name in HIT_FIELDS)
+
+
+# ── native enrichment: the same parsing as Spark SQL built-ins ────────────────
+# regexp_extract rather than parse_url: parse_url goes through java.net.URI and returns null for
+# referrers that are not strict RFC 2396 (spaces, "|", ...) while urlsplit still parses them.
+
+_STRIP = r"^\s+|\s+$"
+
+
+def _native_referrer(df):
+    from pyspark.sql import functions as F
+    referrer = F.regexp_replace(F.col("referrer"), _STRIP, "")
+    engines = F.create_map(*[F.lit(x) for item in SEARCH_ENGINE_MAP.items() for x in item])
+    df = (
+        df
+        .withColumn("_domain", engines[F.lower(F.regexp_extract(referrer, REFERRER_HOST_PATTERN, 1))])
+        .withColumn("_query",  F.when(F.col("_domain").isNotNull(),
+                                      F.regexp_extract(referrer, REFERRER_QUERY_PATTERN, 1)))
+    )
+
+    temp = ["_domain", "_query"]
+    candidates = []
+    for i, param in enumerate(KEYWORD_PARAMS):
+        raw = f"_kw{i}"
+        # unquote_plus semantics: a "%" that does not start a %XX escape stays literal, so it
+        # is escaped first and URLDecoder never throws
+        df = df.withColumn(raw, F.regexp_replace(
+            F.regexp_extract("_query", keyword_param_pattern(param), 1), "%(?![0-9A-Fa-f]{2})", "%25"
+        ))
+        decoded = F.when(
+            F.col(raw).contains("%") | F.col(raw).contains("+"),
+            F.expr(f"reflect('java.net.URLDecoder', 'decode', {raw}, 'UTF-8')"),
+        ).otherwise(F.col(raw))
+        value = F.regexp_replace(decoded, _STRIP, "")
+        candidates.append(F.when(value != "", F.lower(value)))
+        temp.append(raw)
+
+    keyword = F.coalesce(*candidates)
+    return (
+        df
+        .withColumn("se_keyword", F.when(F.col("_domain").isNotNull(), keyword))
+        .withColumn("se_domain",  F.when(F.col("se_keyword").isNotNull(), F.col("_domain")))
+        .drop(*temp)
+    )
+
+
+def _native_revenue():
+    from pyspark.sql import functions as F
+    # parse_revenue: rows whose event_list holds PURCHASE_EVENT get the sum of field
+    # PRODUCT_REVENUE_IDX over their products; blank / non-numeric fields count as 0
+    strip = _sql_literal(_STRIP)
+    return F.expr(f"""
+        CASE WHEN exists(split(coalesce(event_list, ''), ','),
+                         e -> regexp_replace(e, {strip}, '') = {_sql_literal(PURCHASE_EVENT)})
+             THEN aggregate(
+                 split(coalesce(product_list, ''), ','),
+                 CAST(0 AS DOUBLE),
+                 (acc, p) -> acc + coalesce(
+                     CASE WHEN size(split(p, ';')) > {PRODUCT_REVENUE_IDX}
+                          THEN try_cast(regexp_replace(split(p, ';')[{PRODUCT_REVENUE_IDX}], {strip}, '') AS DOUBLE)
+                     END,
+                     CAST(0 AS DOUBLE)))
+             ELSE CAST(0 AS DOUBLE)
+        END
+    """)
+
+
+def _sql_literal(value: str) -> str:
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+# ── grouped attribution: one pass per (ip, time bucket), no global sort ────────
+# Hits of an IP are split into time buckets so a hot IP (bot, NAT) is spread over many small
+# groups. Each group is folded on its own; purchases that come before the first search of their
+# bucket are stitched against the last search of the IP's earlier buckets in a second, much
+# smaller grouped pass.
+
+# time: hit time of a pending purchase, search time of a bucket's last search
+_BUCKET_SCHEMA = (
+    "ip string, bucket long, kind string, domain string, keyword string, time double, revenue double"
+)
+_ATTRIBUTED_SCHEMA = "domain string, keyword string, revenue double"
+
+
+def _ffill_text(values: pd.Series) -> pd.Series:
+    # filled on a string dtype: an all-null object column (an IP or bucket without a search)
+    # would otherwise warn about being downcast to float, once per group in the executor logs
+    return values.astype("string").ffill()
+
 
+def _fold_bucket(pdf: pd.DataFrame, window: int = 0) -> pd.DataFrame:
+    import pandas as pd
+    # same ordering as the window: hit_time_gmt ascending with nulls first; at equal times a
+    # search is placed before a purchase, and a hit that is both counts its own search
+    pdf = pdf.sort_values(
+        ["hit_time_gmt", "is_purchase"], na_position="first", kind="stable"
+    ).reset_index(drop=True)
+    domain = _ffill_text(pdf["se_domain"])
+    keyword = _ffill_text(pdf["se_keyword"])
+    purchases = pdf["is_purchase"]
+
+    attributed = purchases & domain.notna()
+    pending = purchases & domain.isna()
+    if window:
+        # the last search is the newest one, if it is out of the window every earlier one is too
+        search_time = pdf["hit_time_gmt"].where(pdf["se_domain"].notna()).ffill()
+        attributed &= pdf["hit_time_gmt"] - search_time <= window
+    searches = pdf.index[pdf["se_domain"].notna()]
+
+    # the same dtypes in every part (object text, float time), so concat has nothing to infer
+    # from an empty or all-null part
+    out = [
+        pd.DataFrame({"kind": "attributed", "domain": domain[attributed].astype(object),
+                      "keyword": keyword[attributed].astype(object),
+                      "time": float("nan"), "revenue": pdf["revenue"][attributed]}),
+        pd.DataFrame({"kind": "pending", "domain": None, "keyword": None,
+                      "time": pdf["hit_time_gmt"][pending], "revenue": pdf["revenue"][pending]}),
+    ]
+    if len(searches):
+        last = searches[-1]
+        out.append(pd.DataFrame({"kind": ["last"], "domain": [pdf["se_domain"][last]],
+                                 "keyword": [pdf["se_keyword"][last]],
+                                 "time": [pdf["hit_time_gmt"][last]], "revenue": [0.0]}))
+    result = pd.concat(out, ignore_index=True)
+    result["time"] = result["time"].astype(float)
+    result.insert(0, "ip", pdf["ip"].iloc[0])
+    result.insert(1, "bucket", pdf["bucket"].iloc[0])
+    return result[["ip", "bucket", "kind", "domain", "keyword", "time", "revenue"]]
+
+
+def _stitch_buckets(pdf: pd.DataFrame, window: int = 0) -> pd.DataFrame:
+    import pandas as pd
+    # pending rows sort before their own bucket's "last", so the forward-filled search they see
+    # comes from earlier buckets only
+    pdf = pdf.assign(rank=(pdf["kind"] == "last").astype(int))
+    pdf = pdf.sort_values(["bucket", "rank"], na_position="first", kind="stable")
+    is_last = pdf["kind"] == "last"
+    domain = _ffill_text(pdf["domain"].where(is_last))
+    keyword = _ffill_text(pdf["keyword"].where(is_last))
+    resolved = (pdf["kind"] == "pending") & domain.notna()
+    if window:
+        resolved &= pdf["time"] - pdf["time"].where(is_last).ffill() <= window
+    return pd.DataFrame({
+        "domain": domain[resolved].astype(object), "keyword": keyword[resolved].astype(object),
+        "revenue": pdf["revenue"][resolved],
+    })
+
+
+# ── report output from the executors ──────────────────────────────────────────
+# Lines are rendered the way csv.writer renders them in write_output (QUOTE_MINIMAL, \r\n), so
+# both paths produce byte-identical reports.
+
+def _tsv_field(col):
+    from pyspark.sql import functions as F
+    return F.when(
+        col.rlike('[\t"\r\n]'),
+        F.concat(F.lit('"'), F.regexp_replace(col, '"', '""'), F.lit('"')),
+    ).otherwise(col)
+
+
+def _tsv_line(fields: list[str]) -> str:
+    buf = io.StringIO()
+    csv.writer(buf, delimiter=TSV_DELIMITER, lineterminator="").writerow(fields)
+    return buf.getvalue()
+
+
+def _hadoop_path(path: str) -> str:
+    # local paths go to the JVM absolute: its working directory is the one it started in, and a
+    # bare name must not be taken relative to "/"
+    return path if "://" in path else os.path.abspath(path)
+
+
+def _merge_parts(spark: SparkSession, parts_dir: str, output_path: str) -> None:
+    # Runs on the Hadoop FileSystem of the target (local, HDFS or S3), so part bytes stream
+    # JVM-side and never pass through Python. A single part is just renamed.
+    jvm = spark._jvm
+    conf = spark._jsc.hadoopConfiguration()
+    Path = jvm.org.apache.hadoop.fs.Path
+    src, dst = Path(parts_dir), Path(output_path)
+    fs = src.getFileSystem(conf)
+    if jvm.java.lang.Class.forName("org.apache.hadoop.fs.ChecksumFileSystem").isInstance(fs):
+        # no .crc side files next to the report on a local disk
+        fs = fs.getRawFileSystem()
+
+    parts = sorted(
+        (status.getPath() for status in fs.listStatus(src) if status.getPath().getName().startswith("part-")),
+        key=lambda path: path.getName(),
+    )
+    fs.delete(dst, False)
+    if len(parts) == 1:
+        fs.rename(parts[0], dst)
+    else:
+        out = fs.create(dst, True)
+        try:
+            for part in parts:
+                stream = fs.open(part)
+                try:
+                    jvm.org.apache.hadoop.io.IOUtils.copyBytes(stream, out, conf, False)
+                finally:
+                    stream.close()
+        finally:
+            out.close()
+    fs.delete(src, True)
+
+
+# columns the pipeline reads from HIT_SCHEMA
+ATTRIBUTION_COLUMNS = ["hit_time_gmt", "ip", "event_list", "product_list", "referrer"]
+
+
+def _stage_metrics(spark: SparkSession) -> list[dict]:
+    import urllib.request
+    # completed stages from the Spark UI REST API (the same numbers the UI shows)
+    sc = spark.sparkContext
+    url = f"{sc.uiWebUrl}/api/v1/applications/{sc.applicationId}/stages?status=complete"
+    with urllib.request.urlopen(url, timeout=5) as resp:
+        return json.load(resp)
+
+
+def _stage_ids(spark: SparkSession) -> set[int]:
+    try:
+        return {stage["stageId"] for stage in _stage_metrics(spark)}
+    except Exception:
+        return set()
+
+
+def _log_stage_metrics(spark: SparkSession, stages_before: set[int], metrics: Metrics) -> None:
+    # input vs shuffle volume of this run's stages, shows what pruning saved before the window
+    try:
+        stages = [s for s in _stage_metrics(spark) if s["stageId"] not in stages_before]
+    except Exception as exc:
+        logger.warning("Spark stage metrics unavailable: %s", exc)
+        return
+    input_rows = sum(s.get("inputRecords", 0) for s in stages)
+    input_bytes = sum(s.get("inputBytes", 0) for s in stages)
+    shuffle_rows = sum(s.get("shuffleWriteRecords", 0) for s in stages)
+    shuffle_bytes = sum(s.get("shuffleWriteBytes", 0) for s in stages)
+    metrics.count("rows", input_rows)
+    metrics.count("bytes_read", input_bytes)
+    metrics.count("shuffle_write_rows", shuffle_rows)
+    metrics.count("shuffle_write_bytes", shuffle_bytes)
+    # per Spark stage, the executor side of the run that the driver timers cannot see
+    metrics.set("spark_stages", [
+        {
+            "stage_id": s["stageId"],
+            "name": s.get("name", ""),
+            "tasks": s.get("numTasks", 0),
+            "executor_run_ms": s.get("executorRunTime", 0),
+            "input_rows": s.get("inputRecords", 0),
+            "shuffle_write_bytes": s.get("shuffleWriteBytes", 0),
+        }
+        for s in sorted(stages, key=lambda s: s["stageId"])
+    ])
+    logger.info(
+        "Spark metrics | input: %s rows, %.1f MB | shuffle write: %s rows, %.1f MB (%.2f%% of input rows)",
+        f"{input_rows:,}", input_bytes / 1e6, f"{shuffle_rows:,}", shuffle_bytes / 1e6,
+        100.0 * shuffle_rows / input_rows if input_rows else 0.0,
+    )
 
 
 class SparkProcessor(BaseProcessor):
 
+    def __init__(
+        self,
+        input_path: str,
+        enrich: str = SPARK_ENRICH,
+        attribution: str = SPARK_ATTRIBUTION,
+        top_k: int = TOP_K,
+        min_revenue: float = MIN_REVENUE,
+        attribution_window: int | None = None,
+        metrics: Metrics | None = None,
+        input_paths: list[str] | None = None,
+    ):
+        super().__init__(input_path, attribution_window, metrics, input_paths)
+        if enrich not in ("native", "udf"):
+            raise ValueError(f"Unknown Spark enrich mode: {enrich!r}")
+        if attribution not in ("window", "grouped"):
+            raise ValueError(f"Unknown Spark attribution mode: {attribution!r}")
+        self.enrich = enrich
+        self.attribution = attribution
+        self.top_k = top_k
+        self.min_revenue = min_revenue
+        self._dataset = False
+
     def describe(self) -> str:
-        return f"SparkProcessor | file={self.input_path}"
+        return (
+            f"SparkProcessor | enrich={self.enrich} | attribution={self.attribution} | "
+            f"window={self.attribution_window or 'unbounded'} | top_k={self.top_k or 'all'} | "
+            f"file={self.input_path}"
+        )
 
     def process(self) -> dict[tuple[str, str], float]:
-        spark = self._get_session()
+        rows = self._run(self._collect)
+        self.metrics.set("unique_keywords", len(rows))
+        logger.info("Spark pipeline complete | unique (engine,keyword): %d", len(rows))
+        return dict(rows)
 
-        df = self._read(spark)
-        df = self._enrich(df)
-        df = self._attribute(df)
-        df = self._aggregate(df)
+    def write(self, location: str) -> str:
+        """Writes the report from the executors, next to / inside `location` like write_output.
 
-        rows = df.collect()
-        logger.info("Spark pipeline complete | unique (engine,keyword): %d", len(rows))
-        return {(r["domain"], r["keyword"]): r["revenue"] for r in rows}
+        Nothing is collected to the driver: the sorted lines, header included, are written as
+        part files that are then renamed or concatenated into the final .tab on the target
+        filesystem.
+        """
+        output_path = self._run(lambda df: self._write_report(df, report_path(self._report_location(location))))
+        logger.info("Spark pipeline complete | output -> %s", output_path)
+        return output_path
+
+    def _run(self, finish):
+        with self.metrics.stage("session"):
+            spark = self._get_session()
+        stages_before = _stage_ids(spark)
+
+        manifest = self._dataset_manifest(spark)
+        if manifest is not None:
+            # an ingested columnar dataset comes pruned and parsed
+            df = self._read_dataset(spark, manifest)
+        else:
+            df = self._read(spark)
+            df = self._prune(df)
+            df = self._enrich(df)
+        df = self._relevant(df)
+        try:
+            df = self._attribute(df)
+            df = self._aggregate(df)
+            # the plan is lazy: reading, parsing and attribution all run in here
+            with self.metrics.stage("spark_jobs"):
+                result = finish(df)
+        finally:
+            self._relevant_cache.unpersist()
+
+        _log_stage_metrics(spark, stages_before, self.metrics)
+        return result
 
 
     def _read(self, spark: SparkSession):
@@ -79,29 +380,127 @@ class SparkProcessor(BaseProcessor):
             .option("multiLine", "false")
             .option("mode",      "PERMISSIVE") 
             .schema(HIT_SCHEMA)
-            .csv(self.input_path)
+            .csv([_hadoop_path(p) for p in self.input_paths])
         )
 
+    def _dataset_manifest(self, spark: SparkSession) -> dict | None:
+        # a columnar dataset from ingest.py, local or on S3: looked up through the Hadoop filesystem
+        self._dataset = False
+        if len(self.input_paths) != 1:
+            return None
+        jvm = spark.sparkContext._jvm
+        location = _hadoop_path(self.input_paths[0]).rstrip("/")
+        path = jvm.org.apache.hadoop.fs.Path(f"{location}/{DATASET_MANIFEST}")
+        fs = path.getFileSystem(spark.sparkContext._jsc.hadoopConfiguration())
+        if not fs.isFile(path):
+            return None
+        # not through spark.read: the DataFrame readers skip "_" files like the manifest
+        stream = fs.open(path)
+        try:
+            manifest = json.loads(jvm.org.apache.commons.io.IOUtils.toString(stream, "UTF-8"))
+        finally:
+            stream.close()
+        check_manifest(manifest, self.input_paths[0])
+        self._dataset = True
+        return manifest
+
+    def _read_dataset(self, spark: SparkSession, manifest: dict):
+        from pyspark.sql import functions as F
+        logger.info("Reading columnar dataset: %s (%s rows ingested)", self.input_path, f"{manifest['rows']:,}")
+        engines = F.create_map(*[F.lit(x) for item in SEARCH_ENGINE_MAP.items() for x in item])
+        domain = F.when(F.col("referrer_keyword").isNotNull(), engines[F.col("referrer_host")])
+        revenue = F.col("revenue")
+        return (
+            spark.read.parquet(_hadoop_path(self.input_paths[0]))
+            # pushed into the Parquet scan, like the filter of the chunked backend's dataset reader
+            .filter(
+                (F.col("referrer_host").isin(list(SEARCH_ENGINE_MAP)) & F.col("referrer_keyword").isNotNull())
+                | (revenue > 0)
+            )
+            .select(
+                "ip",
+                "hit_time_gmt",
+                # the dataset keeps revenue only; a purchase is a hit with revenue, as far as
+                # the event_list checks downstream are concerned
+                F.when(revenue > 0, F.lit(PURCHASE_EVENT)).alias("event_list"),
+                domain.alias("se_domain"),
+                F.when(domain.isNotNull(), F.col("referrer_keyword")).alias("se_keyword"),
+                revenue,
+            )
+        )
+
+    def _report_location(self, location: str) -> str:
+        # a report inside an S3 dataset prefix would be read back as a Parquet file
+        if self._dataset and location.rstrip("/") == self.input_paths[0].rstrip("/") and "://" in location:
+            return location.rstrip("/").rpartition("/")[0]
+        return location
+
+    @staticmethod
+    def _prune(df):
+        # the CSV reader only materializes these, user_agent & co never leave the scan
+        return df.select(*ATTRIBUTION_COLUMNS)
+
+    def _relevant(self, df):
+        from pyspark import StorageLevel
+        from pyspark.sql import functions as F
+        # Only search hits and purchase hits can change the result, and only for IPs that made a
+        # purchase, so everything else is dropped before the window shuffles by ip. The purchaser
+        # set is small enough for a broadcast semi-join; the filtered hits are cached because
+        # they are scanned twice (once to find purchasers, once for the join).
+        is_purchase = F.array_contains(F.split("event_list", ","), PURCHASE_EVENT) & (F.col("revenue") > 0)
+        relevant = (
+            df
+            .filter(F.col("se_domain").isNotNull() | is_purchase)
+            .select("ip", "hit_time_gmt", "event_list", "se_domain", "se_keyword", "revenue")
+            .persist(StorageLevel.MEMORY_AND_DISK)
+        )
+        self._relevant_cache = relevant
+        purchasers = relevant.filter(is_purchase).select("ip").distinct()
+        return relevant.join(purchasers, "ip", "left_semi")
+
     def _enrich(self, df):
-        parsed = _udf_parse_referrer(F.col("referrer"))
+        from pyspark.sql import functions as F
+        if self.enrich == "native":
+            return (
+                _native_referrer(df)
+                .withColumn("revenue", _native_revenue())
+                .withColumn("hit_time_gmt", F.col("hit_time_gmt").cast("long"))
+            )
+
+        from src.spark_udfs import udf_parse_referrer, udf_parse_revenue
+        parsed = udf_parse_referrer(F.col("referrer"))
         return (
             df
             .withColumn("_ref",       parsed)
             .withColumn("se_domain",  F.col("_ref.domain"))
             .withColumn("se_keyword", F.col("_ref.keyword"))
             .drop("_ref")
-            .withColumn("revenue", _udf_parse_revenue(
+            .withColumn("revenue", udf_parse_revenue(
                 F.col("product_list"), F.col("event_list")
             ))
             .withColumn("hit_time_gmt", F.col("hit_time_gmt").cast("long"))
         )
 
     def _attribute(self, df):
+        from pyspark.sql import functions as F
+        from pyspark.sql import Window
+        window = self.attribution_window
+        if window:
+            # a hit without a usable time neither opens nor uses a search
+            has_time = F.col("hit_time_gmt").isNotNull()
+            df = (
+                df
+                .withColumn("se_domain",  F.when(has_time, F.col("se_domain")))
+                .withColumn("se_keyword", F.when(has_time, F.col("se_keyword")))
+            )
+        if self.attribution == "grouped":
+            return self._attribute_grouped(df, window)
+
+        by_time = Window.partitionBy("ip").orderBy("hit_time_gmt")
+        # a bounded range frame only buffers the last `window` seconds of each IP's hits
         w = (
-            Window
-            .partitionBy("ip")
-            .orderBy("hit_time_gmt")
-            .rowsBetween(Window.unboundedPreceding, Window.currentRow)
+            by_time.rangeBetween(-window, Window.currentRow) if window
+            else by_time.rowsBetween(Window.unboundedPreceding, Window.currentRow)
         )
         return (
             df
@@ -113,17 +512,124 @@ class SparkProcessor(BaseProcessor):
             .select("domain", "keyword", "revenue")
         )
 
+    @staticmethod
+    def _attribute_grouped(df, window: int = 0):
+        from pyspark.sql import functions as F
+        hits = df.select(
+            "ip", "hit_time_gmt", "se_domain", "se_keyword", "revenue",
+            # hits without a time sort first in the window, so they get the lowest bucket
+            F.coalesce(
+                F.floor(F.col("hit_time_gmt") / SPARK_ATTRIBUTION_BUCKET_SECONDS),
+                F.lit(-(2 ** 63)),
+            ).alias("bucket"),
+            F.coalesce(
+                F.array_contains(F.split("event_list", ","), PURCHASE_EVENT) & (F.col("revenue") > 0),
+                F.lit(False),
+            ).alias("is_purchase"),
+        )
+        def fold(pdf):
+            return _fold_bucket(pdf, window)
+
+        def stitch(pdf):
+            return _stitch_buckets(pdf, window)
+
+        buckets = hits.groupBy("ip", "bucket").applyInPandas(fold, _BUCKET_SCHEMA)
+
+        attributed = buckets.filter(F.col("kind") == "attributed").select("domain", "keyword", "revenue")
+        stitched = (
+            buckets
+            .filter(F.col("kind").isin("pending", "last"))
+            .groupBy("ip")
+            .applyInPandas(stitch, _ATTRIBUTED_SCHEMA)
+        )
+        return attributed.unionByName(stitched)
+
     def _aggregate(self, df):
+        from pyspark.sql import functions as F
         return (
             df
             .groupBy("domain", "keyword")
             .agg(F.round(F.sum("revenue"), 2).alias("revenue"))
-            .orderBy(F.col("revenue").desc())
         )
 
+    def _collect(self, df) -> list[tuple[tuple[str, str], float]]:
+        from pyspark.sql import functions as F
+        if self.min_revenue:
+            df = df.filter(F.col("revenue") >= self.min_revenue)
+        if not self.top_k:
+            rows = df.orderBy(F.col("revenue").desc()).collect()
+            return [((r["domain"], r["keyword"]), r["revenue"]) for r in rows]
+
+        # each partition keeps its own top_k per engine and the driver merges those, so the long
+        # tail is neither sorted nor shipped
+        top_k = self.top_k
+        partial = df.rdd.mapPartitions(
+            lambda rows: top_revenue((((r["domain"], r["keyword"]), r["revenue"]) for r in rows), top_k)
+        )
+        return top_revenue(partial.collect(), top_k)
+
+    def _select(self, df):
+        from pyspark.sql import functions as F
+        from pyspark.sql import Window
+        # the same rows as _collect, left distributed: per-partition top_k, then a per-engine
+        # rank over those few candidates
+        if self.min_revenue:
+            df = df.filter(F.col("revenue") >= self.min_revenue)
+        if not self.top_k:
+            return df
+        top_k = self.top_k
+        partial = df.rdd.mapPartitions(
+            lambda rows: [
+                (domain, keyword, revenue)
+                for (domain, keyword), revenue in top_revenue(
+                    (((r["domain"], r["keyword"]), r["revenue"]) for r in rows), top_k
+                )
+            ]
+        )
+        rank = Window.partitionBy("domain").orderBy(F.col("revenue").desc())
+        return (
+            df.sparkSession.createDataFrame(partial, df.schema)
+            .withColumn("_rank", F.row_number().over(rank))
+            .filter(F.col("_rank") <= top_k)
+            .drop("_rank")
+        )
+
+    def _write_report(self, df, output_path: str) -> str:
+        from pyspark.sql import functions as F
+        spark = df.sparkSession
+        target = _hadoop_path(output_path)
+        parent, _, filename = target.rpartition("/")
+        parts_dir = f"{parent}/_tmp_{filename}"
+
+        # the header is a row with a null revenue, so it sorts first and lands at the top of part 0
+        header = spark.createDataFrame(
+            [(_tsv_line(OUTPUT_HEADER), None)], "line string, revenue double"
+        )
+        lines = self._select(df).select(
+            F.concat_ws(
+                TSV_DELIMITER,
+                _tsv_field(F.col("domain")),
+                _tsv_field(F.col("keyword")),
+                F.format_string("%.2f", F.col("revenue")),
+            ).alias("line"),
+            "revenue",
+        )
+        (
+            lines.unionByName(header)
+            .orderBy(F.col("revenue").desc_nulls_first())
+            # csv.writer ends rows with \r\n, the text writer adds the \n
+            .select(F.concat(F.col("line"), F.lit("\r")).alias("line"))
+            .write.mode("overwrite")
+            .text(parts_dir)
+        )
+        with self.metrics.stage("merge_parts"):
+            _merge_parts(spark, parts_dir, target)
+        return output_path
+
 
     @staticmethod
     def _get_session() -> SparkSession:
+        from pyspark.sql import SparkSession
 
         return (
             SparkSession.builder
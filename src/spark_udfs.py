@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+import pandas as pd
+from pyspark.sql import functions as F
+from pyspark.sql.types import DoubleType, StringType, StructField, StructType
+
+from src.parsers import ReferrerCache, parse_revenue_batch
+
+# Python-worker enrichment for SparkProcessor(enrich="udf"): parse_referrer / parse_revenue in
+# pandas UDFs. Defining a pandas UDF needs pandas and pyspark at import time, so these live apart
+# from spark_processor and are only imported when the udf mode is used.
+
+# one cache per Python worker process, it lives as long as the executor reuses the worker
+_referrer_cache: ReferrerCache | None = None
+
+
+def _get_referrer_cache() -> ReferrerCache:
+    global _referrer_cache
+    if _referrer_cache is None:
+        _referrer_cache = ReferrerCache()
+    return _referrer_cache
+
+
+@F.pandas_udf(StructType([
+    StructField("domain",  StringType(), True),
+    StructField("keyword", StringType(), True),
+]))
+def udf_parse_referrer(referrer_series: pd.Series) -> pd.DataFrame:
+    results = referrer_series.map(_get_referrer_cache().parse)
+    return pd.DataFrame(results.tolist(), columns=["domain", "keyword"])
+
+
+@F.pandas_udf(DoubleType())
+def udf_parse_revenue(
+    product_series: pd.Series,
+    event_series: pd.Series,
+) -> pd.Series:
+    return pd.Series(parse_revenue_batch(product_series.tolist(), event_series.tolist()))
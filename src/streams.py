@@ -0,0 +1,89 @@
+from __future__ import annotations
+import io
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, TypeVar
+
+# Building blocks for reading ahead of the parser: a raw stream fed by a background thread
+# through a bounded queue, and an ordered thread-pool map with a bounded number of tasks in flight.
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def map_ordered(fn: Callable[[T], R], items: Iterable[T], threads: int, ahead: int) -> Iterator[R]:
+    # like ThreadPoolExecutor.map, but only `ahead` tasks are submitted before the oldest result
+    # is handed out, so memory stays bounded however many items there are
+    with ThreadPoolExecutor(threads) as pool:
+        in_flight: deque = deque()
+        for item in items:
+            in_flight.append(pool.submit(fn, item))
+            if len(in_flight) >= ahead:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+class PrefetchReader(io.RawIOBase):
+    """Raw stream over blocks that a background thread produces into a bounded queue."""
+
+    def __init__(self, blocks: Iterator[bytes], depth: int = 4):
+        self._queue: queue.Queue = queue.Queue(depth)
+        self._stop = threading.Event()
+        self._view = memoryview(b"")
+        self._done = False
+        self._thread = threading.Thread(target=self._fill, args=(blocks,), daemon=True)
+        self._thread.start()
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._view:
+            if self._done:
+                return 0
+            item = self._queue.get()
+            if item is None or isinstance(item, BaseException):
+                self._done = True
+                if item is not None:
+                    raise item
+                return 0
+            self._view = memoryview(item)
+        n = min(len(b), len(self._view))
+        b[:n] = self._view[:n]
+        self._view = self._view[n:]
+        return n
+
+    def close(self) -> None:
+        if not self.closed:
+            self._stop.set()
+            while self._thread.is_alive():
+                try:
+                    self._queue.get(timeout=0.05)
+                except queue.Empty:
+                    pass
+        super().close()
+
+    def _fill(self, blocks: Iterator[bytes]) -> None:
+        try:
+            for block in blocks:
+                if not self._put(block):
+                    return
+        except BaseException as exc:
+            self._put(exc)
+            return
+        finally:
+            # a reader closed early leaves the generator suspended, this releases its file handles
+            getattr(blocks, "close", lambda: None)()
+        self._put(None)
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.05)
+                return True
+            except queue.Full:
+                pass
+        return False
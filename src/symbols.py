@@ -0,0 +1,65 @@
+from __future__ import annotations
+from array import array
+
+from src.config import SEARCH_ENGINE_MAP
+
+# Symbol table for (engine, keyword) pairs in the chunked backends. Engines are small ints (the
+# SEARCH_ENGINE_MAP domains first), keywords are interned once however many engines and IPs use
+# them, and each pair gets a dense id in first-seen order. The referrer cache, the last search
+# per IP and the revenue totals all work on these ids; they are decoded back to strings once
+# per unique pair when a processor hands its revenue map to write_output.
+
+_ENGINE_BITS = 16
+_ENGINE_MASK = (1 << _ENGINE_BITS) - 1
+
+
+class SymbolTable:
+
+    def __init__(self):
+        self.engines: list[str] = []
+        self.keywords: list[str] = []
+        self._engine_ids: dict[str, int] = {}
+        self._keyword_ids: dict[str, int] = {}
+        # keyword id << _ENGINE_BITS | engine id, per pair id and back
+        self._codes = array("q")
+        self._pair_ids: dict[int, int] = {}
+        for engine in SEARCH_ENGINE_MAP.values():
+            self._engine_id(engine)
+
+    def _engine_id(self, engine: str) -> int:
+        engine_id = self._engine_ids.get(engine)
+        if engine_id is None:
+            if len(self.engines) > _ENGINE_MASK:
+                raise ValueError(f"More than {_ENGINE_MASK + 1} search engines")
+            engine_id = self._engine_ids[engine] = len(self.engines)
+            self.engines.append(engine)
+        return engine_id
+
+    def pair_id(self, engine: str, keyword: str) -> int:
+        keyword_id = self._keyword_ids.get(keyword)
+        if keyword_id is None:
+            keyword_id = self._keyword_ids[keyword] = len(self.keywords)
+            self.keywords.append(keyword)
+        code = keyword_id << _ENGINE_BITS | self._engine_id(engine)
+        pair_id = self._pair_ids.get(code)
+        if pair_id is None:
+            pair_id = self._pair_ids[code] = len(self._codes)
+            self._codes.append(code)
+        return pair_id
+
+    def pair(self, pair_id: int) -> tuple[str, str]:
+        code = self._codes[pair_id]
+        return self.engines[code & _ENGINE_MASK], self.keywords[code >> _ENGINE_BITS]
+
+    def pairs(self) -> list[tuple[str, str]]:
+        return [self.pair(i) for i in range(len(self._codes))]
+
+    def decode(self, totals: dict[int, float]) -> dict[tuple[str, str], float]:
+        # keeps the order of `totals`, write_output breaks revenue ties by it
+        return {self.pair(pair_id): revenue for pair_id, revenue in totals.items()}
+
+    def encode(self, revenue_map: dict[tuple[str, str], float]) -> dict[int, float]:
+        return {self.pair_id(engine, keyword): revenue for (engine, keyword), revenue in revenue_map.items()}
+
+    def __len__(self) -> int:
+        return len(self._codes)
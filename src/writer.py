@@ -1,69 +1,72 @@
 from __future__ import annotations
 
 import csv
-import io
 import logging
 from datetime import datetime
 from pathlib import Path
 
-from src.config import OUTPUT_SUFFIX, OUTPUT_HEADER, TSV_DELIMITER
+from src.config import METRICS_SUFFIX, MIN_REVENUE, OUTPUT_SUFFIX, OUTPUT_HEADER, TOP_K, TSV_DELIMITER
+from src.ranking import top_revenue
+from src.readers import is_dataset
+from src.s3 import S3Writer, is_s3
 
 logger = logging.getLogger(__name__)
 
 
-def _is_s3(path: str) -> bool:
-    return path.startswith("s3://")
-
+def _open_output(output_path: str):
+    # rows are streamed straight to the file or to an S3 multipart upload, never built up in memory
+    if is_s3(output_path):
+        return S3Writer(output_path)
+    return open(output_path, "w", newline="", encoding="utf-8")
 
-def _write_local(content: str, output_path: str) -> None:
-    with open(output_path, "w", newline="", encoding="utf-8") as fh:
-        fh.write(content)
 
+def report_path(input_path: str) -> str:
+    #date_str    = datetime.now().strftime("%Y-%m-%d")
+    date_str   = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    filename = f"{date_str}{OUTPUT_SUFFIX}"
 
-def _write_s3(content: str, s3_path: str) -> None:
-    import boto3
-    path = s3_path[len("s3://"):]
-    bucket, key = path.split("/", 1)
-    s3 = boto3.client("s3")
-    s3.put_object(
-        Bucket=bucket,
-        Key=key,
-        Body=content.encode("utf-8"),
-        ContentType="text/plain",
-    )
+    if is_s3(input_path):
+        base = input_path.rstrip("/")
+        return f"{base}/{filename}"
+    if Path(input_path).is_dir() and not is_dataset(input_path):
+        # directory input: the report goes inside it, like an s3:// prefix; a columnar dataset
+        # only holds its own files, its report goes next to it
+        return str(Path(input_path) / filename)
+    return str(Path(input_path).parent / filename)
 
 
 def write_output(
     revenue_map: dict[tuple[str, str], float],
     input_path: str,
+    top_k: int = TOP_K,
+    min_revenue: float = MIN_REVENUE,
 ) -> str:
 
-    #date_str    = datetime.now().strftime("%Y-%m-%d")
-    date_str   = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    filename = f"{date_str}{OUTPUT_SUFFIX}"
+    output_path = report_path(input_path)
+    sorted_rows = top_revenue(revenue_map.items(), top_k, min_revenue)
 
-    if _is_s3(input_path):
-        base = input_path.rstrip("/")
-        output_path = f"{base}/{filename}"
-    else:
-        output_path = str(Path(input_path).parent / filename)
+    with _open_output(output_path) as fh:
+        writer = csv.writer(fh, delimiter=TSV_DELIMITER)
+        writer.writerow(OUTPUT_HEADER)
+        writer.writerows([domain, keyword, f"{revenue:.2f}"] for (domain, keyword), revenue in sorted_rows)
 
-    sorted_rows = sorted(revenue_map.items(), key=lambda x: x[1], reverse=True)
+    logger.info("Output -> %s  (%d rows)", output_path, len(sorted_rows))
+    return output_path
 
-    buf = io.StringIO()
-    writer = csv.writer(buf, delimiter=TSV_DELIMITER)
-    writer.writerow(OUTPUT_HEADER)
-    for (domain, keyword), revenue in sorted_rows:
-        writer.writerow([domain, keyword, f"{revenue:.2f}"])
-    content = buf.getvalue()
 
-    if _is_s3(output_path):
-        _write_s3(content, output_path)
-    else:
-        _write_local(content, output_path)
+def sidecar_path(output_path: str, suffix: str) -> str:
+    # a file next to the report with the same timestamp, e.g. the run metrics
+    if output_path.endswith(OUTPUT_SUFFIX):
+        return output_path[: -len(OUTPUT_SUFFIX)] + suffix
+    return output_path + suffix
 
-    logger.info("Output -> %s  (%d rows)", output_path, len(sorted_rows))
-    return output_path
+
+def write_metrics(metrics, output_path: str) -> str:
+    metrics_path = sidecar_path(output_path, METRICS_SUFFIX)
+    with _open_output(metrics_path) as fh:
+        fh.write(metrics.to_json() + "\n")
+    logger.info("Metrics -> %s", metrics_path)
+    return metrics_path
 
 '''
 #older logic working fine for local execution and on ec2 instance without spark changes and glue job as it doesnt require the s3 bucket path
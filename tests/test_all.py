@@ -1,9 +1,20 @@
 from __future__ import annotations
+import bz2
 import csv
+import gzip
+import importlib.util
+import io
+import json
 import os
+import shutil
+import struct
+import subprocess
 import sys
 import tempfile
 import unittest
+import zlib
+from collections import defaultdict
+from unittest import mock
 from datetime import datetime
 from pathlib import Path
 
@@ -11,9 +22,22 @@ from pathlib import Path
 PROJECT_ROOT = Path(__file__).parent.parent
 sys.path.insert(0, str(PROJECT_ROOT))
 
-from src.parsers import parse_referrer, parse_revenue, _has_purchase
-from src.processor import ChunkedProcessor
-from src.writer import write_output
+from src import s3
+from src.compression import _bgzf_members, detect_compression, open_binary
+from src.parsers import (
+    InternedReferrerCache, ReferrerCache, format_cache_stats, parse_referrer, parse_revenue, parse_revenue_batch, split_referrer,
+    _has_purchase,
+)
+from src.processor import ChunkedProcessor, IncrementalProcessor, ParallelProcessor, auto_backend
+from src.metrics import Metrics
+from src.profiling import Profiler
+from src.ranking import top_revenue
+from src import columnar, ordering, search_state
+from src.ordering import reorder_rows, sort_rows
+from src.search_state import LastSearchStore
+from src.symbols import SymbolTable
+from src.readers import iter_projected_chunks, iter_range_rows, project_rows, resolve_inputs, split_ranges
+from src.writer import report_path, write_metrics, write_output
 
 
 # ── helpers 
@@ -36,6 +60,55 @@ def _make_tsv(rows: list[dict]) -> str:
     return f.name
 
 
+def _random_hits(n: int, seed: int) -> list[dict]:
+    """n hits at distinct random times below 10,000 from 8 IPs: searches, purchases, both or neither."""
+    import random
+    rng = random.Random(seed)
+    searches = [
+        "http://www.google.com/search?q=ipod", "http://www.bing.com/search?q=zune",
+        "http://search.yahoo.com/search?p=cd+player", "http://www.esshopzilla.com/",
+    ]
+    rows = []
+    for t in rng.sample(range(10_000), n):
+        row = {"hit_time_gmt": str(t), "ip": f"10.0.0.{rng.randrange(8)}"}
+        if rng.random() < 0.5:
+            row["referrer"] = rng.choice(searches)
+        if rng.random() < 0.4:
+            row["event_list"] = "1"
+            row["product_list"] = f"E;p;1;{rng.randrange(1, 500)};"
+        rows.append(row)
+    return rows
+
+
+def _dataset_hits(seed: int) -> list[dict]:
+    """_random_hits spread over about 12 days, so a columnar dataset gets several partitions, plus
+    one search without a usable time."""
+    rows = _random_hits(300, seed)
+    for row in rows:
+        row["hit_time_gmt"] = str(int(row["hit_time_gmt"]) * 97)
+    rows[7].update(hit_time_gmt="not a time", referrer="http://www.google.com/search?q=ipod")
+    return rows
+
+
+# hourly files, named so that name order and time order disagree
+_HOURS = {
+    "b.tsv": 3600,
+    "c.tsv": 7200,
+    "a.tsv": 0,
+}
+
+
+def _make_hourly_dir(rows: list[dict], hours: dict[str, int] = _HOURS) -> tuple[str, str]:
+    """Write rows to one file per hour in a temp directory, timed from each file's start second,
+    and the same hits in time order to a single file; returns (directory, single file)."""
+    directory = tempfile.mkdtemp()
+    single = _make_tsv([dict(r, hit_time_gmt=str(i)) for i, r in enumerate(rows * len(hours))])
+    for name, start in hours.items():
+        part = _make_tsv([dict(r, hit_time_gmt=str(start + i)) for i, r in enumerate(rows)])
+        os.replace(part, os.path.join(directory, name))
+    return directory, single
+
+
 # ── parse_referrer ──
 
 class TestParseReferrer(unittest.TestCase):
@@ -75,6 +148,116 @@ class TestParseReferrer(unittest.TestCase):
         self.assertEqual(parse_referrer(None), (None, None))
 
 
+class TestReferrerPreFilter(unittest.TestCase):
+    """parse_referrer skips urlparse/parse_qs; it must still agree with the full parse."""
+
+    @staticmethod
+    def _reference(referrer):
+        from urllib.parse import parse_qs, urlparse
+        from src.config import KEYWORD_PARAMS, SEARCH_ENGINE_MAP
+        if not referrer:
+            return None, None
+        try:
+            parsed = urlparse(referrer)
+        except ValueError:
+            return None, None
+        domain = SEARCH_ENGINE_MAP.get((parsed.hostname or "").lower())
+        if not domain:
+            return None, None
+        qs = parse_qs(parsed.query)
+        for param in KEYWORD_PARAMS:
+            values = qs.get(param)
+            if values and values[0].strip():
+                return domain, values[0].strip().lower()
+        return None, None
+
+    CASES = [
+        "http://WWW.Google.COM/search?q=Ipod",
+        "https://www.google.com:8080/search?q=ipod",
+        "http://user:pw@www.bing.com/search?q=zune",
+        "http://www.google.com.evil.net/search?q=ipod",
+        "http://www.google.com@evil.net/search?q=ipod",
+        "http://evil.net@www.google.com/search?q=ipod",
+        "  http://www.google.com/search?q=leading+space",
+        "http://www.google.com%25eth0/search?q=zone",
+        "http://evil.net/?u=http://www.google.com/search?q=ipod",
+        "http://www.google.com/search?q=&p=second",
+        "http://www.google.com/search?q=+&p=second",
+        "http://www.google.com/search?q=first&q=second",
+        "http://www.google.com/search?%71=encoded+name",
+        "http://www.google.com/search?q=caf%C3%A9+%E2%82%AC",
+        "http://www.google.com/search?q=bad%ZZescape",
+        "http://www.google.com/search?hl=en&q&q=real",
+        "http://www.google.com/search?text=a&query=b",
+        "http://www.google.com/search#q=fragment",
+        "http://www.goo\tgle.com/search?q=tab",
+        "http://[::1/search?q=x",
+        "www.google.com/search?q=noscheme",
+        "//www.google.com/search?q=relative",
+        "http://duckduckgo.com/?q=duck&t=h_",
+        "http://www.esshopzilla.com/product/?pid=as32213",
+    ]
+
+    def test_matches_full_parse(self):
+        for ref in self.CASES:
+            with self.subTest(ref=ref):
+                self.assertEqual(parse_referrer(ref), self._reference(ref))
+
+    def test_sample_data_referrers(self):
+        sample = PROJECT_ROOT / "data" / "data.sql"
+        if not sample.exists():
+            self.skipTest(f"Sample file not found: {sample}")
+        with open(sample, encoding="utf-8") as fh:
+            for row in csv.DictReader(fh, delimiter="\t"):
+                self.assertEqual(parse_referrer(row["referrer"]), self._reference(row["referrer"]))
+
+
+# ── ReferrerCache ─────────────────────────────────────────────────────────────
+
+class TestReferrerCache(unittest.TestCase):
+
+    GOOGLE = "http://www.google.com/search?q=Ipod"
+    BING   = "http://www.bing.com/search?q=Zune"
+    SHOP   = "http://www.esshopzilla.com/cart/"
+
+    def test_same_results_as_parse_referrer(self):
+        cache = ReferrerCache(maxsize=2)
+        for ref in [self.GOOGLE, self.SHOP, self.GOOGLE, self.BING, "", None, self.SHOP]:
+            self.assertEqual(cache.parse(ref), parse_referrer(ref))
+
+    def test_hits_misses_evictions(self):
+        cache = ReferrerCache(maxsize=2)
+        for ref in [self.GOOGLE, self.GOOGLE, self.BING, self.GOOGLE, self.SHOP, self.BING]:
+            cache.parse(ref)
+        # SHOP evicts BING (least recently used), so the last BING is a miss that evicts GOOGLE
+        self.assertEqual(cache.stats(), (2, 4, 2))
+        self.assertEqual(len(cache), 2)
+
+    def test_empty_referrers_bypass_cache(self):
+        cache = ReferrerCache(maxsize=2)
+        cache.parse("")
+        cache.parse(None)
+        self.assertEqual(cache.stats(), (0, 0, 0))
+
+    def test_disabled(self):
+        cache = ReferrerCache(maxsize=0)
+        self.assertEqual(cache.parse(self.GOOGLE), ("google.com", "ipod"))
+        self.assertEqual(len(cache), 0)
+
+    def test_interned_cache_answers_pair_ids(self):
+        symbols = SymbolTable()
+        cache = InternedReferrerCache(symbols, maxsize=2)
+        for ref in [self.GOOGLE, self.SHOP, self.GOOGLE, self.BING, "", None, self.SHOP, self.BING]:
+            pair_id = cache.parse(ref)
+            self.assertEqual(symbols.pair(pair_id) if pair_id >= 0 else (None, None), parse_referrer(ref))
+        self.assertEqual(len(symbols), 2)
+        self.assertEqual(cache.stats(), (2, 4, 2))
+
+    def test_format_stats(self):
+        self.assertIn("75.0%", format_cache_stats(3, 1, 0))
+        self.assertIn("0.0%", format_cache_stats(0, 0, 0))
+
+
 # ── parse_revenue ─────────────────────────────────────────────────────────────
 
 class TestParseRevenue(unittest.TestCase):
@@ -101,6 +284,50 @@ class TestParseRevenue(unittest.TestCase):
         self.assertAlmostEqual(parse_revenue("bad", "1"), 0.0)
 
 
+class TestRevenueParity(unittest.TestCase):
+    """parse_revenue tokenizes in place; it must agree with the split()-based version."""
+
+    @staticmethod
+    def _reference(product_list, event_list):
+        events = {e.strip() for e in (event_list or "").split(",") if e.strip()}
+        if "1" not in events or not product_list:
+            return 0.0
+        total = 0.0
+        for product in product_list.split(","):
+            fields = product.split(";")
+            if len(fields) > 3:
+                raw = fields[3].strip()
+                if raw:
+                    try:
+                        total += float(raw)
+                    except ValueError:
+                        pass
+        return total
+
+    EVENTS = ["1", " 1 ", "2,1", "1,2", "10,11", "12", "2, 1 ,3", ",1,", "", None, "1\n", "11,01", "\t1"]
+    PRODUCTS = [
+        "E;A;1;100;", "E;A;1;100", "E;A;1;;", "E;A;1; 5 ;", "E;A;1;1e3;", "E;A;1;abc;",
+        "E;A;1;5;,", ",E;A;1;5;", "E;A;1;5;,bad,E;B;2;7.25;x", ";;;", ";;;9", "E;A",
+        "E;A;1;1_0;", "E;A;1;-3;", "", None,
+    ]
+
+    def test_matches_split_version(self):
+        for events in self.EVENTS:
+            for products in self.PRODUCTS:
+                with self.subTest(events=events, products=products):
+                    self.assertEqual(parse_revenue(products, events), self._reference(products, events))
+
+    def test_has_purchase(self):
+        for events in self.EVENTS:
+            with self.subTest(events=events):
+                self.assertEqual(_has_purchase(events or ""), self._reference("E;A;1;1;", events) > 0)
+
+    def test_batch_matches_scalar(self):
+        pairs = [(p, e) for e in self.EVENTS for p in self.PRODUCTS]
+        products, events = zip(*pairs)
+        self.assertEqual(parse_revenue_batch(products, events), [parse_revenue(p, e) for p, e in pairs])
+
+
 # ── ChunkedProcessor ──────────────────────────────────────────────────────────
 
 class TestChunkedProcessor(unittest.TestCase):
@@ -168,6 +395,1012 @@ class TestChunkedProcessor(unittest.TestCase):
             ChunkedProcessor("/nonexistent/file.tsv").process()
 
 
+# ── byte-range reader ─────────────────────────────────────────────────────────
+
+class TestByteRangeReader(unittest.TestCase):
+
+    ROWS = [
+        {"ip": f"10.0.0.{i}", "user_agent": 'Mozilla/5.0 "X11"\tLinux' if i % 3 == 0 else "curl/7.1",
+         "referrer": f"http://www.google.com/search?q=item{i}", "product_list": "E;A;1;1.5;"}
+        for i in range(200)
+    ]
+
+    def setUp(self):
+        self.path = _make_tsv(self.ROWS)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def _dict_rows(self):
+        with open(self.path, encoding="utf-8") as fh:
+            return [list(r.values()) for r in csv.DictReader(fh, delimiter="\t")]
+
+    def test_ranges_start_on_line_boundaries(self):
+        _, ranges = split_ranges(self.path, 7)
+        with open(self.path, "rb") as fh:
+            data = fh.read()
+        self.assertGreater(len(ranges), 1)
+        self.assertEqual(ranges[-1][1], len(data))
+        for start, end in ranges:
+            self.assertEqual(data[start - 1:start], b"\n")
+            self.assertLess(start, end)
+
+    def test_ranges_match_dictreader(self):
+        header, ranges = split_ranges(self.path, 5)
+        self.assertEqual(header[3], "ip")
+        rows = [row for start, end in ranges for row in iter_range_rows(self.path, start, end, block_size=256)]
+        self.assertEqual(rows, self._dict_rows())
+        self.assertIn("\t", rows[0][2])
+
+    def test_more_ranges_than_lines(self):
+        _, ranges = split_ranges(self.path, 10_000)
+        self.assertEqual(len(ranges), len(self.ROWS))
+
+    def test_projected_chunks_match_dictreader(self):
+        cols = ("ip", "referrer", "event_list", "product_list")
+        with open(self.path, encoding="utf-8") as fh:
+            expected = [tuple(r[c] for c in cols) for r in csv.DictReader(fh, delimiter="\t")]
+        chunks = list(iter_projected_chunks(self.path, cols, 64))
+        self.assertEqual([len(c) for c in chunks], [64, 64, 64, 8])
+        self.assertEqual([row for chunk in chunks for row in chunk], expected)
+
+    def test_project_short_rows_and_missing_columns(self):
+        rows = [["a", "b", "c"], ["d"]]
+        self.assertEqual(list(project_rows(rows, ["x", "y", "z"], ("z", "x"))), [("c", "a"), ("", "d")])
+        self.assertEqual(list(project_rows(rows, ["x", "y", "z"], ("w", "y"))), [("", "b"), ("", "")])
+
+    def test_header_only(self):
+        path = _make_tsv([])
+        try:
+            header, ranges = split_ranges(path, 4)
+            self.assertEqual(len(header), 12)
+            self.assertEqual(ranges, [])
+        finally:
+            os.unlink(path)
+
+
+# ── ParallelProcessor ─────────────────────────────────────────────────────────
+
+class TestParallelProcessor(unittest.TestCase):
+
+    ROWS = [
+        {"ip": "1.1.1.1", "referrer": "http://www.google.com/search?q=Ipod"},
+        {"ip": "2.2.2.2", "referrer": "http://www.bing.com/search?q=Zune"},
+        {"ip": "1.1.1.1", "event_list": "1", "product_list": "E;Ipod;1;0.1;"},
+        {"ip": "3.3.3.3", "referrer": "http://www.google.com/search?q=ipod"},
+        {"ip": "2.2.2.2", "event_list": "1", "product_list": "E;Zune;1;250;"},
+        {"ip": "3.3.3.3", "event_list": "1", "product_list": "E;Ipod;1;0.2;,E;Case;1;0.7;"},
+        {"ip": "4.4.4.4", "event_list": "1", "product_list": "E;Ipod;1;99;"},
+        {"ip": "1.1.1.1", "referrer": "http://search.yahoo.com/search?p=cd+player"},
+        {"ip": "1.1.1.1", "event_list": "2,1", "product_list": "E;CD;1;0.3;"},
+    ]
+
+    def _run_both(self, rows, workers):
+        path = _make_tsv(rows)
+        try:
+            return ChunkedProcessor(path).process(), ParallelProcessor(path, workers=workers).process()
+        finally:
+            os.unlink(path)
+
+    def test_matches_serial(self):
+        for workers in (1, 2, 3):
+            serial, parallel = self._run_both(self.ROWS * 50, workers)
+            self.assertEqual(parallel, serial)
+            self.assertEqual(list(parallel), list(serial))
+
+    def test_sample_data_matches_serial(self):
+        sample = PROJECT_ROOT / "data" / "data.sql"
+        if not sample.exists():
+            self.skipTest(f"Sample file not found: {sample}")
+        self.assertEqual(
+            ParallelProcessor(str(sample), workers=4).process(),
+            ChunkedProcessor(str(sample)).process(),
+        )
+
+    def test_file_not_found(self):
+        with self.assertRaises(FileNotFoundError):
+            ParallelProcessor("/nonexistent/file.tsv", workers=2).process()
+
+
+# ── multi-file input ──────────────────────────────────────────────────────────
+
+class TestMultiFileInput(unittest.TestCase):
+
+    HOURS = _HOURS
+
+    def setUp(self):
+        self.dir, self.single = _make_hourly_dir(TestParallelProcessor.ROWS * 3, self.HOURS)
+        with open(os.path.join(self.dir, "2026-01-01_00-00-00_SearchKeywordPerformance.tab"), "w") as fh:
+            fh.write("not an input\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        os.unlink(self.single)
+
+    def test_directory_is_ordered_by_first_hit_time(self):
+        names = [os.path.basename(p) for p in resolve_inputs(self.dir)]
+        self.assertEqual(names, ["a.tsv", "b.tsv", "c.tsv"])
+
+    def test_glob_and_manifest(self):
+        manifest = os.path.join(self.dir, "hits.manifest")
+        with open(manifest, "w") as fh:
+            fh.write("# hourly parts\nc.tsv\n\na.tsv\n")
+        self.assertEqual(
+            [os.path.basename(p) for p in resolve_inputs(manifest)], ["a.tsv", "c.tsv"]
+        )
+        self.assertEqual(len(resolve_inputs(os.path.join(self.dir, "*.tsv"))), 3)
+        self.assertEqual(resolve_inputs(self.single), [self.single])
+
+    def test_manifest_with_missing_file(self):
+        manifest = os.path.join(self.dir, "hits.manifest")
+        with open(manifest, "w") as fh:
+            fh.write("a.tsv\nmissing.tsv\n")
+        with self.assertRaises(FileNotFoundError):
+            resolve_inputs(manifest)
+
+    def test_matches_single_file(self):
+        expected = ChunkedProcessor(self.single).process()
+        for source in (self.dir, os.path.join(self.dir, "*.tsv")):
+            with self.subTest(source=source):
+                self.assertEqual(ChunkedProcessor(source).process(), expected)
+                parallel = ParallelProcessor(source, workers=3).process()
+                self.assertEqual(parallel, expected)
+                self.assertEqual(list(parallel), list(expected))
+
+    def test_file_name_with_glob_characters(self):
+        path = os.path.join(self.dir, "hits[1]?.tsv")
+        shutil.copy(os.path.join(self.dir, "a.tsv"), path)
+        self.assertEqual(resolve_inputs(path), [path])
+        self.assertEqual(ChunkedProcessor(path).process(), ChunkedProcessor(os.path.join(self.dir, "a.tsv")).process())
+
+    def test_compressed_files_probed_without_prefetch(self):
+        for name in self.HOURS:
+            path = os.path.join(self.dir, name)
+            with open(path, "rb") as src, gzip.open(path + ".gz", "wb") as dst:
+                dst.write(src.read())
+            os.unlink(path)
+        with mock.patch("src.compression.PrefetchReader") as prefetch:
+            names = [os.path.basename(p) for p in resolve_inputs(self.dir)]
+        prefetch.assert_not_called()
+        self.assertEqual(names, ["a.tsv.gz", "b.tsv.gz", "c.tsv.gz"])
+
+    def test_main_resolves_inputs_once(self):
+        import main
+        with mock.patch.object(sys, "argv", ["main.py", self.dir]), \
+                mock.patch("main.resolve_inputs", wraps=resolve_inputs) as resolve, \
+                mock.patch("src.processor.resolve_inputs", side_effect=AssertionError("resolved again")), \
+                mock.patch("sys.stdout", new_callable=io.StringIO):
+            main.main()
+        resolve.assert_called_once_with(self.dir)
+
+    def test_main_runs_the_requested_backend_for_several_files(self):
+        import main
+        auto = {"chunked": "ChunkedProcessor", "parallel": "ParallelProcessor"}[
+            auto_backend(resolve_inputs(self.dir), order=main.ORDER)
+        ]
+        for processor, expected in (("chunked", "ChunkedProcessor"), ("parallel", "ParallelProcessor"), ("auto", auto)):
+            with self.subTest(processor=processor), mock.patch.object(main, "PROCESSOR", processor), \
+                    mock.patch.object(sys, "argv", ["main.py", self.dir]), \
+                    mock.patch("sys.stdout", new_callable=io.StringIO), \
+                    self.assertLogs("main", "INFO") as logs:
+                main.main()
+            self.assertIn(f"Back-end: {expected}", "\n".join(logs.output))
+
+
+# ── compressed input ──────────────────────────────────────────────────────────
+
+def _bgzf(data: bytes, block: int) -> bytes:
+    """BGZF-style gzip: one member per block, total member size in a "BC" extra subfield."""
+    out = []
+    for i in range(0, len(data), block):
+        chunk = data[i:i + block]
+        c = zlib.compressobj(6, zlib.DEFLATED, -15)
+        body = c.compress(chunk) + c.flush()
+        bsize = 12 + 6 + len(body) + 8
+        out.append(
+            b"\x1f\x8b\x08\x04" + b"\x00" * 4 + b"\x00\xff" + struct.pack("<H", 6)
+            + b"BC" + struct.pack("<HH", 2, bsize - 1) + body
+            + struct.pack("<II", zlib.crc32(chunk), len(chunk))
+        )
+    return b"".join(out)
+
+
+class TestCompressedInput(unittest.TestCase):
+
+    def setUp(self):
+        self.plain = _make_tsv(TestParallelProcessor.ROWS * 300)
+        with open(self.plain, "rb") as fh:
+            self.data = fh.read()
+        self.paths = []
+
+    def tearDown(self):
+        for p in [self.plain] + self.paths:
+            os.unlink(p)
+
+    def _write(self, payload: bytes, suffix: str = "") -> str:
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(payload)
+        self.paths.append(path)
+        return path
+
+    def _variants(self) -> dict[str, bytes]:
+        half = len(self.data) // 2
+        variants = {
+            "gzip": gzip.compress(self.data),
+            "gzip multi-member": gzip.compress(self.data[:half]) + gzip.compress(self.data[half:]),
+            "bgzf": _bgzf(self.data, 4096),
+            "bz2": bz2.compress(self.data[:half]) + bz2.compress(self.data[half:]),
+        }
+        try:
+            import zstandard
+        except ImportError:
+            return variants
+        c = zstandard.ZstdCompressor()
+        variants["zstd frames"] = b"".join(c.compress(self.data[i:i + 5000]) for i in range(0, len(self.data), 5000))
+        stream = c.compressobj()
+        variants["zstd stream"] = stream.compress(self.data) + stream.flush()
+        return variants
+
+    def test_decompressed_bytes(self):
+        self.assertIsNone(detect_compression(self.plain))
+        for name, payload in self._variants().items():
+            with self.subTest(name):
+                # no extension on purpose, detection goes by magic bytes
+                path = self._write(payload)
+                self.assertEqual(detect_compression(path), name.split()[0].replace("bgzf", "gzip"))
+                with open_binary(path) as fh:
+                    self.assertEqual(fh.read(), self.data)
+
+    def test_bgzf_members_are_located(self):
+        mm = _bgzf(self.data, 4096)
+        self.assertEqual(len(_bgzf_members(mm)), -(-len(self.data) // 4096))
+        self.assertIsNone(_bgzf_members(gzip.compress(self.data)))
+
+    def test_processors_match_plain(self):
+        expected = ChunkedProcessor(self.plain).process()
+        for name, payload in self._variants().items():
+            with self.subTest(name):
+                path = self._write(payload, ".gz")
+                self.assertEqual(ChunkedProcessor(path).process(), expected)
+                self.assertEqual(ParallelProcessor(path, workers=2).process(), expected)
+
+    def test_truncated_stream(self):
+        path = self._write(gzip.compress(self.data)[:-100])
+        with self.assertRaises(EOFError):
+            ChunkedProcessor(path).process()
+
+    def test_close_before_end(self):
+        path = self._write(_bgzf(self.data, 1024))
+        with open_binary(path) as fh:
+            fh.read(10)
+
+
+# ── s3:// input ───────────────────────────────────────────────────────────────
+
+try:
+    import boto3
+    from moto import mock_aws
+    MOTO_AVAILABLE = True
+except ImportError:
+    MOTO_AVAILABLE = False
+
+
+@unittest.skipUnless(MOTO_AVAILABLE, "boto3 / moto not installed — skipping S3 tests")
+class TestS3Input(unittest.TestCase):
+
+    def setUp(self):
+        env = mock.patch.dict(os.environ, {
+            "AWS_ACCESS_KEY_ID": "testing", "AWS_SECRET_ACCESS_KEY": "testing", "AWS_DEFAULT_REGION": "us-east-1",
+        })
+        env.start()
+        self.addCleanup(env.stop)
+        aws = mock_aws()
+        aws.start()
+        self.addCleanup(aws.stop)
+        # the client is cached per process, it has to be created inside the mock
+        s3.get_client.cache_clear()
+        self.addCleanup(s3.get_client.cache_clear)
+        # small ranges so even a test file is fetched in many concurrent GETs
+        for name, value in (("S3_RANGE_SIZE", 1000), ("S3_CONCURRENCY", 3), ("S3_PREFETCH_RANGES", 4)):
+            patch = mock.patch.object(s3, name, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        boto3.client("s3").create_bucket(Bucket="hits")
+        self.plain = _make_tsv(TestParallelProcessor.ROWS * 100)
+        self.addCleanup(os.unlink, self.plain)
+        with open(self.plain, "rb") as fh:
+            self.data = fh.read()
+
+    def _put(self, key: str, body: bytes) -> str:
+        boto3.client("s3").put_object(Bucket="hits", Key=key, Body=body)
+        return f"s3://hits/{key}"
+
+    def test_ranged_read_returns_object(self):
+        path = self._put("input/data.tsv", self.data)
+        client = s3.get_client()
+        with mock.patch.object(client, "get_object", wraps=client.get_object) as get_object:
+            with open_binary(path) as fh:
+                self.assertEqual(fh.read(), self.data)
+        calls = get_object.call_args_list
+        self.assertEqual(len(calls), -(-len(self.data) // 1000))
+        self.assertIn("bytes=1000-1999", {c.kwargs["Range"] for c in calls})
+        self.assertTrue(all(c.kwargs["IfMatch"] for c in calls))
+
+    def test_chunked_processor_matches_local(self):
+        expected = ChunkedProcessor(self.plain).process()
+        path = self._put("input/data.tsv", self.data)
+        self.assertEqual(ChunkedProcessor(path).process(), expected)
+        gz_path = self._put("input/data.tsv.gz", gzip.compress(self.data))
+        self.assertEqual(ChunkedProcessor(gz_path).process(), expected)
+
+    def test_empty_object(self):
+        path = self._put("input/empty.tsv", b"")
+        self.assertIsNone(detect_compression(path))
+        self.assertEqual(ChunkedProcessor(path).process(), {})
+
+    def test_missing_object(self):
+        with self.assertRaises(FileNotFoundError):
+            ChunkedProcessor("s3://hits/input/missing.tsv").process()
+
+    def _report(self, revenue_map: dict) -> tuple[str, list[list[str]]]:
+        out = write_output(revenue_map, "s3://hits/output/")
+        bucket, key = s3.split_s3_path(out)
+        body = boto3.client("s3").get_object(Bucket=bucket, Key=key)["Body"].read().decode("utf-8")
+        return out, list(csv.reader(io.StringIO(body, newline=""), delimiter="\t"))
+
+    def test_small_report_is_one_put(self):
+        out, rows = self._report(TestWriteOutput.SAMPLE_MAP)
+        self.assertTrue(out.startswith("s3://hits/output/"))
+        self.assertEqual(rows[1], ["google.com", "ipod", "290.00"])
+
+    def test_large_report_is_multipart(self):
+        revenue_map = {("google.com", f"keyword {i}"): float(i) for i in range(5000)}
+        client = s3.get_client()
+        with mock.patch.object(s3, "S3_PART_SIZE", 10_000), \
+                mock.patch("moto.s3.models.S3_UPLOAD_PART_MIN_SIZE", 0), \
+                mock.patch.object(client, "upload_part", wraps=client.upload_part) as upload_part:
+            _, rows = self._report(revenue_map)
+        self.assertGreater(upload_part.call_count, 5)
+        self.assertEqual(len(rows), 5001)
+        self.assertEqual(rows[1], ["google.com", "keyword 4999", "4999.00"])
+        self.assertEqual(rows[-1], ["google.com", "keyword 0", "0.00"])
+
+    def test_failed_report_aborts_upload(self):
+        client = s3.get_client()
+        with mock.patch.object(s3, "S3_PART_SIZE", 10), \
+                mock.patch("moto.s3.models.S3_UPLOAD_PART_MIN_SIZE", 0):
+            with self.assertRaises(RuntimeError), s3.S3Writer("s3://hits/output/partial.tab") as fh:
+                fh.write("x" * 100)
+                raise RuntimeError("boom")
+        self.assertEqual(client.list_multipart_uploads(Bucket="hits").get("Uploads", []), [])
+        self.assertNotIn("Contents", client.list_objects_v2(Bucket="hits", Prefix="output/"))
+
+    def test_failed_complete_aborts_upload(self):
+        from botocore.exceptions import ClientError
+        client = s3.get_client()
+        refused = ClientError({"Error": {"Code": "InternalError", "Message": "retry"}}, "CompleteMultipartUpload")
+        with mock.patch.object(s3, "S3_PART_SIZE", 10), \
+                mock.patch("moto.s3.models.S3_UPLOAD_PART_MIN_SIZE", 0), \
+                mock.patch.object(client, "complete_multipart_upload", side_effect=refused), \
+                mock.patch.object(client, "abort_multipart_upload", wraps=client.abort_multipart_upload) as abort:
+            with self.assertRaises(ClientError), s3.S3Writer("s3://hits/output/refused.tab") as fh:
+                fh.write("x" * 100)
+        abort.assert_called_once()
+        self.assertEqual(client.list_multipart_uploads(Bucket="hits").get("Uploads", []), [])
+        self.assertNotIn("Contents", client.list_objects_v2(Bucket="hits", Prefix="output/"))
+
+
+# ── IncrementalProcessor ──────────────────────────────────────────────────────
+
+class TestIncrementalProcessor(unittest.TestCase):
+
+    ROWS = TestParallelProcessor.ROWS
+
+    def setUp(self):
+        self.path = _make_tsv(self.ROWS * 20)
+        self.checkpoint = self.path + ".ckpt"
+        with open(self.path, "rb") as fh:
+            self.data = fh.read()
+
+    def tearDown(self):
+        for p in (self.path, self.checkpoint):
+            if os.path.exists(p):
+                os.unlink(p)
+
+    def _write(self, data: bytes) -> None:
+        with open(self.path, "wb") as fh:
+            fh.write(data)
+
+    def _run(self):
+        return IncrementalProcessor(self.path, self.checkpoint).process()
+
+    def test_appends_match_full_run(self):
+        expected = ChunkedProcessor(self.path).process()
+        lines = self.data.splitlines(keepends=True)
+        for cut in (1, 30, 31, 95, len(lines)):
+            self._write(b"".join(lines[:cut]))
+            result = self._run()
+        self.assertEqual(result, expected)
+        self.assertEqual(list(result), list(expected))
+
+    def test_no_new_data_skips_reading(self):
+        first = self._run()
+        with mock.patch("src.processor.iter_range_rows") as reader:
+            self.assertEqual(self._run(), first)
+        reader.assert_not_called()
+
+    def test_partial_last_line_waits_for_next_run(self):
+        expected = ChunkedProcessor(self.path).process()
+        cut = self.data.rindex(b"E;CD")
+        self._write(self.data[:cut])
+        self._run()
+        self._write(self.data)
+        self.assertEqual(self._run(), expected)
+
+    def test_rewritten_file_starts_over(self):
+        self._run()
+        other = _make_tsv([
+            {"ip": "9.9.9.9", "referrer": "http://www.bing.com/search?q=zune"},
+            {"ip": "9.9.9.9", "event_list": "1", "product_list": "E;Zune;1;5;"},
+        ])
+        try:
+            with open(other, "rb") as fh:
+                self._write(fh.read())
+        finally:
+            os.unlink(other)
+        self.assertEqual(self._run(), {("bing.com", "zune"): 5.0})
+
+    def test_checkpoint_is_header_then_rows(self):
+        expected = self._run()
+        with open(self.checkpoint, encoding="utf-8") as fh:
+            header, *rows = [json.loads(line) for line in fh]
+        self.assertEqual(header["offset"], len(self.data))
+        revenue, last_search = rows[: header["revenue"]], rows[header["revenue"]:]
+        self.assertEqual(list({(domain, keyword): r for domain, keyword, r in revenue}.items()), list(expected.items()))
+        self.assertTrue(last_search)
+        self.assertTrue(all(len(row) == 4 for row in last_search))
+
+    def test_no_new_data_reads_only_header_and_totals(self):
+        first = self._run()
+        # the last-search rows are not parsed when there is nothing new to attribute
+        with open(self.checkpoint, "a", encoding="utf-8") as fh:
+            fh.write("not json\n")
+        self.assertEqual(self._run(), first)
+
+    def test_older_checkpoint_starts_over(self):
+        expected = ChunkedProcessor(self.path).process()
+        with open(self.checkpoint, "w", encoding="utf-8") as fh:
+            json.dump({"version": 2, "offset": len(self.data), "fingerprint": "", "last_search": [], "revenue": []}, fh)
+        self.assertEqual(self._run(), expected)
+
+    def test_changed_settings_are_refused(self):
+        from src import checkpoint
+        self._run()
+        with self.assertRaisesRegex(ValueError, "attribution_window"):
+            IncrementalProcessor(self.path, self.checkpoint, attribution_window=100).process()
+        engines = {**checkpoint.SEARCH_ENGINE_MAP, "search.example.org": "example.org"}
+        with mock.patch.object(checkpoint, "SEARCH_ENGINE_MAP", engines), \
+                self.assertRaisesRegex(ValueError, "search_engine_map"):
+            self._run()
+        # the checkpoint is left alone for a run with the original settings
+        self.assertEqual(self._run(), ChunkedProcessor(self.path).process())
+
+    def test_main_refuses_checkpoint_for_other_backends(self):
+        import main
+        for processor, workers in (("spark", 0), ("parallel", 0), ("chunked", 4)):
+            with self.subTest(processor=processor, workers=workers), \
+                    mock.patch.multiple(main, CHECKPOINT=self.checkpoint, PROCESSOR=processor, WORKERS=workers), \
+                    mock.patch.object(sys, "argv", ["main.py", self.path]), \
+                    mock.patch("sys.stdout", new_callable=io.StringIO) as out, \
+                    self.assertRaises(SystemExit):
+                main.main()
+            self.assertIn("CHECKPOINT", out.getvalue())
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_resumed_state_spills_past_cap(self):
+        expected = ChunkedProcessor(self.path).process()
+        lines = self.data.splitlines(keepends=True)
+        self._write(b"".join(lines[:60]))
+        self._run()
+        self._write(self.data)
+        with mock.patch.object(search_state, "LAST_SEARCH_MEMORY_ENTRIES", 2), \
+                self.assertLogs("src.search_state", "INFO") as logs:
+            self.assertEqual(self._run(), expected)
+        self.assertTrue(any("Spilled" in line for line in logs.output))
+
+
+# ── last_search state ─────────────────────────────────────────────────────────
+
+class TestLastSearchStore(unittest.TestCase):
+
+    def test_keys_round_trip(self):
+        with LastSearchStore() as store:
+            for ip in ("1.2.3.4", "255.255.255.255", "0.0.0.0", "01.2.3.4", "::1", "not an ip", ""):
+                store[ip] = ("google.com", ip)
+            self.assertEqual(dict(store.items()), {ip: ("google.com", ip) for ip in store})
+            self.assertEqual(store["01.2.3.4"], ("google.com", "01.2.3.4"))
+            self.assertEqual(store.get("1.2.3.4"), ("google.com", "1.2.3.4"))
+            self.assertIsNone(store.get("1.2.3.5"))
+            self.assertEqual(len(store), 7)
+
+    def test_pairs_are_interned(self):
+        with LastSearchStore() as store:
+            for i in range(100):
+                store[f"10.0.0.{i}"] = ("bing.com", "zune")
+            self.assertEqual(len(store.symbols), 1)
+            self.assertEqual(set(store._memory), set(range(0x0A000000, 0x0A000000 + 100)))
+
+    def test_symbol_table(self):
+        symbols = SymbolTable()
+        self.assertEqual(symbols.pair_id("bing.com", "zune"), 0)
+        self.assertEqual(symbols.pair_id("google.com", "zune"), 1)
+        self.assertEqual(symbols.pair_id("bing.com", "zune"), 0)
+        self.assertEqual(symbols.pair_id("example.org", "ipod"), 2)
+        # one copy of a keyword whatever the engine, engines are ids from SEARCH_ENGINE_MAP onwards
+        self.assertEqual(symbols.keywords, ["zune", "ipod"])
+        self.assertEqual(symbols.engines[-1], "example.org")
+        self.assertEqual(symbols.pairs(), [("bing.com", "zune"), ("google.com", "zune"), ("example.org", "ipod")])
+        revenue_map = {("google.com", "zune"): 2.0, ("yahoo.com", "cd player"): 1.0, ("bing.com", "zune"): 3.0}
+        totals = symbols.encode(revenue_map)
+        self.assertEqual(list(totals), [1, 3, 0])
+        self.assertEqual(list(symbols.decode(totals).items()), list(revenue_map.items()))
+
+    def test_spills_past_cap(self):
+        with LastSearchStore(max_entries=3) as store:
+            for i in range(10):
+                store[f"1.1.1.{i}"] = ("google.com", f"kw{i}")
+            store["1.1.1.0"] = ("bing.com", "again")
+            db_path = store._db_path
+            self.assertTrue(os.path.exists(db_path))
+            self.assertGreater(store.spills, 0)
+            self.assertLessEqual(len(store._memory), 3)
+            self.assertEqual(store["1.1.1.0"], ("bing.com", "again"))
+            self.assertEqual(store["1.1.1.5"], ("google.com", "kw5"))
+            self.assertNotIn("1.1.1.10", store)
+            self.assertEqual(len(store), 10)
+            self.assertEqual(dict(store.items())["1.1.1.0"], ("bing.com", "again"))
+            del store["1.1.1.5"]
+            self.assertNotIn("1.1.1.5", store)
+        self.assertFalse(os.path.exists(db_path))
+
+    def test_spill_keeps_recent_entries_in_memory(self):
+        with LastSearchStore(max_entries=4) as store:
+            for i in range(5):
+                store[f"1.1.1.{i}"] = ("google.com", f"kw{i}")
+            # the three oldest went to disk, the newer half of the cap stayed
+            self.assertEqual(store.spills, 1)
+            self.assertEqual(len(store._memory), 2)
+            self.assertEqual([store._memory.get(search_state.pack_ip(f"1.1.1.{i}")) is not None for i in range(5)],
+                             [False, False, False, True, True])
+            self.assertEqual(store["1.1.1.0"], ("google.com", "kw0"))
+
+    def test_detached_state_is_read_back_once(self):
+        store = LastSearchStore(max_entries=2, window=0)
+        for i in range(5):
+            store.put_id(i, i, 100 - i)
+        store.put_id(0, 7, 200)
+        path, memory = state = store.detach()
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(len(store), 0)
+        values = dict(search_state.iter_detached(state))
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(values, {i: (200 if i == 0 else 100 - i) << search_state.PAIR_BITS | (7 if i == 0 else i)
+                                  for i in range(5)})
+
+    def test_backends_match_with_spilling(self):
+        path = _make_tsv(TestParallelProcessor.ROWS * 30)
+        checkpoint = path + ".ckpt"
+        try:
+            expected = ChunkedProcessor(path).process()
+            with mock.patch.object(search_state, "LAST_SEARCH_MEMORY_ENTRIES", 2):
+                self.assertEqual(ChunkedProcessor(path).process(), expected)
+                # the workers' own last-search state and pending purchases spill too
+                parallel = ParallelProcessor(path, workers=2)
+                self.assertEqual(parallel.process(), expected)
+                self.assertGreater(parallel.metrics.counters["last_search_spills"], 0)
+                self.assertEqual(IncrementalProcessor(path, checkpoint).process(), expected)
+        finally:
+            for p in (path, checkpoint):
+                if os.path.exists(p):
+                    os.unlink(p)
+
+
+class TestAttributionWindow(unittest.TestCase):
+
+    G = "http://www.google.com/search?q=ipod"
+    B = "http://www.bing.com/search?q=zune"
+    # window of 100 seconds
+    ROWS = [
+        {"hit_time_gmt": "1000", "ip": "1.1.1.1", "referrer": G},
+        {"hit_time_gmt": "1050", "ip": "1.1.1.1", "event_list": "1", "product_list": "E;A;1;1;"},
+        {"hit_time_gmt": "1100", "ip": "1.1.1.1", "event_list": "1", "product_list": "E;A;1;2;"},
+        {"hit_time_gmt": "1101", "ip": "1.1.1.1", "event_list": "1", "product_list": "E;A;1;4;"},
+        {"hit_time_gmt": "1200", "ip": "2.2.2.2", "referrer": B},
+        {"hit_time_gmt": "1250", "ip": "1.1.1.1", "referrer": B},
+        {"hit_time_gmt": "1290", "ip": "1.1.1.1", "event_list": "1", "product_list": "E;A;1;8;"},
+        {"hit_time_gmt": "1301", "ip": "2.2.2.2", "event_list": "1", "product_list": "E;A;1;16;"},
+        # no usable time: opens no search and earns nothing
+        {"hit_time_gmt": "", "ip": "3.3.3.3", "referrer": G},
+        {"hit_time_gmt": "1400", "ip": "3.3.3.3", "event_list": "1", "product_list": "E;A;1;32;"},
+        {"hit_time_gmt": "1410", "ip": "2.2.2.2", "referrer": G},
+        {"hit_time_gmt": "x", "ip": "2.2.2.2", "event_list": "1", "product_list": "E;A;1;64;"},
+        {"hit_time_gmt": "1509.9", "ip": "2.2.2.2", "event_list": "1", "product_list": "E;A;1;128;"},
+    ]
+    EXPECTED = {("google.com", "ipod"): 131.0, ("bing.com", "zune"): 8.0}
+
+    def setUp(self):
+        self.path = _make_tsv(self.ROWS)
+
+    def tearDown(self):
+        for p in (self.path, self.path + ".ckpt"):
+            if os.path.exists(p):
+                os.unlink(p)
+
+    def test_chunked_backends(self):
+        self.assertEqual(ChunkedProcessor(self.path, attribution_window=100).process(), self.EXPECTED)
+        for workers in (1, 2, 3):
+            with self.subTest(workers=workers):
+                self.assertEqual(
+                    ParallelProcessor(self.path, workers=workers, attribution_window=100).process(),
+                    self.EXPECTED,
+                )
+        self.assertEqual(
+            IncrementalProcessor(self.path, self.path + ".ckpt", attribution_window=100).process(), self.EXPECTED,
+        )
+
+    def test_no_window_keeps_last_search_forever(self):
+        self.assertEqual(
+            ChunkedProcessor(self.path, attribution_window=0).process(),
+            {("google.com", "ipod"): 231.0, ("bing.com", "zune"): 24.0},
+        )
+
+    def test_incremental_resume_keeps_search_times(self):
+        with open(self.path, "rb") as fh:
+            data = fh.read()
+        lines = data.splitlines(keepends=True)
+        for cut in (2, 4, 7, len(lines)):
+            with open(self.path, "wb") as fh:
+                fh.write(b"".join(lines[:cut]))
+            result = IncrementalProcessor(self.path, self.path + ".ckpt", attribution_window=100).process()
+        self.assertEqual(result, self.EXPECTED)
+
+    def test_store_evicts_expired_searches(self):
+        with LastSearchStore(window=100) as store:
+            for t in range(0, 1000, 10):
+                store.put(f"10.0.{t // 256}.{t % 256}", ("google.com", "ipod"), t)
+            self.assertLessEqual(len(store), 100 // 10 + 100 // 8 // 10 + 1)
+            self.assertGreater(store.evicted, 0)
+            self.assertEqual(store.lookup("10.0.3.222", 1090), ("google.com", "ipod"))
+            self.assertIsNone(store.lookup("10.0.3.222", 1091))
+
+    def test_store_evicts_spilled_searches(self):
+        with LastSearchStore(max_entries=5, window=100) as store:
+            for t in range(0, 1000, 10):
+                store.put(f"10.0.{t // 256}.{t % 256}", ("google.com", "ipod"), t)
+            self.assertGreater(store.spills, 0)
+            self.assertLessEqual(len(store), 100 // 10 + 100 // 8 // 10 + 1)
+            self.assertEqual(sorted(t for *_, t in store.rows())[-1], 990)
+
+
+# ── time ordering in the chunked backend ──────────────────────────────────────
+
+class TestChunkedOrder(unittest.TestCase):
+
+    def _process(self, rows: list[dict], **kwargs) -> dict:
+        path = _make_tsv(rows)
+        try:
+            return ChunkedProcessor(path, **kwargs).process()
+        finally:
+            os.unlink(path)
+
+    def _by_time(self, rows: list[dict]) -> list[dict]:
+        return sorted(rows, key=lambda r: int(r["hit_time_gmt"]))
+
+    def test_sort_matches_time_ordered_file(self):
+        rows = _random_hits(300, 1)
+        expected = self._process(self._by_time(rows), order="file")
+        self.assertNotEqual(self._process(rows, order="file"), expected)
+        self.assertEqual(self._process(rows, order="sort"), expected)
+        with mock.patch.object(ordering, "SORT_RUN_ROWS", 7), mock.patch.object(ordering, "_MERGE_FAN_IN", 3):
+            self.assertEqual(self._process(rows, order="sort"), expected)
+
+    def test_reorder_fixes_nearly_sorted_input(self):
+        ordered = self._by_time(_random_hits(300, 2))
+        # swap neighbours within blocks of 10 rows
+        shuffled = []
+        for i in range(0, len(ordered), 10):
+            shuffled.extend(reversed(ordered[i:i + 10]))
+        expected = self._process(ordered, order="file")
+        with mock.patch.object(ordering, "REORDER_BUFFER_ROWS", 10):
+            self.assertEqual(self._process(shuffled, order="reorder"), expected)
+        with mock.patch.object(ordering, "REORDER_BUFFER_ROWS", 2), self.assertLogs("src.ordering", "WARNING"):
+            self.assertNotEqual(self._process(shuffled, order="reorder"), expected)
+
+    def test_rows_round_trip_through_runs(self):
+        rows = [("3", "a\tb", '"q"'), ("", "x\ny", ""), ("1", "", "\r"), ("nan", "z", "z"), ("2", "w", "w")]
+        expected = [rows[1], rows[3], rows[2], rows[4], rows[0]]
+        self.assertEqual(list(sort_rows(iter(rows), run_rows=2)), expected)
+        self.assertEqual(list(sort_rows(iter(rows), run_rows=10)), expected)
+        self.assertEqual(list(reorder_rows(iter(rows), buffer_rows=10)), expected)
+
+    def test_equal_times_keep_file_order(self):
+        rows = [("5", str(i)) for i in range(20)]
+        self.assertEqual(list(sort_rows(iter(rows), run_rows=3)), rows)
+        self.assertEqual(list(reorder_rows(iter(rows), buffer_rows=4)), rows)
+
+    def test_backends_reject_other_orders(self):
+        with self.assertRaises(ValueError):
+            ChunkedProcessor("unused", order="random")
+        path = _make_tsv([])
+        try:
+            with self.assertRaises(ValueError):
+                ParallelProcessor(path, order="sort")
+            with self.assertRaises(ValueError):
+                IncrementalProcessor(path, path + ".ckpt", order="reorder")
+        finally:
+            os.unlink(path)
+
+
+# ── columnar dataset ──────────────────────────────────────────────────────────
+
+@unittest.skipUnless(importlib.util.find_spec("pyarrow"), "pyarrow not installed")
+class TestColumnarDataset(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.rows = _dataset_hits(3)
+        self.raw = _make_tsv(self.rows)
+        self.dataset = os.path.join(self.tmp_dir, "hits")
+
+    def tearDown(self):
+        os.unlink(self.raw)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_split_referrer_matches_parse_referrer(self):
+        referrers = [
+            "http://www.google.com/search?q=Ipod", "https://search.yahoo.com/search?p=cd+player&q=x",
+            "http://www.esshopzilla.com/?q=ipod", "http://www.bing.com/", "http://WWW.BING.COM/?q=%20Zune%20",
+            "http://[::1/?q=x", "", "not a url", "http://user@google.com:80/?query=a&q=",
+        ]
+        for referrer in referrers:
+            with self.subTest(referrer=referrer):
+                host, keyword = split_referrer(referrer)
+                domain = columnar.SEARCH_ENGINE_MAP.get(host) if keyword else None
+                self.assertEqual(parse_referrer(referrer), (domain, keyword) if domain else (None, None))
+
+    def test_dataset_matches_raw_input(self):
+        manifest = columnar.ingest(self.raw, self.dataset, row_group_rows=16)
+        self.assertEqual(manifest["rows"], 300)
+        self.assertLess(manifest["kept_rows"], 300)
+        self.assertGreater(manifest["partitions"], 2)
+        self.assertTrue(os.path.isdir(os.path.join(self.dataset, columnar.NULL_PARTITION)))
+        self.assertEqual(resolve_inputs(self.dataset), [self.dataset])
+        for order in ("sort", "reorder"):
+            for window in (0, 500):
+                with self.subTest(order=order, window=window):
+                    self.assertEqual(
+                        ChunkedProcessor(self.dataset, attribution_window=window, order=order).process(),
+                        ChunkedProcessor(self.raw, attribution_window=window, order="sort").process(),
+                    )
+
+    def test_file_order_matches_unsorted_raw_input(self):
+        # unsorted times with several null ones: ORDER=file must follow the source rows, not the
+        # day partitions
+        for i in (3, 40, 41, 120):
+            self.rows[i].update(hit_time_gmt="", referrer="http://www.bing.com/search?q=nulltime")
+        raw = _make_tsv(self.rows)
+        try:
+            expected = ChunkedProcessor(raw, order="file").process()
+            columnar.ingest(raw, self.dataset, row_group_rows=16)
+            with mock.patch.object(columnar, "_MAX_OPEN_WRITERS", 1):
+                columnar.ingest(raw, self.dataset + "2", row_group_rows=5)
+        finally:
+            os.unlink(raw)
+        self.assertNotEqual(ChunkedProcessor(self.dataset, order="sort").process(), expected)
+        for dataset in (self.dataset, self.dataset + "2"):
+            with self.subTest(dataset=dataset):
+                got = ChunkedProcessor(dataset, order="file").process()
+                self.assertEqual(list(got.items()), list(expected.items()))
+
+    def test_null_time_search_does_not_move_ahead(self):
+        rows = [
+            {"hit_time_gmt": "100", "ip": "1.1.1.1", "referrer": "http://www.google.com/search?q=early"},
+            {"hit_time_gmt": "200", "ip": "1.1.1.1", "event_list": "1", "product_list": "E;A;1;10;"},
+            {"hit_time_gmt": "", "ip": "1.1.1.1", "referrer": "http://www.bing.com/search?q=nulltime"},
+            {"hit_time_gmt": "90000", "ip": "1.1.1.1", "referrer": "http://www.bing.com/search?q=late"},
+            {"hit_time_gmt": "90100", "ip": "1.1.1.1", "event_list": "1", "product_list": "E;A;1;5;"},
+        ]
+        raw = _make_tsv(rows)
+        try:
+            columnar.ingest(raw, self.dataset)
+            expected = ChunkedProcessor(raw).process()
+        finally:
+            os.unlink(raw)
+        self.assertEqual(expected, {("google.com", "early"): 10.0, ("bing.com", "late"): 5.0})
+        self.assertEqual(ChunkedProcessor(self.dataset).process(), expected)
+
+    def test_engine_map_change_needs_no_reingest(self):
+        columnar.ingest(self.raw, self.dataset)
+        engines = {"www.google.com": "google.com"}
+        with mock.patch.object(columnar, "SEARCH_ENGINE_MAP", engines), \
+                mock.patch("src.parsers.SEARCH_ENGINE_MAP", engines):
+            self.assertEqual(
+                ChunkedProcessor(self.dataset, order="sort").process(),
+                ChunkedProcessor(self.raw, order="sort").process(),
+            )
+
+    def test_stale_or_reused_dataset_is_rejected(self):
+        columnar.ingest(self.raw, self.dataset)
+        with self.assertRaises(ValueError):
+            columnar.ingest(self.raw, self.dataset)
+        with mock.patch.object(columnar, "KEYWORD_PARAMS", ["q"]):
+            with self.assertRaisesRegex(ValueError, "keyword_params"):
+                ChunkedProcessor(self.dataset).process()
+        with self.assertRaises(ValueError):
+            ParallelProcessor(self.dataset)
+        with self.assertRaises(ValueError):
+            IncrementalProcessor(self.dataset, self.dataset + ".ckpt")
+        self.assertEqual(os.path.dirname(report_path(self.dataset)), self.tmp_dir)
+        self.assertEqual(auto_backend([self.dataset]), "chunked")
+
+
+# ── metrics / profiling ───────────────────────────────────────────────────────
+
+class TestMetrics(unittest.TestCase):
+
+    ROWS = [
+        {"hit_time_gmt": "1000", "ip": "1.1.1.1", "referrer": "http://www.google.com/search?q=Ipod"},
+        {"hit_time_gmt": "1001", "ip": "2.2.2.2", "referrer": "http://www.google.com/search?q=Ipod"},
+        {"hit_time_gmt": "2000", "ip": "1.1.1.1", "event_list": "1", "product_list": "E;Ipod;1;290;"},
+        {"hit_time_gmt": "2001", "ip": "3.3.3.3", "event_list": "1", "product_list": "E;Zune;1;100;"},
+    ]
+
+    def test_stages_and_counters(self):
+        metrics = Metrics(progress_seconds=0)
+        with metrics.stage("a"):
+            pass
+        with metrics.stage("a"):
+            pass
+        self.assertEqual(list(metrics.timed("b", [1, 2, 3])), [1, 2, 3])
+        metrics.count("rows", 2)
+        metrics.count("rows")
+        metrics.set("backend", "x")
+        summary = metrics.as_dict()
+        self.assertEqual(set(summary["stages"]), {"a", "b"})
+        self.assertEqual(summary["counters"], {"rows": 3})
+        self.assertEqual(summary["info"], {"backend": "x"})
+
+    def test_chunked_processor_metrics(self):
+        path = _make_tsv(self.ROWS)
+        try:
+            processor = ChunkedProcessor(path)
+            processor.process()
+        finally:
+            os.unlink(path)
+        summary = processor.metrics.as_dict()
+        self.assertEqual(
+            list(summary["stages"]), ["read", "parse_referrer", "parse_revenue", "attribute"],
+        )
+        counters = summary["counters"]
+        self.assertEqual(counters["rows"], 4)
+        self.assertEqual(counters["purchase_rows"], 1)
+        self.assertEqual(counters["referrer_cache_hits"], 1)
+        self.assertGreater(counters["bytes_read"], 0)
+        self.assertEqual(summary["info"]["backend"], "ChunkedProcessor")
+
+    def test_parallel_processor_metrics(self):
+        path = _make_tsv(self.ROWS)
+        try:
+            processor = ParallelProcessor(path, workers=2)
+            processor.process()
+        finally:
+            os.unlink(path)
+        self.assertEqual(processor.metrics.counters["rows"], 4)
+        self.assertEqual(processor.metrics.counters["purchase_rows"], 1)
+
+    def test_metrics_written_next_to_report(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            out = write_output({("google.com", "ipod"): 290.0}, os.path.join(tmp_dir, "data.sql"))
+            metrics_path = write_metrics(Metrics(), out)
+            self.assertEqual(
+                os.path.basename(metrics_path),
+                os.path.basename(out).replace(".tab", ".metrics.json"),
+            )
+            with open(metrics_path, encoding="utf-8") as fh:
+                self.assertIn("stages", json.load(fh))
+            # neither file is read back when the directory is the input
+            open(os.path.join(tmp_dir, "data.sql"), "w").close()
+            self.assertEqual(resolve_inputs(tmp_dir), [os.path.join(tmp_dir, "data.sql")])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def _busy(self):
+        total = 0
+        for i in range(300_000):
+            total += parse_revenue("E;Ipod;1;290;", "1")
+        return total
+
+    def test_sampling_profiler(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            with Profiler("sample", interval=0.001) as profiler:
+                self._busy()
+            path = os.path.join(tmp_dir, "run.folded")
+            profiler.save(path)
+            with open(path, encoding="utf-8") as fh:
+                lines = fh.read().splitlines()
+        finally:
+            shutil.rmtree(tmp_dir)
+        self.assertTrue(lines)
+        self.assertTrue(any("_busy" in line for line in lines))
+        self.assertTrue(all(line.rsplit(" ", 1)[1].isdigit() for line in lines))
+        self.assertTrue(profiler.top())
+
+    def test_cprofile(self):
+        with Profiler("cprofile") as profiler:
+            self._busy()
+        functions = [entry["function"] for entry in profiler.top(50)]
+        self.assertTrue(any(f.startswith("_sum_product_revenue") for f in functions))
+
+    def test_unknown_profile_mode(self):
+        with self.assertRaises(ValueError):
+            Profiler("perf")
+
+
+# ── backend choice / start-up ─────────────────────────────────────────────────
+
+class TestAutoBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def _file(self, name: str, size: int, data: bytes | None = None) -> str:
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, "wb") as fh:
+            fh.write(data if data is not None else b"x" * size)
+        return path
+
+    def test_small_input_runs_chunked(self):
+        self.assertEqual(auto_backend([self._file("a.tsv", 100)], workers=4), "chunked")
+
+    @mock.patch("src.processor.AUTO_PARALLEL_BYTES", 1000)
+    def test_large_input_runs_parallel(self):
+        path = self._file("a.tsv", 5000)
+        self.assertEqual(auto_backend([path], workers=4), "parallel")
+        # one core, a single compressed stream or a time-ordered run gain nothing from a pool
+        self.assertEqual(auto_backend([path], workers=1), "chunked")
+        self.assertEqual(auto_backend([path], workers=4, order="sort"), "chunked")
+        compressed = self._file("a.tsv.gz", 0, gzip.compress(b"x" * 5000, compresslevel=0))
+        self.assertEqual(auto_backend([compressed], workers=4), "chunked")
+        self.assertEqual(auto_backend([compressed, compressed], workers=4), "parallel")
+
+    @mock.patch("src.processor.AUTO_PARALLEL_BYTES", 1000)
+    @mock.patch("src.processor.AUTO_SPARK_BYTES", 4000)
+    def test_huge_input_runs_spark_when_installed(self):
+        path = self._file("a.tsv", 5000)
+        with mock.patch("importlib.util.find_spec", return_value=object()):
+            self.assertEqual(auto_backend([path], workers=4), "spark")
+        with mock.patch("importlib.util.find_spec", return_value=None):
+            self.assertEqual(auto_backend([path], workers=4), "parallel")
+
+    def test_s3_input_runs_chunked(self):
+        self.assertEqual(auto_backend(["s3://bucket/hits.tsv"], workers=4), "chunked")
+
+    def test_spark_module_imports_without_pyspark_or_pandas(self):
+        out = subprocess.run(
+            [sys.executable, "-c",
+             "import sys, src.spark_processor; print(sorted({'pyspark', 'pandas'} & set(sys.modules)))"],
+            cwd=PROJECT_ROOT, capture_output=True, text=True, check=True,
+        ).stdout
+        self.assertEqual(out.strip(), "[]")
+
+
 # ── write_output ──────────────────────────────────────────────────────────────
 
 class TestWriteOutput(unittest.TestCase):
@@ -209,6 +1442,50 @@ class TestWriteOutput(unittest.TestCase):
                          f"Unexpected filename: {filename}")
 
 
+# ── top-K / minimum revenue ───────────────────────────────────────────────────
+
+class TestTopRevenue(unittest.TestCase):
+
+    def _map(self, n: int = 3000) -> dict:
+        import random
+        rng = random.Random(11)
+        engines = ["google.com", "bing.com", "yahoo.com"]
+        # few distinct revenues so there are plenty of ties
+        return {(rng.choice(engines), f"kw{i}"): float(rng.randrange(1, 40)) for i in range(n)}
+
+    def _reference(self, revenue_map, top_k, min_revenue):
+        rows = sorted(revenue_map.items(), key=lambda x: x[1], reverse=True)
+        seen: dict[str, int] = defaultdict(int)
+        out = []
+        for key, revenue in rows:
+            if revenue < min_revenue or (top_k and seen[key[0]] >= top_k):
+                continue
+            seen[key[0]] += 1
+            out.append((key, revenue))
+        return out
+
+    def test_matches_full_sort(self):
+        revenue_map = self._map()
+        for top_k, min_revenue in ((0, 0.0), (1, 0.0), (25, 0.0), (0, 20.0), (10, 35.0), (5000, 0.0)):
+            with self.subTest(top_k=top_k, min_revenue=min_revenue):
+                self.assertEqual(
+                    top_revenue(revenue_map.items(), top_k, min_revenue),
+                    self._reference(revenue_map, top_k, min_revenue),
+                )
+
+    def test_write_output_top_k(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            out = write_output(self._map(), os.path.join(tmp_dir, "data.sql"), top_k=3, min_revenue=10.0)
+            with open(out, encoding="utf-8") as fh:
+                rows = list(csv.reader(fh, delimiter="\t"))[1:]
+        finally:
+            shutil.rmtree(tmp_dir)
+        self.assertEqual(len(rows), 9)
+        self.assertEqual(sorted({r[0] for r in rows}), ["bing.com", "google.com", "yahoo.com"])
+        self.assertTrue(all(float(r[2]) >= 10.0 for r in rows))
+
+
 # ── end-to-end against sample data 
 
 class TestEndToEnd(unittest.TestCase):
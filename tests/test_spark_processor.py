@@ -1,6 +1,8 @@
 from __future__ import annotations
 import csv
+import importlib.util
 import os
+import shutil
 import sys
 import tempfile
 import unittest
@@ -9,11 +11,8 @@ from pathlib import Path
 PROJECT_ROOT = Path(__file__).parent.parent
 sys.path.insert(0, str(PROJECT_ROOT))
 
-try:
-    from pyspark.sql import SparkSession
-    PYSPARK_AVAILABLE = True
-except ImportError:
-    PYSPARK_AVAILABLE = False
+# find_spec only looks pyspark up, the import itself waits for setUpClass
+PYSPARK_AVAILABLE = importlib.util.find_spec("pyspark") is not None
 
 
 @unittest.skipUnless(PYSPARK_AVAILABLE, "PySpark not installed — skipping Spark tests")
@@ -49,11 +48,11 @@ class TestSparkProcessor(unittest.TestCase):
         f.close()
         return f.name
 
-    def _run(self, rows: list[dict]) -> dict:
+    def _run(self, rows: list[dict], **kwargs) -> dict:
         from src.spark_processor import SparkProcessor
         path = self._make_tsv(rows)
         try:
-            return SparkProcessor(path).process()
+            return SparkProcessor(path, **kwargs).process()
         finally:
             os.unlink(path)
 
@@ -110,6 +109,289 @@ class TestSparkProcessor(unittest.TestCase):
         self.assertAlmostEqual(result.get(("google.com", "ipod"), 0), 480.0)
         self.assertAlmostEqual(result.get(("bing.com",   "zune"), 0), 250.0)
 
+    def test_metrics(self):
+        from src.spark_processor import SparkProcessor
+        path = self._make_tsv([
+            {"hit_time_gmt": "1000", "ip": "1.1.1.1", "referrer": "http://www.google.com/search?q=Ipod"},
+            {"hit_time_gmt": "2000", "ip": "1.1.1.1", "event_list": "1", "product_list": "E;Ipod;1;290;"},
+        ])
+        try:
+            processor = SparkProcessor(path)
+            processor.process()
+        finally:
+            os.unlink(path)
+        metrics = processor.metrics
+        self.assertIn("session", metrics.stages)
+        self.assertIn("spark_jobs", metrics.stages)
+        self.assertEqual(metrics.info["unique_keywords"], 1)
+        # the Spark UI REST API is optional, its numbers are only there when it answered
+        if "spark_stages" in metrics.info:
+            self.assertGreater(metrics.counters["rows"], 0)
+            self.assertTrue(metrics.info["spark_stages"])
+
+    def test_directory_input_matches_single_file(self):
+        from src.spark_processor import SparkProcessor
+        from tests.test_all import TestParallelProcessor, _make_hourly_dir
+        directory, single = _make_hourly_dir(TestParallelProcessor.ROWS * 3)
+        try:
+            expected = SparkProcessor(single).process()
+            got = SparkProcessor(directory).process()
+        finally:
+            shutil.rmtree(directory)
+            os.unlink(single)
+        self.assertEqual(set(got), set(expected))
+        for key, revenue in expected.items():
+            self.assertAlmostEqual(got[key], revenue, places=6)
+
+    def test_top_k_matches_local_selection(self):
+        import random
+        from src.ranking import top_revenue
+        rng = random.Random(5)
+        rows = []
+        for i in range(300):
+            ip = f"10.1.{i}.1"
+            engine = rng.choice(["google.com", "bing.com", "yahoo.com"])
+            rows.append({"hit_time_gmt": "1", "ip": ip, "referrer": f"http://www.{engine}/search?q=kw{i}&p=kw{i}"})
+            rows.append({"hit_time_gmt": "2", "ip": ip, "event_list": "1", "product_list": f"E;A;1;{i + 1};"})
+        full = self._run(rows)
+        got = self._run(rows, top_k=4, min_revenue=50.0)
+        self.assertEqual(list(got.items()), top_revenue(full.items(), 4, 50.0))
+        self.assertEqual(len(got), 12)
+
+    # ── report written from the executors ─────────────────────────────
+
+    def _report_rows(self) -> list[dict]:
+        rows = []
+        keywords = ["ipod", "zune", '%22cd%22+player', "nano%09case", "x"]
+        for i in range(60):
+            ip = f"10.2.{i}.1"
+            engine = ["google.com", "bing.com", "yahoo.com"][i % 3]
+            keyword = f"{keywords[i % len(keywords)]}{i}"
+            rows.append({"hit_time_gmt": "1", "ip": ip, "referrer": f"http://www.{engine}/search?q={keyword}&p={keyword}"})
+            rows.append({"hit_time_gmt": "2", "ip": ip, "event_list": "1", "product_list": f"E;A;1;{i * 1.25 + 0.5};"})
+        return rows
+
+    def _write_both(self, **kwargs) -> tuple[bytes, bytes]:
+        from src.spark_processor import SparkProcessor
+        from src.writer import write_output
+        path = self._make_tsv(self._report_rows())
+        out_dir = tempfile.mkdtemp()
+        try:
+            processor = SparkProcessor(path, **kwargs)
+            spark_out = processor.write(out_dir + "/")
+            self.assertEqual(os.listdir(out_dir), [os.path.basename(spark_out)])
+            with open(spark_out, "rb") as fh:
+                spark_bytes = fh.read()
+            os.unlink(spark_out)
+            local_out = write_output(
+                processor.process(), out_dir + "/", top_k=processor.top_k, min_revenue=processor.min_revenue
+            )
+            with open(local_out, "rb") as fh:
+                return spark_bytes, fh.read()
+        finally:
+            os.unlink(path)
+            import shutil
+            shutil.rmtree(out_dir)
+
+    def test_write_matches_write_output(self):
+        spark_bytes, local_bytes = self._write_both()
+        self.assertEqual(spark_bytes, local_bytes)
+        self.assertIn(b'\t"""cd"" player', spark_bytes)
+        self.assertIn(b'\t"nano\tcase', spark_bytes)
+
+    def test_write_merges_several_parts(self):
+        conf = {"spark.sql.adaptive.enabled": "false", "spark.sql.shuffle.partitions": "4"}
+        before = {k: self.spark.conf.get(k) for k in conf}
+        for k, v in conf.items():
+            self.spark.conf.set(k, v)
+        try:
+            spark_bytes, local_bytes = self._write_both(top_k=5, min_revenue=3.0)
+        finally:
+            for k, v in before.items():
+                self.spark.conf.set(k, v)
+        self.assertEqual(spark_bytes, local_bytes)
+        self.assertEqual(spark_bytes.count(b"\r\n"), 16)
+
+    def test_write_with_cwd_relative_input(self):
+        import shutil
+        from src.spark_processor import SparkProcessor
+        path = self._make_tsv(self._report_rows())
+        work_dir = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        try:
+            shutil.move(path, os.path.join(work_dir, "hits.tsv"))
+            os.chdir(work_dir)
+            # report_path gives a bare name here, the parts must be staged next to it, not in "/"
+            output_path = SparkProcessor("hits.tsv").write("hits.tsv")
+            self.assertEqual(os.path.dirname(output_path), "")
+            self.assertEqual(sorted(os.listdir(work_dir)), sorted(["hits.tsv", output_path]))
+            self.assertFalse(os.path.exists(f"/_tmp_{output_path}"))
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(work_dir)
+
+    # ── native enrichment vs the UDF path ─────────────────────────────
+
+    def _enriched(self, rows: list[dict], enrich: str) -> list[tuple]:
+        from src.spark_processor import HIT_FIELDS, HIT_SCHEMA, SparkProcessor
+        data = [tuple(r.get(name) for name in HIT_FIELDS) for r in rows]
+        df = self.spark.createDataFrame(data, HIT_SCHEMA)
+        out = SparkProcessor("unused", enrich=enrich)._enrich(df)
+        return [tuple(r) for r in out.select("referrer", "se_domain", "se_keyword", "revenue").collect()]
+
+    def test_native_enrich_matches_udf(self):
+        from tests.test_all import TestReferrerPreFilter, TestRevenueParity
+        # the native path reads param names literally and leaves tab-mangled urls alone, like the vectorized one
+        referrers = [c for c in TestReferrerPreFilter.CASES if "%71" not in c and "\t" not in c] + [None]
+        pairs = [(p, e) for e in TestRevenueParity.EVENTS for p in TestRevenueParity.PRODUCTS
+                 if "_" not in (p or "") and "\n" not in (e or "")]
+        rows = [
+            {"referrer": referrers[i % len(referrers)], "product_list": p, "event_list": e}
+            for i, (p, e) in enumerate(pairs)
+        ]
+        self.assertEqual(self._enriched(rows, "native"), self._enriched(rows, "udf"))
+
+    def test_both_enrich_modes_on_sample_data(self):
+        sample = PROJECT_ROOT / "data" / "data.sql"
+        if not sample.exists():
+            self.skipTest(f"Sample file not found: {sample}")
+        from src.spark_processor import SparkProcessor
+        self.assertEqual(
+            SparkProcessor(str(sample), enrich="native").process(),
+            SparkProcessor(str(sample), enrich="udf").process(),
+        )
+
+    def test_unknown_enrich_mode(self):
+        from src.spark_processor import SparkProcessor
+        with self.assertRaises(ValueError):
+            SparkProcessor("unused", enrich="jit")
+
+    # ── pruning before the window ─────────────────────────────
+
+    def test_relevant_keeps_only_searches_and_purchases_of_buyers(self):
+        from src.spark_processor import SparkProcessor
+        path = self._make_tsv([
+            {"hit_time_gmt": "1", "ip": "1.1.1.1", "referrer": "http://www.google.com/search?q=ipod"},
+            {"hit_time_gmt": "2", "ip": "1.1.1.1", "pagename": "browse"},
+            {"hit_time_gmt": "3", "ip": "1.1.1.1", "event_list": "1", "product_list": "E;A;1;10;"},
+            {"hit_time_gmt": "4", "ip": "2.2.2.2", "referrer": "http://www.bing.com/search?q=zune"},
+            {"hit_time_gmt": "5", "ip": "2.2.2.2", "event_list": "2", "product_list": "E;A;1;10;"},
+        ])
+        try:
+            proc = SparkProcessor(path)
+            df = proc._relevant(proc._enrich(proc._prune(proc._read(self.spark))))
+            plan = df._jdf.queryExecution().executedPlan().toString()
+            rows = sorted(r["hit_time_gmt"] for r in df.collect())
+            proc._relevant_cache.unpersist()
+        finally:
+            os.unlink(path)
+        self.assertEqual(rows, [1, 3])
+        self.assertNotIn("user_agent", plan)
+
+    # ── grouped attribution vs the window ─────────────────────────────
+
+    def test_grouped_attribution_matches_window(self):
+        import random
+        from unittest import mock
+        from src import spark_processor
+        rng = random.Random(7)
+        searches = [
+            "http://www.google.com/search?q=ipod", "http://www.bing.com/search?q=zune",
+            "http://search.yahoo.com/search?p=cd+player", "http://www.esshopzilla.com/",
+        ]
+        times = rng.sample(range(0, 6 * 86_400), 400)
+        rows = []
+        for t in times:
+            row = {"hit_time_gmt": str(t), "ip": f"10.0.0.{rng.randrange(12)}"}
+            if rng.random() < 0.5:
+                row["referrer"] = rng.choice(searches)
+            if rng.random() < 0.4:
+                row["event_list"] = rng.choice(["1", "2,1", "2"])
+                row["product_list"] = f"E;p;1;{rng.randrange(1, 500)};"
+            rows.append(row)
+        rows.append({"ip": "10.0.0.1", "event_list": "1", "product_list": "E;p;1;5;"})
+
+        window = self._run(rows, attribution="window")
+        for bucket_seconds in (86_400, 1_000, 10 ** 9):
+            with self.subTest(bucket_seconds=bucket_seconds), \
+                    mock.patch.object(spark_processor, "SPARK_ATTRIBUTION_BUCKET_SECONDS", bucket_seconds):
+                self.assertEqual(self._run(rows, attribution="grouped"), window)
+
+    def test_bucket_functions_do_not_warn_without_searches(self):
+        import warnings
+        import pandas as pd
+        from src.spark_processor import _fold_bucket, _stitch_buckets
+        # an IP whose buckets hold no search: all-null domain / keyword columns
+        hits = pd.DataFrame({
+            "ip": "1.1.1.1", "bucket": 0, "hit_time_gmt": [1.0, 2.0], "se_domain": [None, None],
+            "se_keyword": [None, None], "is_purchase": [False, True], "revenue": [0.0, 5.0],
+        })
+        buckets = pd.DataFrame({
+            "ip": "1.1.1.1", "bucket": [0, 1], "kind": ["pending", "pending"], "domain": [None, None],
+            "keyword": [None, None], "time": [1.0, 2.0], "revenue": [1.0, 2.0],
+        })
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            for window in (0, 100):
+                folded = _fold_bucket(hits, window)
+                self.assertEqual(folded["kind"].tolist(), ["pending"])
+                self.assertTrue(_stitch_buckets(buckets, window).empty)
+
+    def test_grouped_attribution_on_sample_data(self):
+        sample = PROJECT_ROOT / "data" / "data.sql"
+        if not sample.exists():
+            self.skipTest(f"Sample file not found: {sample}")
+        from src.spark_processor import SparkProcessor
+        self.assertEqual(
+            SparkProcessor(str(sample), attribution="grouped").process(),
+            SparkProcessor(str(sample), attribution="window").process(),
+        )
+
+    def test_attribution_window_matches_chunked(self):
+        from tests.test_all import TestAttributionWindow
+        for attribution in ("window", "grouped"):
+            with self.subTest(attribution=attribution):
+                self.assertEqual(
+                    self._run(TestAttributionWindow.ROWS, attribution=attribution, attribution_window=100),
+                    TestAttributionWindow.EXPECTED,
+                )
+
+    def test_sorted_chunked_matches_window_on_unordered_input(self):
+        from src.processor import ChunkedProcessor
+        from tests.test_all import _random_hits
+        rows = _random_hits(300, 5)
+        path = self._make_tsv(rows)
+        try:
+            self.assertEqual(ChunkedProcessor(path, order="sort").process(), self._run(rows))
+        finally:
+            os.unlink(path)
+
+    @unittest.skipUnless(importlib.util.find_spec("pyarrow"), "pyarrow not installed")
+    def test_columnar_dataset_matches_raw_input(self):
+        from src import columnar
+        from src.spark_processor import SparkProcessor
+        from tests.test_all import _dataset_hits
+        tmp_dir = tempfile.mkdtemp()
+        raw = self._make_tsv(_dataset_hits(3))
+        dataset = os.path.join(tmp_dir, "hits")
+        try:
+            columnar.ingest(raw, dataset, row_group_rows=16)
+            for window in (0, 500):
+                with self.subTest(window=window):
+                    self.assertEqual(
+                        SparkProcessor(dataset, attribution_window=window).process(),
+                        SparkProcessor(raw, attribution_window=window).process(),
+                    )
+            output_path = SparkProcessor(dataset).write(dataset)
+            self.assertEqual(os.path.dirname(output_path), tmp_dir)
+        finally:
+            os.unlink(raw)
+            shutil.rmtree(tmp_dir)
+
+    def test_unknown_attribution_mode(self):
+        from src.spark_processor import SparkProcessor
+        with self.assertRaises(ValueError):
+            SparkProcessor("unused", attribution="sorted")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,191 @@
+from __future__ import annotations
+import importlib.util
+import os
+import random
+import shutil
+import sys
+import unittest
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from tests.test_all import _make_tsv
+
+PANDAS_AVAILABLE = importlib.util.find_spec("pandas") is not None
+
+
+@unittest.skipUnless(PANDAS_AVAILABLE, "pandas not installed — skipping vectorized tests")
+class TestVectorizedProcessor(unittest.TestCase):
+
+    def _run(self, rows: list[dict]) -> dict:
+        from src.vectorized_processor import VectorizedProcessor
+        path = _make_tsv(rows)
+        try:
+            return VectorizedProcessor(path).process()
+        finally:
+            os.unlink(path)
+
+    # ── test cases (same as the cases with TestChunkedProcessor) ─────────────────────────────
+
+    def test_basic_attribution(self):
+        result = self._run([
+            {"hit_time_gmt": "1000", "ip": "1.1.1.1",
+             "referrer": "http://www.google.com/search?q=Ipod"},
+            {"hit_time_gmt": "2000", "ip": "1.1.1.1",
+             "event_list": "1", "product_list": "E;Ipod;1;290;"},
+        ])
+        self.assertAlmostEqual(result[("google.com", "ipod")], 290.0)
+
+    def test_no_search_referrer_not_attributed(self):
+        result = self._run([
+            {"hit_time_gmt": "1000", "ip": "2.2.2.2",
+             "referrer": "http://www.esshopzilla.com/",
+             "event_list": "1", "product_list": "E;Ipod;1;290;"},
+        ])
+        self.assertEqual(len(result), 0)
+
+    def test_multiple_visitors_same_keyword_aggregated(self):
+        result = self._run([
+            {"ip": "3.3.3.3", "referrer": "http://www.google.com/search?q=Zune"},
+            {"ip": "3.3.3.3", "event_list": "1", "product_list": "E;Zune;1;100;"},
+            {"ip": "4.4.4.4", "referrer": "http://www.google.com/search?q=Zune"},
+            {"ip": "4.4.4.4", "event_list": "1", "product_list": "E;Zune;1;150;"},
+        ])
+        self.assertAlmostEqual(result[("google.com", "zune")], 250.0)
+
+    def test_last_touch_wins(self):
+        result = self._run([
+            {"ip": "5.5.5.5", "referrer": "http://www.google.com/search?q=headphones"},
+            {"ip": "5.5.5.5", "referrer": "http://www.bing.com/search?q=headphones"},
+            {"ip": "5.5.5.5", "event_list": "1", "product_list": "E;HP;1;199;"},
+        ])
+        self.assertIn(("bing.com", "headphones"), result)
+        self.assertNotIn(("google.com", "headphones"), result)
+
+    def test_processes_across_chunk_boundary(self):
+        from src import vectorized_processor as vp
+        original = vp.VECTORIZED_CHUNK_SIZE
+        vp.VECTORIZED_CHUNK_SIZE = 2
+        try:
+            result = self._run([
+                {"ip": "6.6.6.6", "referrer": "http://www.google.com/search?q=Nano"},
+                {"ip": "6.6.6.6"},
+                {"ip": "6.6.6.6", "event_list": "1", "product_list": "E;Nano;1;99;"},
+                {"ip": "7.7.7.7", "event_list": "1", "product_list": "E;Nano;1;5;"},
+            ])
+            self.assertEqual(result, {("google.com", "nano"): 99.0})
+        finally:
+            vp.VECTORIZED_CHUNK_SIZE = original
+
+    def test_referrer_parsing_matches_parse_referrer(self):
+        import pandas as pd
+        from src.parsers import parse_referrer
+        from src.vectorized_processor import VectorizedProcessor
+        from tests.test_all import TestReferrerPreFilter
+        # the vectorized path leaves tab-mangled urls alone; referrers are already stripped by
+        # the time they get here
+        cases = [c.strip() for c in TestReferrerPreFilter.CASES if "\t" not in c] + [
+            "http://www.google.com/search?%71=Encoded+Name",
+            "http://www.bing.com/search?a+b=1&q=plus%20name",
+            "http://www.google.com/search?%71=&q=second",
+        ]
+        frame = pd.DataFrame({"ip": "1", "referrer": cases, "event_list": "", "product_list": ""})
+        hits = VectorizedProcessor("unused")._enrich(frame)
+        for i, ref in enumerate(cases):
+            with self.subTest(ref=ref):
+                got = (hits["domain"][i], hits["keyword"][i]) if i in hits.index else (None, None)
+                self.assertEqual(got, parse_referrer(ref))
+
+    def test_matches_chunked_on_random_hits(self):
+        from src.processor import ChunkedProcessor
+        from src.vectorized_processor import VectorizedProcessor
+        rnd = random.Random(3)
+        refs = [
+            "http://www.google.com/search?q=Ipod", "http://www.bing.com/search?q=Zune",
+            "http://search.yahoo.com/search?p=cd+player", "http://www.esshopzilla.com/", "",
+        ]
+        rows = []
+        for _ in range(2000):
+            purchase = rnd.random() < 0.2
+            rows.append({
+                "ip": f"10.0.0.{rnd.randrange(40)}",
+                "referrer": rnd.choice(refs),
+                "event_list": "2,1" if purchase else "2",
+                "product_list": f"E;A;1;{rnd.randrange(1, 500)};" if purchase else "",
+            })
+        path = _make_tsv(rows)
+        try:
+            expected = ChunkedProcessor(path).process()
+            got = VectorizedProcessor(path).process()
+        finally:
+            os.unlink(path)
+        self.assertEqual(set(got), set(expected))
+        for key, revenue in expected.items():
+            self.assertAlmostEqual(got[key], revenue, places=6)
+
+    def test_attribution_window_matches_chunked(self):
+        from src import vectorized_processor as vp
+        from src.vectorized_processor import VectorizedProcessor
+        from tests.test_all import TestAttributionWindow
+        path = _make_tsv(TestAttributionWindow.ROWS)
+        original = vp.VECTORIZED_CHUNK_SIZE
+        try:
+            for chunk_size in (original, 3, 1):
+                vp.VECTORIZED_CHUNK_SIZE = chunk_size
+                with self.subTest(chunk_size=chunk_size):
+                    got = VectorizedProcessor(path, attribution_window=100).process()
+                    self.assertEqual(got, TestAttributionWindow.EXPECTED)
+        finally:
+            vp.VECTORIZED_CHUNK_SIZE = original
+            os.unlink(path)
+
+    def test_directory_input_matches_chunked(self):
+        from src.processor import ChunkedProcessor
+        from src.vectorized_processor import VectorizedProcessor
+        from tests.test_all import TestParallelProcessor, _make_hourly_dir
+        directory, single = _make_hourly_dir(TestParallelProcessor.ROWS * 3)
+        try:
+            expected = ChunkedProcessor(single).process()
+            got = VectorizedProcessor(directory).process()
+        finally:
+            shutil.rmtree(directory)
+            os.unlink(single)
+        self.assertEqual(set(got), set(expected))
+        for key, revenue in expected.items():
+            self.assertAlmostEqual(got[key], revenue, places=6)
+
+    def test_full_sample_data(self):
+        sample = PROJECT_ROOT / "data" / "data.sql"
+        if not sample.exists():
+            self.skipTest(f"Sample file not found: {sample}")
+        from src.vectorized_processor import VectorizedProcessor
+        result = VectorizedProcessor(str(sample)).process()
+        self.assertAlmostEqual(result.get(("google.com", "ipod"), 0), 480.0)
+        self.assertAlmostEqual(result.get(("bing.com",   "zune"), 0), 250.0)
+        self.assertNotIn(("yahoo.com", "cd player"), result)
+
+    def test_metrics(self):
+        from src.vectorized_processor import VectorizedProcessor
+        path = _make_tsv([
+            {"ip": "1.1.1.1", "referrer": "http://www.google.com/search?q=Ipod"},
+            {"ip": "1.1.1.1", "event_list": "1", "product_list": "E;Ipod;1;290;"},
+            {"ip": "2.2.2.2", "event_list": "1", "product_list": "E;Ipod;1;100;"},
+        ])
+        try:
+            processor = VectorizedProcessor(path)
+            processor.process()
+        finally:
+            os.unlink(path)
+        self.assertEqual(list(processor.metrics.stages), ["read", "enrich", "attribute", "aggregate"])
+        self.assertEqual(processor.metrics.counters["rows"], 3)
+        self.assertEqual(processor.metrics.counters["purchase_rows"], 1)
+
+    def test_file_not_found(self):
+        from src.vectorized_processor import VectorizedProcessor
+        with self.assertRaises(FileNotFoundError):
+            VectorizedProcessor("/nonexistent/file.tsv").process()
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)